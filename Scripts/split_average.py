@@ -24,13 +24,12 @@
 
 
 # -*- coding: utf-8 -*-
-import pickle
 import stdb
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.gridspec as gspec
 from math import ceil
-from splitpy import arguments, Split
+from splitpy import arguments, calc, store
 from pathlib import Path
 
 
@@ -85,145 +84,78 @@ def main():
         # Extract station information from dictionary
         sta = db[stkey]
 
-        split = Split(sta)
-
         # Results directory
         datapath = Path("DATA") / stkey
         if not datapath.is_dir():
             print('Path to ' + str(datapath) + ' doesn`t exist - continuing')
             continue
 
-        evs = [str(x) for x in datapath.iterdir() if x.is_dir()]
-        evs.sort()
-        ievs = range(0, len(evs))
-
-        # Initialize Storage
-        baz = []
-        baz_null = []
-        phiRC = []
-        DphiRC = []
-        dtRC = []
-        DdtRC = []
-        phiSC = []
-        DphiSC = []
-        dtSC = []
-        DdtSC = []
-        Qual = []
-        Null = []
-
-        print("  Processing {0:d} Events...".format(len(evs)))
-
-        # Loop over Pickle Files and read in required data
-        ic = 0
-        for iev in ievs:
-
-            # Event Name
-            evSTR = evs[iev]
-
-            # Event data
-            metafile = Path(evSTR) / "Meta_data.pkl"
-            meta = pickle.load(open(metafile, "rb"))
-            split.meta = meta
-
-            # Split results
-            if args.auto:
-                splitfile = Path(evSTR) / "split_results_auto.pkl"
-            else:
-                splitfile = Path(evSTR) / "split_results_manual.pkl"
-            if not splitfile.exists():
-                continue
-            file = open(splitfile, "rb")
-            split.SC_res = pickle.load(file)
-            split.RC_res = pickle.load(file)
-            split.null = pickle.load(file)
-            split.quality = pickle.load(file)
-            file.close()
-
-            # Determine whether to accept based on Null Value
-            Naccept = False
-            if args.nons and args.nulls:
-                Naccept = True
-            elif args.nons and not args.nulls:
-                if not split.null:
-                    Naccept = True
-            elif not args.nons and args.nulls:
-                if split.null:
-                    Naccept = True
-
-            # Determine whether to accept based on Quality Selected
-            Qaccept = False
-            QGaccept = False
-            QFaccept = False
-            QPaccept = False
-            if args.goods and split.quality == "Good":
-                QGaccept = True
-            if args.fairs and split.quality == "Fair":
-                QFaccept = True
-            if args.poors and split.quality == "Poor":
-                QPaccept = True
-            if QGaccept or QFaccept or QPaccept:
-                Qaccept = True
-
-            # Accept Event?
-            accept = False
-            if Qaccept and Naccept:
-
-                if args.verb:
-                    if split.null:
-                        print("      {0} {1} Null -> Retained".format(
-                            str(Path(evSTR).name), split.quality))
-                    else:
-                        print("      {0} {1} Non-Null -> Retained".format(
-                            str(Path(evSTR).name), split.quality))
-
-                # BAZ, null and quality
-                baz.append(split.meta.baz)
-                Qual.append(split.quality)
-                Null.append(split.null)
-
-                # RC Results
-                phiRC.append(split.RC_res.phi)
-                DphiRC.append(split.RC_res.ephi)
-                dtRC.append(split.RC_res.dtt)
-                DdtRC.append(split.RC_res.edtt)
-
-                # SC Results
-                phiSC.append(split.SC_res.phi)
-                DphiSC.append(split.SC_res.ephi)
-                dtSC.append(split.SC_res.dtt)
-                DdtSC.append(split.SC_res.edtt)
-
-                stlat = split.sta.latitude
-                stlon = split.sta.longitude
-                sta = split.sta.station
+        # Load table of results
+        if args.auto:
+            name = 'results_auto'
+        else:
+            name = 'results_manual'
+        table = store.ResultsTable(datapath, name)
+        if not table.exists():
+            print("  Building table of results...")
+            table.build(store.open_store(datapath))
+        res = table.load()
 
-            else:
+        print("  Processing {0:d} Events...".format(len(res)))
+
+        # Determine whether to accept based on Null Value
+        Naccept = (args.nons & ~res['null']) | (args.nulls & res['null'])
+
+        # Determine whether to accept based on Quality Selected
+        quals = [qual for qual, inc in zip(
+            [b'Good', b'Fair', b'Poor'],
+            [args.goods, args.fairs, args.poors]) if inc]
+        Qaccept = np.isin(res['quality'], quals)
+
+        # Accept Event?
+        accept = Qaccept & Naccept
+
+        if args.verb:
+            for row, acc in zip(res, accept):
+                print("      {0} {1} {2} -> {3}".format(
+                    row['key'].decode(), row['quality'].decode(),
+                    "Null" if row['null'] else "Non-Null",
+                    "Retained" if acc else "Skipped"))
+
+        res = res[accept]
+        if len(res) == 0:
+            continue
+
+        # BAZ
+        baz = res['baz']
+
+        # RC Results
+        phiRC = res['phiRC']
+        DphiRC = res['ephiRC']
+        dtRC = res['dtRC']
+        DdtRC = res['edtRC']
 
-                if args.verb:
-                    if split.null:
-                        print("      {0} {1} Null -> Skipped".format(
-                            str(Path(evSTR).name), split.quality))
-                    else:
-                        print("      {0} {1} Non-Null -> Skipped".format(
-                            str(Path(evSTR).name), split.quality))
+        # SC Results
+        phiSC = res['phiSC']
+        DphiSC = res['ephiSC']
+        dtSC = res['dtSC']
+        DdtSC = res['edtSC']
 
-        if not baz:
-            return
+        stlat = sta.latitude
+        stlon = sta.longitude
 
         # Gridspec for polar plot
         gs1 = gspec.GridSpec(1, 1)
         gs1.update(left=0.57, right=1.0, bottom=0.3, top=0.7)
 
-        baz = np.array([float(i) for i in baz])
-
         # Get Max DT value
         dtmax = ceil(max([max(dtRC), max(dtSC), 3]))
 
-        # Convert RC results to floats
-        phi = np.array([float(i) for i in phiRC])
-        Dphi = np.array([float(i) for i in DphiRC])
-        dt = np.array([float(i) for i in dtRC])
-        Ddt = np.array([float(i) for i in DdtRC])
+        # RC results
+        phi = phiRC
+        Dphi = DphiRC
+        dt = dtRC
+        Ddt = DdtRC
 
         # Calculate average and STD for RC technique
         meanphiRC, stdphiRC, meandtRC, stddtRC = angle_mean(dt, phi, Ddt, Dphi)
@@ -242,11 +174,11 @@ def main():
             ax1.plot(np.array([meanphiRC, meanphiRC])*np.pi /
                      180., [0, meandtRC], 'b', linewidth=2)
 
-        # Convert SC results to floats
-        phi = np.array([float(i) for i in phiSC])
-        Dphi = np.array([float(i) for i in DphiSC])
-        dt = np.array([float(i) for i in dtSC])
-        Ddt = np.array([float(i) for i in DdtSC])
+        # SC results
+        phi = phiSC
+        Dphi = DphiSC
+        dt = dtSC
+        Ddt = DdtSC
 
         # Calculate average and STD for SC technique
         meanphiSC, stdphiSC, meandtSC, stddtSC = angle_mean(dt, phi, Ddt, Dphi)
@@ -257,6 +189,29 @@ def main():
             ax1.plot(np.array([meanphiSC, meanphiSC])*np.pi /
                      180., [0, meandtSC], 'coral', linewidth=2)
 
+        # Stack of SC error surfaces
+        stacked = None
+        if args.stack:
+            cube = store.EmatCube(datapath, name)
+            if not cube.exists():
+                print("  Building cube of error surfaces...")
+                cube.build(store.open_store(datapath))
+            Emats = cube.load()
+            select = cube.select(Emats, res['key'])
+            if np.any(select):
+                Estack, phiST, dtST, DphiST, DdtST, errcST = \
+                    calc.split_stack(Emats['Emat'], Emats['errc'],
+                                     Emats['dof'], cube.ddt, cube.dphi,
+                                     select=select)
+                ax1.plot(phiST*np.pi/180., dtST, 'g*', markersize=12)
+                print("  Stack of {0:d} SC error surfaces:".format(
+                    np.sum(select)))
+                print("   PHI: {0:7.3f} d +- {1:.3f}".format(phiST, DphiST))
+                print("   DT:    {0:5.3f} s +- {1:.3f}".format(dtST, DdtST))
+                stacked = (phiST, DphiST, dtST, DdtST)
+            else:
+                print("  No SC error surfaces available for stacking")
+
         ax1.set_rmax(dtmax)
 
         # Gridspec for panels
@@ -268,8 +223,8 @@ def main():
 
         # Azimuth panel
 
-        phi = np.array([float(i) for i in phiRC])
-        Dphi = np.array([float(i) for i in DphiRC])
+        phi = phiRC
+        Dphi = DphiRC
 
         # Plot shaded box with RC uncertainty
         if args.RCinc:
@@ -281,8 +236,8 @@ def main():
             # Plot individual RC results
             ax2.errorbar(baz, phi, yerr=Dphi, fmt='o', c='b', label='RC')
 
-        phi = np.array([float(i) for i in phiSC])
-        Dphi = np.array([float(i) for i in DphiSC])
+        phi = phiSC
+        Dphi = DphiSC
 
         # Plot shaded box with SC uncertainty
         if args.SCinc:
@@ -301,8 +256,8 @@ def main():
 
         # Delay time panel
 
-        dt = np.array([float(i) for i in dtRC])
-        Ddt = np.array([float(i) for i in DdtRC])
+        dt = dtRC
+        Ddt = DdtRC
 
         # Plot shaded box with RC uncertainty
         if args.RCinc:
@@ -314,8 +269,8 @@ def main():
             # Plot individual RC results
             ax3.errorbar(baz, dt, yerr=Ddt, fmt='o', c='b', label='RC')
 
-        dt = np.array([float(i) for i in dtSC])
-        Ddt = np.array([float(i) for i in DdtSC])
+        dt = dtSC
+        Ddt = DdtSC
 
         # Plot shaded box with SC uncertainty
         if args.SCinc:
@@ -348,6 +303,8 @@ def main():
                              args.QualName + "_results.dat")
         outplot = plotdir / (stkey+args.TypeName + args.NullName +
                              args.QualName + "_results.png")
+        outstack = plotdir / (stkey + "_SC" + args.NullName +
+                              args.QualName + "_stack.dat")
 
         # Final estimates (average of SC and RC)
         if args.RCinc and args.SCinc:
@@ -397,12 +354,20 @@ def main():
                 stlon, stlat, PHI, dPHI, DT, dDT))
         fid.close()
 
+        # Write out stacked estimate
+        if stacked is not None:
+            with open(outstack, 'w') as fid:
+                fid.write(
+                    "{0:8.4f}  {1:7.4f}   {2:7.3f} {3:7.3f}   "
+                    "{4:5.3f} {5:5.3f}\n".format(stlon, stlat, *stacked))
+
         # Save Plot
         plt.savefig(outplot)
 
         # Display Plot
         if args.showfig:
             plt.show()
+        plt.close()
 
 
 if __name__ == "__main__":
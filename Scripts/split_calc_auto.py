@@ -23,18 +23,45 @@
 # SOFTWARE.
 
 # -*- coding: utf-8 -*-
+import copy
 from pathlib import Path
-from splitpy import arguments, utils
+from splitpy import arguments, utils, archive, cache, store, workqueue
+from splitpy import ttimes
 from splitpy import Split, DiagPlot
 import matplotlib.pyplot as plt
 import numpy as np
-import pickle
 import stdb
 from obspy.clients.fdsn import Client
 from obspy import UTCDateTime
 import matplotlib
 matplotlib.use('Qt5Agg')
 
+# Processing parameters recorded in the run journal of each station
+JOURNAL_PARAMS = [
+    'phase', 'mindist', 'maxdist', 'dts', 'new_sampling_rate', 'msnr',
+    'fmin', 'fmax', 'fused', 'prescreen', 'calc', 'recalc', 'maxdt',
+    'ddt', 'dphi', 'snrTlim', 'compact', 'keepEmat', 'cluster']
+
+# FDSN clients, created once per process
+_clients = {}
+
+
+def get_client(server=None, auth=[]):
+    """
+    Returns a (cached) FDSN client
+
+    """
+
+    key = (server, tuple(auth))
+    if key not in _clients:
+        if server is None:
+            _clients[key] = Client()
+        elif len(auth) == 0:
+            _clients[key] = Client(server)
+        else:
+            _clients[key] = Client(server, user=auth[0], password=auth[1])
+    return _clients[key]
+
 
 def main():
 
@@ -44,6 +71,9 @@ def main():
     # Load Database
     db = stdb.io.load_db(fname=args.indb)
 
+    # Processing parameters recorded in the run journal of each station
+    jparams = {name: getattr(args, name) for name in JOURNAL_PARAMS}
+
     # Construct station key loop
     allkeys = db.keys()
     sorted(allkeys)
@@ -57,305 +87,609 @@ def main():
         stkeys = db.keys()
         sorted(stkeys)
 
+    # Waveform cache
+    wfcache = None
+    if args.wfcache is not None:
+        wfcache = cache.WaveformCache(
+            args.wfcache, maxsize=args.wfcachesize*1.e6)
+
+    # Update persistent index of local data
+    lclindex = None
+    if args.lclindex is not None and len(args.localdata) > 0 and \
+            args.lclfmt == 'SAC':
+        lclindex = archive.ArchiveIndex(args.lclindex)
+        nscan = lclindex.update(args.localdata)
+        print("* Local data index: {0:d} files ({1:d} directories scanned)".format(
+            len(lclindex), nscan))
+
     # Loop over station keys
+    if args.queue is not None:
+        run_queue(args, db, stkeys, jparams, wfcache=wfcache,
+                  lclindex=lclindex)
+        return
+
     for stkey in list(stkeys):
 
         # Extract station information from dictionary
         sta = db[stkey]
 
-        # Output directory
-        datapath = Path('DATA') / stkey
-        if not datapath.is_dir():
-            datapath.mkdir(parents=True)
+        process_station(args, stkey, sta, Path('DATA') / stkey, jparams,
+                        wfcache=wfcache, lclindex=lclindex)
 
-        # Establish client
-        if len(args.UserAuth) == 0:
-            data_client = Client(args.Server)
-        else:
-            data_client = Client(
-                args.Server, user=args.UserAuth[0], password=args.UserAuth[1])
 
-        # Establish client for events
-        event_client = Client()
+def run_queue(args, db, stkeys, jparams, wfcache=None, lclindex=None):
+    """
+    Adds the stations to the work queue and processes tasks until all
+    tasks of the queue are completed. Each task processes a time range of
+    a station in a partial station directory (specific to the lease on
+    the task), and a final task per station merges the partial directories
+    of the completed leases into the station directory.
+
+    With ``--submit``, the stations are instead submitted as jobs (see
+    :func:`~splitpy.workqueue.submit_job`) with the processing parameters
+    of the command line. With ``--daemon``, the queue is used as a spool
+    directory: jobs are processed as they arrive, with the station
+    database, travel-time tables and clients kept in memory, and the index
+    of local data updated at the start of each job.
+
+    """
 
-        # Get catalogue search start time
+    wq = workqueue.WorkQueue(args.queue, lease=args.lease)
+
+    if args.submit:
+        for stkey in list(stkeys):
+            name = workqueue.submit_job(
+                args.queue, stkey, start=args.startT, end=args.endT,
+                args=jparams)
+            print("* Submitted job " + name)
+        return
+
+    # Add tasks (tasks already in the queue are kept)
+    for stkey in ([] if args.daemon else list(stkeys)):
+        sta = db[stkey]
+        tstart = sta.startdate if args.startT is None else args.startT
+        tend = sta.enddate if args.endT is None else args.endT
+        bounds = [tstart]
+        if args.chunk is not None:
+            while bounds[-1] + args.chunk*86400. < tend:
+                bounds.append(bounds[-1] + args.chunk*86400.)
+        bounds.append(tend)
+
+        parts = []
+        for t1, t2 in zip(bounds[:-1], bounds[1:]):
+            name = stkey + '_' + t1.strftime("%Y%m%dT%H%M%S")
+            wq.add(name, {'station': stkey, 'start': str(t1),
+                          'end': str(t2)})
+            parts.append(name)
+        wq.add(stkey + '_merge', {'station': stkey, 'merge': parts},
+               after=parts)
+
+    def process_task(lease):
+
+        task = lease.task
+        stkey = task['station']
+        if stkey not in db:
+            raise KeyError("Station not in database: " + stkey)
+        datapath = Path('DATA') / stkey
+        if 'merge' in task:
+            parts = ['{0}.{1:d}'.format(part, wq.result(part)['generation'])
+                     for part in task['merge']]
+            nitem = store.merge_parts(
+                datapath, [datapath / 'parts' / part for part in parts])
+            print("* Merged {0:d} items into {1}".format(nitem, datapath))
+            return
+
+        # Parameters of a submitted job
+        targs = args
+        tparams = jparams
+        if len(task.get('args', {})) > 0:
+            targs = copy.copy(args)
+            for name, value in task['args'].items():
+                if not hasattr(targs, name):
+                    raise ValueError("Unknown parameter: " + name)
+                setattr(targs, name, value)
+            tparams = {name: getattr(targs, name) for name in JOURNAL_PARAMS}
+
+        # Local data may have been added since the last job
+        if lclindex is not None:
+            lclindex.update(targs.localdata)
+
+        # Events completed in the station directory are skipped
+        partpath = datapath / 'parts' / '{0}.{1:d}'.format(
+            lease.name, lease.generation)
+        journal = None
+        if targs.journal:
+            journal = store.RunJournal(partpath, tparams)
+            for key, status in store.RunJournal(
+                    datapath, tparams).status.items():
+                journal.status.setdefault(key, status)
+
+        tstart, tend = [None if task.get(name) is None else
+                        UTCDateTime(task[name]) for name in ['start', 'end']]
+        process_station(targs, stkey, db[stkey], partpath, tparams,
+                        wfcache=wfcache, lclindex=lclindex, tstart=tstart,
+                        tend=tend, journal=journal)
+
+    if args.daemon:
+        # Warm up before the first job
+        for phase in args.phase.split(','):
+            ttimes.get_table(phase)
+        get_client(args.Server, args.UserAuth)
+        get_client()
+        print("* Waiting for jobs in " + str(wq.path / 'tasks'))
+
+    ndone = wq.run(process_task, poll=args.poll, verbose=args.verb,
+                   forever=args.daemon)
+    print("* Completed {0:d} tasks of work queue {1}".format(
+        ndone, args.queue))
+
+
+def process_station(args, stkey, sta, datapath, jparams, wfcache=None,
+                    lclindex=None, tstart=None, tend=None, journal=None):
+    """
+    Processes the events of a station and saves the data and results in
+    the station directory
+
+    Parameters
+    ----------
+    args : :class:`~argparse.Namespace`
+        Command-line arguments
+    stkey : str
+        Station key
+    sta : :class:`~stdb.StDbElement`
+        Station metadata
+    datapath : :class:`~pathlib.Path`
+        Station directory
+    jparams : Dict
+        Processing parameters recorded in the run journal
+    wfcache : :class:`~splitpy.cache.WaveformCache`
+        Waveform cache (optional)
+    lclindex : :class:`~splitpy.archive.ArchiveIndex`
+        Index of local data (optional)
+    tstart : :class:`~obspy.core.UTCDateTime`
+        Start time of catalogue search (overrides the arguments)
+    tend : :class:`~obspy.core.UTCDateTime`
+        End time of catalogue search (overrides the arguments)
+    journal : :class:`~splitpy.store.RunJournal`
+        Run journal (by default, the journal of the station directory)
+
+    """
+
+
+    # Output directory
+    datapath = Path(datapath)
+    if not datapath.is_dir():
+        datapath.mkdir(parents=True)
+    ststore = store.open_store(datapath)
+    if args.journal and journal is None:
+        journal = store.RunJournal(datapath, jparams)
+
+    # Establish client
+    data_client = get_client(args.Server, args.UserAuth)
+
+    # Establish client for events
+    event_client = get_client()
+
+    # Get catalogue search start time
+    if tstart is None:
         if args.startT is None:
             tstart = sta.startdate
         else:
             tstart = args.startT
 
-        # Get catalogue search end time
+    # Get catalogue search end time
+    if tend is None:
         if args.endT is None:
             tend = sta.enddate
         else:
             tend = args.endT
-        if tstart > sta.enddate or tend < sta.startdate:
-            continue
-
-        # Temporary print locations
-        tlocs = sta.location
-        if len(tlocs) == 0:
-            tlocs = ['']
-        for il in range(0, len(tlocs)):
-            if len(tlocs[il]) == 0:
-                tlocs[il] = "--"
-        sta.location = tlocs
-
-        # Update Display
-        print(" ")
-        print(" ")
-        print("|"+"="*50+"|")
-        print("|                   {0:>8s}                       |".format(
-            sta.station))
-        print("|"+"="*50+"|")
-        print("|  Station: {0:>2s}.{1:5s}                               |".format(
-            sta.network, sta.station))
-        print("|      Channel: {0:2s}; Locations: {1:15s}     |".format(
-            sta.channel, ",".join(tlocs)))
-        print("|      Lon: {0:7.2f}; Lat: {1:6.2f}                   |".format(
-            sta.longitude, sta.latitude))
-        print("|      Start time: {0:19s}             |".format(
-            sta.startdate.strftime("%Y-%m-%d %H:%M:%S")))
-        print("|      End time:   {0:19s}             |".format(
-            sta.enddate.strftime("%Y-%m-%d %H:%M:%S")))
+    if tstart > sta.enddate or tend < sta.startdate:
+        return
+
+    # Temporary print locations
+    tlocs = sta.location
+    if len(tlocs) == 0:
+        tlocs = ['']
+    for il in range(0, len(tlocs)):
+        if len(tlocs[il]) == 0:
+            tlocs[il] = "--"
+    sta.location = tlocs
+
+    # Update Display
+    print(" ")
+    print(" ")
+    print("|"+"="*50+"|")
+    print("|                   {0:>8s}                       |".format(
+        sta.station))
+    print("|"+"="*50+"|")
+    print("|  Station: {0:>2s}.{1:5s}                               |".format(
+        sta.network, sta.station))
+    print("|      Channel: {0:2s}; Locations: {1:15s}     |".format(
+        sta.channel, ",".join(tlocs)))
+    print("|      Lon: {0:7.2f}; Lat: {1:6.2f}                   |".format(
+        sta.longitude, sta.latitude))
+    print("|      Start time: {0:19s}             |".format(
+        sta.startdate.strftime("%Y-%m-%d %H:%M:%S")))
+    print("|      End time:   {0:19s}             |".format(
+        sta.enddate.strftime("%Y-%m-%d %H:%M:%S")))
+    print("|"+"-"*50+"|")
+    print("| Searching Possible events:                       |")
+    print("|   Start: {0:19s}                     |".format(
+        tstart.strftime("%Y-%m-%d %H:%M:%S")))
+    print("|   End:   {0:19s}                     |".format(
+        tend.strftime("%Y-%m-%d %H:%M:%S")))
+    if args.maxmag is None:
+        print("|   Mag:   >{0:3.1f}", format(args.minmag) +
+              "                           |")
+    else:
+        msg = "|   Mag:   {0:3.1f}".format(args.minmag) + \
+            " - {0:3.1f}".format(args.maxmag) + \
+            "                           |"
+        print(msg)
+
+    print("| ...                                              |")
+
+    # Get catalogue using deployment start and end
+    cat = event_client.get_events(
+        starttime=tstart, endtime=tend,
+        minmagnitude=args.minmag, maxmagnitude=args.maxmag)
+
+    # Total number of events in Catalogue
+    nevK = 0
+    nevtT = len(cat)
+    print(
+        "|  Found {0:5d}".format(nevtT) +
+        " possible events                     |")
+    ievs = range(0, nevtT)
+
+    # Get Local Data Availabilty
+    if len(args.localdata) > 0 and args.lclfmt == 'SDS':
+        stalcllist = archive.SDSReader(args.localdata, sta)
+        print("|"+"-"*50+"|")
+        print("| Cataloging Local Data...                         |")
+        print("|   {0:>2s}.{1:5s}: {2:6d} SDS volumes           ".format(
+            sta.network, sta.station, len(stalcllist)) +
+            "        |")
+    elif len(args.localdata) > 0:
         print("|"+"-"*50+"|")
-        print("| Searching Possible events:                       |")
-        print("|   Start: {0:19s}                     |".format(
-            tstart.strftime("%Y-%m-%d %H:%M:%S")))
-        print("|   End:   {0:19s}                     |".format(
-            tend.strftime("%Y-%m-%d %H:%M:%S")))
-        if args.maxmag is None:
-            print("|   Mag:   >{0:3.1f}", format(args.minmag) +
-                  "                           |")
+        print("| Cataloging Local Data...                         |")
+        if args.useNet:
+            stalcllist = utils.list_local_data_stn(
+                lcldrs=args.localdata, sta=sta.station,
+                net=sta.network, altnet=sta.altnet, index=lclindex)
+            print("|   {0:>2s}.{1:5s}: {2:6d} files              " +
+                  "        |".format(
+                      sta.network, sta.station, len(stalcllist)))
         else:
-            msg = "|   Mag:   {0:3.1f}".format(args.minmag) + \
-                " - {0:3.1f}".format(args.maxmag) + \
-                "                           |"
-            print(msg)
-
-        print("| ...                                              |")
-
-        # Get catalogue using deployment start and end
-        cat = event_client.get_events(
-            starttime=tstart, endtime=tend,
-            minmagnitude=args.minmag, maxmagnitude=args.maxmag)
+            stalcllist = utils.list_local_data_stn(
+                lcldrs=args.localdata, sta=sta.station, index=lclindex)
+            print("|   {0:5s}: {1:6d} files                      " +
+                  "   |".format(
+                      sta.station, len(stalcllist)))
+    else:
+        stalcllist = []
+    print("|"+"="*50+"|")
 
-        # Total number of events in Catalogue
-        nevK = 0
-        nevtT = len(cat)
-        print(
-            "|  Found {0:5d}".format(nevtT) +
-            " possible events                     |")
+    # Select order of processing
+    if args.reverse:
         ievs = range(0, nevtT)
+    else:
+        ievs = range(nevtT-1, -1, -1)
+
+    # Pre-select events within the distance annulus
+    keep, gac, az, baz = utils.prefilter_events(
+        cat, sta, gacmin=args.mindist, gacmax=args.maxdist)
+    ievs = [iev for iev in ievs if keep[iev]]
+    print(
+        "|  Retained {0:5d}".format(len(ievs)) +
+        " events within distance range     |")
+    print("|"+"="*50+"|")
+
+    # Add events to Split objects
+    splits = []
+    nskip = 0
+    phase_list = args.phase.split(',')
+    for iev in ievs:
+
+        # Skip events completed in a previous run (journal keys of
+        # additional phases have the phase as suffix)
+        timekey = cat[iev].origins[0].time.strftime("%Y%m%d_%H%M%S")
+        jkeys = [timekey] + [timekey + '_' + phase
+                             for phase in phase_list[1:]]
+        if journal is not None and not args.ovr and \
+                all([journal.done(jkey) for jkey in jkeys]):
+            nskip += 1
+            continue
 
-        # Get Local Data Availabilty
-        if len(args.localdata) > 0:
-            print("|"+"-"*50+"|")
-            print("| Cataloging Local Data...                         |")
-            if args.useNet:
-                stalcllist = utils.list_local_data_stn(
-                    lcldrs=args.localdata, sta=sta.station,
-                    net=sta.network, altnet=sta.altnet)
-                print("|   {0:>2s}.{1:5s}: {2:6d} files              " +
-                      "        |".format(
-                          sta.network, sta.station, len(stalcllist)))
-            else:
-                stalcllist = utils.list_local_data_stn(
-                    lcldrs=args.localdata, sta=sta.station)
-                print("|   {0:5s}: {1:6d} files                      " +
-                      "   |".format(
-                          sta.station, len(stalcllist)))
-        else:
-            stalcllist = []
+        # Initialize Split object with station info
+        split = Split(sta)
+
+        # Add event to split object
+        accept = split.add_event(
+            cat[iev], gacmin=args.mindist, gacmax=args.maxdist,
+            phase=phase_list, returned=True)
+        if accept:
+            splits.append((iev, split))
+        if journal is not None:
+            for phase, jkey in zip(phase_list, jkeys):
+                if not accept or split.meta.phases[phase] is None:
+                    journal.record(jkey, 'rejected/geometry')
+
+    if journal is not None:
+        print(
+            "|  Skipped  {0:5d}".format(nskip) +
+            " events completed in journal      |")
         print("|"+"="*50+"|")
 
-        # Select order of processing
-        if args.reverse:
-            ievs = range(0, nevtT)
+    # Plan reads of local day files for all events
+    if len(stalcllist) > 0 and args.lclfmt == 'SAC':
+        windows = {}
+        for iev, split in splits:
+            times = [arrival['ttime'] for arrival in
+                     split.meta.phases.values() if arrival is not None]
+            windows[iev] = (split.meta.time + min(times) - args.dts,
+                            split.meta.time + max(times) + args.dts)
+        if args.lclmmap:
+            stalcllist = archive.MappedSACReader(stalcllist, sta)
         else:
-            ievs = range(nevtT-1, -1, -1)
-
-        # Read through catalogue
-        for iev in ievs:
-
-            # Extract event
-            ev = cat[iev]
-
-            # Initialize Split object with station info
-            split = Split(sta)
+            stalcllist = archive.DayFilePlanner(
+                stalcllist, sta, windows=windows.values())
 
-            # Add event to split object
-            accept = split.add_event(
-                ev, gacmin=args.mindist, gacmax=args.maxdist,
-                phase=args.phase, returned=True)
+    # Events rejected by the SNR pre-screen
+    nprescreen = 0
+    if args.prescreen is not None:
+        prescreen = args.msnr - args.prescreen
+    else:
+        prescreen = None
 
-            # Define time stamp
-            yr = str(split.meta.time.year).zfill(4)
-            jd = str(split.meta.time.julday).zfill(3)
-            hr = str(split.meta.time.hour).zfill(2)
+    # Read through accepted events
+    for iev, split in splits:
 
-            # If event is accepted (data exists)
-            if accept:
+        # Define time stamp
+        yr = str(split.meta.time.year).zfill(4)
+        jd = str(split.meta.time.julday).zfill(3)
+        hr = str(split.meta.time.hour).zfill(2)
 
-                # Display Event Info
-                nevK = nevK + 1
-                if args.reverse:
-                    inum = iev + 1
-                else:
-                    inum = nevtT - iev + 1
-                print(" ")
-                print("|"+"*"*50+"|")
-                print("* #{0:d} ({1:d}/{2:d}):  {3:13s} {4}".format(
-                    nevK, inum, nevtT, split.meta.time.strftime(
-                        "%Y%m%d_%H%M%S"), stkey))
-                if args.verb:
-                    print("*   Phase: {}".format(args.phase))
-                    print("*   Origin Time: " +
-                          split.meta.time.strftime("%Y-%m-%d %H:%M:%S"))
-                    print(
-                        "*   Lat: {0:6.2f};        Lon: {1:7.2f}".format(
-                            split.meta.lat, split.meta.lon))
-                    print(
-                        "*   Dep: {0:6.2f} km;     Mag: {1:3.1f}".format(
-                            split.meta.dep, split.meta.mag))
-                    print("*   Dist: {0:7.2f} km;".format(split.meta.epi_dist) +
-                          "   Epi dist: {0:6.2f} deg\n".format(split.meta.gac) +
-                          "*   Baz:  {0:6.2f} deg;".format(split.meta.baz) +
-                          "   Az: {0:6.2f} deg".format(split.meta.az))
-
-                # Event Folder
-                timekey = split.meta.time.strftime("%Y%m%d_%H%M%S")
-                datadir = datapath / timekey
-                ZNEfile = datadir / 'ZNE_data.pkl'
-                LQTfile = datadir / 'LQT_data.pkl'
-                metafile = datadir / 'Meta_data.pkl'
-                stafile = datadir / 'Station_data.pkl'
-                splitfile = datadir / 'Split_results_auto.pkl'
-
-                # Check if RF data already exist and overwrite has been set
-                if datadir.exists():
-                    if splitfile.exists():
-                        if not args.ovr:
-                            continue
-
-                if args.recalc:
-                    if np.sum([file.exists() for file in
-                               [ZNEfile, metafile, stafile]]) < 3:
-                        continue
-                    sta = pickle.load(open(stafile, "rb"))
-                    split = Split(sta)
-                    meta = pickle.load(open(metafile, "rb"))
-                    split.meta = meta
-                    dataZNE = pickle.load(open(ZNEfile, "rb"))
-                    split.dataZNE = dataZNE
-
-                    # Rotate from ZNE to 'LQT'
-                    split.rotate(align='LQT')
-
-                    # Filter rotated traces
-                    split.dataLQT.filter('bandpass', freqmin=args.fmin,
-                                         freqmax=args.fmax)
-                    
-                    # Calculate snr over dt_snr seconds
-                    split.calc_snr()
-
-                    # Save LQT Traces
-                    pickle.dump(split.dataLQT, open(LQTfile, "wb"))
+        # Display Event Info
+        nevK = nevK + 1
+        if args.reverse:
+            inum = iev + 1
+        else:
+            inum = nevtT - iev + 1
+        print(" ")
+        print("|"+"*"*50+"|")
+        print("* #{0:d} ({1:d}/{2:d}):  {3:13s} {4}".format(
+            nevK, inum, nevtT, split.meta.time.strftime(
+                "%Y%m%d_%H%M%S"), stkey))
+        if args.verb:
+            print("*   Phase: {}".format(args.phase))
+            print("*   Origin Time: " +
+                  split.meta.time.strftime("%Y-%m-%d %H:%M:%S"))
+            print(
+                "*   Lat: {0:6.2f};        Lon: {1:7.2f}".format(
+                    split.meta.lat, split.meta.lon))
+            print(
+                "*   Dep: {0:6.2f} km;     Mag: {1:3.1f}".format(
+                    split.meta.dep, split.meta.mag))
+            print("*   Dist: {0:7.2f} km;".format(split.meta.epi_dist) +
+                  "   Epi dist: {0:6.2f} deg\n".format(split.meta.gac) +
+                  "*   Baz:  {0:6.2f} deg;".format(split.meta.baz) +
+                  "   Az: {0:6.2f} deg".format(split.meta.az))
+
+        # Event key
+        timekey = split.meta.time.strftime("%Y%m%d_%H%M%S")
+
+        if args.recalc:
+            # Phases with event meta data saved by a previous run
+            saved = {}
+            for phase in phase_list:
+                name = split.item_name('meta', phase)
+                if ststore.has(timekey, name):
+                    saved[phase] = name
+            if len(saved) == 0 or not all([
+                    ststore.has(timekey, name) for name in
+                    ['ZNE', 'station']]):
+                if isinstance(stalcllist, archive.DayFilePlanner):
+                    stalcllist.release(*windows.pop(iev))
+                continue
+            sta = ststore.get(timekey, 'station')
+            split = Split(sta)
+            meta = ststore.get(timekey, list(saved.values())[0])
+            split.meta = meta
+            split.attach(ststore, timekey)
+
+        # Phases left to analyze, unless results already exist and
+        # overwrite has not been set
+        phases = []
+        for phase, arrival in getattr(
+                split.meta, 'phases', {split.meta.phase: True}).items():
+            if arrival is None or (args.recalc and phase not in saved):
+                continue
+            if not args.ovr and (
+                    ststore.has(timekey, split.item_name('results_auto', phase))
+                    or (journal is not None and
+                        journal.done(split.item_name(timekey, phase)))):
+                continue
+            phases.append(phase)
+
+        # Resume from the data saved before an interruption
+        resumed = not args.recalc and journal is not None and \
+            not args.ovr and all([
+                journal.get(split.item_name(timekey, phase)) in
+                ['downloaded', 'analyzed'] and
+                ststore.has(timekey, split.item_name('LQT', phase))
+                for phase in phases])
+
+        # Release the day files planned for events not retrieved
+        if isinstance(stalcllist, archive.DayFilePlanner) and \
+                (len(phases) == 0 or resumed or args.recalc):
+            stalcllist.release(*windows.pop(iev))
+        if len(phases) == 0:
+            continue
 
+        if resumed:
+            split.attach(ststore, timekey)
+
+        elif not args.recalc:
+
+            # Get data, once for all phases
+            has_data = split.download_data(
+                client=data_client, dts=args.dts, stdata=stalcllist,
+                ndval=args.ndval, new_sr=args.new_sampling_rate,
+                returned=True, verbose=args.verb, cache=wfcache,
+                bandpass=(args.fmin, args.fmax) if args.fused else None,
+                prescreen=prescreen)
+
+            if not has_data:
+                if split.meta.snr_pre is not None and \
+                        split.meta.snr_pre < prescreen:
+                    nprescreen += 1
+                    if args.verb:
+                        print("* Pre-screen SNR {0:.1f} < {1:.1f},".format(
+                            split.meta.snr_pre, prescreen) + " continuing")
+                        print("*"*50)
+                    if journal is not None:
+                        for phase in phases:
+                            journal.record(split.item_name(timekey, phase),
+                                           'rejected/SNR',
+                                           snr_pre=split.meta.snr_pre)
+                continue
+
+        # Analyze each phase in turn from the same ZNE data
+        savezne = True
+        for phase in phases:
+
+            split.select_phase(phase)
+            jkey = split.item_name(timekey)
+            if args.verb and len(phases) > 1:
+                print("*   Phase: {}".format(phase))
+
+            if args.recalc or not (resumed or split.meta.rotated):
+                # Rotate from ZNE to 'LQT'
+                split.rotate(align='LQT')
+
+                # Filter rotated traces
+                split.dataLQT.filter('bandpass', freqmin=args.fmin,
+                                     freqmax=args.fmax)
+
+            # Calculate snr over dt_snr seconds
+            split.calc_snr()
+
+            if args.recalc:
+
+                # Save LQT Traces
+                ststore.put(timekey, split.item_name('LQT'), split.dataLQT)
+
+            elif not resumed:
+
+                # If SNR lower than user-specified threshold, continue
+                if split.meta.snrq < args.msnr:
+                    if args.verb:
+                        print(
+                            "* SNRQ < {0:.1f}, continuing".format(args.msnr))
+                        print("*"*50)
+                    if journal is not None:
+                        journal.record(jkey, 'rejected/SNR',
+                                       snrq=float(split.meta.snrq))
+                    continue
+
+                # Make sure no processing happens for NaNs
+                if np.isnan(split.meta.snrq):
+                    if args.verb:
+                        print("* SNR NaN, continuing")
+                        print("*"*50)
+                    if journal is not None:
+                        journal.record(jkey, 'rejected/SNR')
+                    continue
+
+                # Save ZNE Traces
+                if savezne:
+                    ststore.put(timekey, 'ZNE', split.dataZNE)
+                    savezne = False
+
+                # Save LQT Traces
+                ststore.put(timekey, split.item_name('LQT'), split.dataLQT)
+
+                if journal is not None:
+                    ststore.sync()
+                    journal.record(jkey, 'downloaded')
+
+            if args.verb:
+                print("* SNRQ: {}".format(split.meta.snrq))
+                print("* SNRT: {}".format(split.meta.snrt))
+
+            if args.calc or args.recalc:
+
+                # Analyze
+                if args.cluster:
+                    split.cluster_analysis(verbose=args.verb)
                 else:
-
-                    # Get data
-                    has_data = split.download_data(
-                        client=data_client, dts=args.dts, stdata=stalcllist,
-                        ndval=args.ndval, new_sr=args.new_sampling_rate,
-                        returned=True, verbose=args.verb)
-
-                    if not has_data:
-                        continue
-
-                    # Rotate from ZNE to 'LQT'
-                    split.rotate(align='LQT')
-
-                    # Filter rotated traces
-                    split.dataLQT.filter('bandpass', freqmin=args.fmin,
-                                         freqmax=args.fmax)
-
-                    # Calculate snr over dt_snr seconds
-                    split.calc_snr()
-
-                    # If SNR lower than user-specified threshold, continue
-                    if split.meta.snrq < args.msnr:
-                        if args.verb:
-                            print(
-                                "* SNRQ < {0:.1f}, continuing".format(args.msnr))
-                            print("*"*50)
-                        continue
-
-                    # Make sure no processing happens for NaNs
-                    if np.isnan(split.meta.snrq):
-                        if args.verb:
-                            print("* SNR NaN, continuing")
-                            print("*"*50)
-                        continue
-
-                    # Create Folder if it doesn't exist
-                    if not datadir.exists():
-                        datadir.mkdir(parents=True)
-
-                    # Save ZNE Traces
-                    pickle.dump(split.dataZNE, open(ZNEfile, "wb"))
-
-                    # Save LQT Traces
-                    pickle.dump(split.dataLQT, open(LQTfile, "wb"))
-
-                if args.verb:
-                    print("* SNRQ: {}".format(split.meta.snrq))
-                    print("* SNRT: {}".format(split.meta.snrt))
-
-                if args.calc or args.recalc:
-
-                    # Analyze
                     split.analyze(verbose=args.verb)
 
-                    # Continue if problem with analysis
-                    if split.RC_res.edtt is None or split.SC_res.edtt is None:
-                        if args.verb:
-                            print("* !!! DOF Error. --> Skipping...")
-                            print("*"*50)
-                        continue
-
-                    # Determine if Null and Quality of estimate
-                    split.is_null(args.snrTlim, verbose=args.verb)
-                    split.get_quality(verbose=args.verb)
-
-                # Display results
-                if args.verb:
-                    split.display_meta()
-                    if args.calc or args.recalc:
-                        split.display_results()
-                        split.display_null_quality()
-
-                # Save event meta data
-                pickle.dump(split.meta, open(metafile, "wb"))
-
-                # Save Station Data
-                pickle.dump(split.sta, open(stafile, "wb"))
-
+                # Continue if problem with analysis
+                if split.RC_res.edtt is None or split.SC_res.edtt is None:
+                    if args.verb:
+                        print("* !!! DOF Error. --> Skipping...")
+                        print("*"*50)
+                    if journal is not None:
+                        journal.record(jkey, 'rejected/analysis')
+                    continue
+
+                # Determine if Null and Quality of estimate
+                split.is_null(args.snrTlim, verbose=args.verb)
+                split.get_quality(verbose=args.verb)
+
+                if journal is not None:
+                    journal.record(jkey, 'analyzed')
+
+            # Display results
+            if args.verb:
+                split.display_meta()
                 if args.calc or args.recalc:
-                    # Save Split Data
-                    file = open(splitfile, "wb")
-                    pickle.dump(split.SC_res, file)
-                    pickle.dump(split.RC_res, file)
-                    pickle.dump(split.null, file)
-                    pickle.dump(split.quality, file)
-                    file.close()
-
-                    # Initialize diagnostic figure and plot it
-                    if args.diagplot:
-                        dplot = DiagPlot(split)
-                        dplot.plot_diagnostic()
-                        plt.figure(dplot.axes[0].number)
-                        plt.show()
+                    split.display_results()
+                    split.display_null_quality()
+
+            # Save event meta data
+            ststore.put(timekey, split.item_name('meta'), split.meta)
+
+            # Save Station Data
+            ststore.put(timekey, 'station', split.sta)
+
+            if args.calc or args.recalc:
+                # Save Split Data
+                results = {'SC_res': split.SC_res, 'RC_res': split.RC_res,
+                           'null': split.null, 'quality': split.quality}
+                if args.compact:
+                    results['SC_res'] = split.SC_res.compact(
+                        'SC', keep_Emat=args.keepEmat)
+                    results['RC_res'] = split.RC_res.compact(
+                        'RC', keep_Emat=args.keepEmat)
+                name = split.item_name('results_auto')
+                ststore.put(timekey, name, results)
+                store.ResultsTable(datapath, name).append(
+                    timekey, split.meta, results, store=ststore)
+                store.EmatCube(datapath, name).append(
+                    timekey, split.meta, results, store=ststore)
+
+            if journal is not None:
+                ststore.sync()
+                journal.record(jkey, 'saved')
+
+            if args.calc or args.recalc:
+
+                # Initialize diagnostic figure and plot it
+                if args.diagplot:
+                    dplot = DiagPlot(split)
+                    dplot.plot_diagnostic()
+                    plt.figure(dplot.axes[0].number)
+                    plt.show()
+
+    if args.prescreen is not None:
+        print(" ")
+        print("|"+"="*50+"|")
+        print("|  Rejected {0:5d}".format(nprescreen) +
+              " events with SNR pre-screen       |")
+        print("|"+"="*50+"|")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+
+# Copyright 2019 Pascal Audet & Andrew Schaeffer
+#
+# This file is part of SplitPy.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# -*- coding: utf-8 -*-
+from splitpy import arguments, batch
+import stdb
+
+
+def main():
+
+    # Run Input Parser
+    args = arguments.get_arguments_calc_batch()
+
+    # Load job and station database
+    try:
+        spec = batch.load_spec(args.spec)
+    except ValueError as e:
+        raise SystemExit("Error in job file " + args.spec + ": " + str(e))
+    db = stdb.io.load_db(fname=args.indb)
+
+    stkeys = batch.select_stations(spec, db)
+    print(" ")
+    print("|"+"="*50+"|")
+    print("|  Job with {0:3d} configurations and {1:5d} stations  |".format(
+        len(spec['configs']), len(stkeys)))
+    print("|"+"="*50+"|")
+
+    counts = batch.run(spec, db, queue=args.queue, lease=args.lease,
+                       poll=args.poll, verbose=args.verb)
+
+    # Summary
+    for stkey, stcounts in counts.items():
+        print(" ")
+        print("* Station " + stkey)
+        for name, status in stcounts.items():
+            print("*   {0:s}: ".format(name) + ", ".join(
+                "{0:d} {1:s}".format(n, s) for s, n in sorted(status.items())))
+
+
+if __name__ == "__main__":
+
+    # Run main program
+    main()
@@ -23,14 +23,14 @@
 # SOFTWARE.
 
 # -*- coding: utf-8 -*-
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from splitpy import Pick, Keep, Save, Repeat
 from splitpy import PickPlot, DiagPlot
-from splitpy import arguments, utils
+from splitpy import arguments, utils, store
 from splitpy import Split
 import matplotlib.pyplot as plt
 import numpy as np
-import pickle
 import stdb
 from obspy.clients.fdsn import Client
 from obspy import UTCDateTime
@@ -62,6 +62,10 @@ def main():
         stkeys = db.keys()
         sorted(stkeys)
 
+    # Exact analyses of picked windows are carried out in the background,
+    # one at a time, while the next window is picked
+    executor = ThreadPoolExecutor(max_workers=1)
+
     # Loop over station keys
     for stkey in list(stkeys):
 
@@ -71,8 +75,9 @@ def main():
         # Data directory
         datapath = Path("DATA") / stkey
 
-        # Get only directories for which the key is available
-        evs = [str(x) for x in datapath.iterdir() if x.is_dir()]
+        # Get events for which data are available
+        ststore = store.open_store(datapath)
+        evs = ststore.keys()
 
         # Get catalogue search start time
         if args.startT is None:
@@ -114,8 +119,8 @@ def main():
         # Read through catalogue
         for iev in ievs:
 
-            datekey = evs[iev].split('/')[-1].split('_')[0]
-            timekey = evs[iev].split('/')[-1].split('_')[-1]
+            datekey = evs[iev].split('_')[0]
+            timekey = evs[iev].split('_')[-1]
             evdate = UTCDateTime(
                 datekey[0:4]+'-'+datekey[4:6]+'-'+datekey[6:8]+
                 'T'+timekey[0:2]+':'+timekey[2:4]+':'+timekey[4:6])
@@ -124,31 +129,24 @@ def main():
 
             # Event Name
             evSTR = evs[iev]
+            if not all([ststore.has(evSTR, name) for name in
+                        ['station', 'meta', 'ZNE', 'LQT']]):
+                continue
 
-            # Load Relevant Files
+            # Load Relevant Data
             # Station data
-            stafile = Path(evSTR) / "Station_data.pkl"
-            sta = pickle.load(open(stafile, "rb"))
+            sta = ststore.get(evSTR, 'station')
             split = Split(sta)
 
             # Event data
-            metafile = Path(evSTR) / "Meta_data.pkl"
-            meta = pickle.load(open(metafile, "rb"))
+            meta = ststore.get(evSTR, 'meta')
             split.meta = meta
 
-            # ZNE data
-            ZNEfile = Path(evSTR) / "ZNE_data.pkl"
-            dataZNE = pickle.load(open(ZNEfile, "rb"))
-            split.dataZNE = dataZNE
-
-            # LQT data
-            LQTfile = Path(evSTR) / "LQT_data.pkl"
-            dataLQT = pickle.load(open(LQTfile, "rb"))
-            split.dataLQT = dataLQT
+            # ZNE and LQT data, memory-mapped from the store when used
+            split.attach(ststore, evSTR)
 
             # Split results
-            splitfile = Path(evSTR) / "Split_results_auto.pkl"
-            if not splitfile.exists():
+            if not ststore.has(evSTR, 'results_auto'):
 
                 print("* Split results not available... calculating")
                 split.analyze(verbose=args.verb)
@@ -156,12 +154,11 @@ def main():
                 split.get_quality(verbose=args.verb)
 
             else:
-                file = open(splitfile, "rb")
-                split.SC_res = pickle.load(file)
-                split.RC_res = pickle.load(file)
-                split.null = pickle.load(file)
-                split.quality = pickle.load(file)
-                file.close()
+                results = ststore.get(evSTR, 'results_auto')
+                split.SC_res = results['SC_res']
+                split.RC_res = results['RC_res']
+                split.null = results['null']
+                split.quality = results['quality']
 
             if args.verb:
                 split.display_results()
@@ -183,6 +180,7 @@ def main():
 
             # Choose whether to re-pick window times
             iselect = 'a'
+            pending = None
             while iselect == 'a':
 
                 # Call interactive window for picking
@@ -217,33 +215,53 @@ def main():
                     # Update LQT figure
                     pplot.update_LQT(tp1, tp2)
 
-                    # Re-analyze splits
-                    split.analyze(verbose=args.verb, t1=t1, t2=t2)
-
-                    # Check for fault result
-                    if (split.RC_res.edtt is None or
-                            split.SC_res.edtt is None):
-                        print("* !!! DOF Error. --> Skipping...")
-                        print("*"*50)
-                        continue
-
-                    # Determine if estimate is Null and quality
-                    # of estimate
-                    split.calc_snr(t1=t1, dt=(t2-t1))
-                    split.is_null(args.snrTlim, verbose=args.verb)
-                    split.get_quality(verbose=args.verb)
-
-                    if args.verb:
-                        split.display_results()
-                        split.display_meta()
-                        split.display_null_quality()
+                    # Preview estimates on a coarse grid
+                    phiRC, dttRC, phiSC, dttSC = split.preview(t1=t1, t2=t2)
+                    print("* Preview RC: {0:.1f} deg, {1:.1f} sec;".format(
+                        phiRC, dttRC) + " SC: {0:.1f} deg, {1:.1f} sec".format(
+                        phiSC, dttSC))
 
-                    # Re-initialize diagnostic figure and plot
-                    dplot = DiagPlot(split)
-                    dplot.plot_diagnostic(t1, t2)
+                    # Re-analyze splits in the background, in place of the
+                    # analysis of a previous window not yet started
+                    if pending is not None:
+                        pending[0].cancel()
+                    pending = (executor.submit(
+                        split.analyze, verbose=args.verb, t1=t1, t2=t2),
+                        t1, t2)
 
                 # If user clicks no:
                 else:
+
+                    # Wait for the analysis of the last picked window
+                    if pending is not None:
+                        future, t1, t2 = pending
+                        pending = None
+                        if not future.done():
+                            print("* Waiting for analysis of picked window")
+                        future.result()
+
+                        # Check for fault result
+                        if (split.RC_res.edtt is None or
+                                split.SC_res.edtt is None):
+                            print("* !!! DOF Error. --> Skipping...")
+                            print("*"*50)
+                            continue
+
+                        # Determine if estimate is Null and quality
+                        # of estimate
+                        split.calc_snr(t1=t1, dt=(t2-t1))
+                        split.is_null(args.snrTlim, verbose=args.verb)
+                        split.get_quality(verbose=args.verb)
+
+                        if args.verb:
+                            split.display_results()
+                            split.display_meta()
+                            split.display_null_quality()
+
+                        # Re-initialize diagnostic figure and plot
+                        dplot = DiagPlot(split)
+                        dplot.plot_diagnostic(t1, t2)
+
                     iselect = 'c'
 
                     # Call interactive window for decision on
@@ -260,20 +278,25 @@ def main():
                         split.display_results()
 
                         # Save split results
-                        splitfile = Path(evSTR) / "Split_results_manual.pkl"
-                        file = open(splitfile, "wb")
-                        split.SC_res = pickle.dump(split.SC_res, file)
-                        split.RC_res = pickle.dump(split.RC_res, file)
-                        split.null = pickle.dump(split.null, file)
-                        split.quality = pickle.dump(split.quality, file)
-                        file.close()
+                        results = {
+                            'SC_res': split.SC_res, 'RC_res': split.RC_res,
+                            'null': split.null, 'quality': split.quality}
+                        ststore.put(evSTR, 'results_manual', results)
+                        store.ResultsTable(
+                            datapath, 'results_manual').append(
+                                evSTR, split.meta, results, store=ststore)
+                        store.EmatCube(
+                            datapath, 'results_manual').append(
+                                evSTR, split.meta, results, store=ststore)
 
                         # Save pick plot
-                        pplotfile = Path(evSTR) / "Plot_window_manual.png"
+                        figdir = ststore.figdir(evSTR)
+                        figdir.mkdir(parents=True, exist_ok=True)
+                        pplotfile = figdir / "Plot_window_manual.png"
                         pplot.save(pplotfile)
 
                         # Save diagnostic plot
-                        dplotfile = Path(evSTR) / "Plot_diagnostic_manual.png"
+                        dplotfile = figdir / "Plot_diagnostic_manual.png"
                         dplot.save(dplotfile)
 
                         print("* Estimate Saved")
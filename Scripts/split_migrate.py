@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+# Copyright 2019 Pascal Audet & Andrew Schaeffer
+#
+# This file is part of SplitPy.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# -*- coding: utf-8 -*-
+from pathlib import Path
+from splitpy import arguments, store
+import stdb
+
+
+def main():
+
+    # Run Input Parser
+    args = arguments.get_arguments_migrate()
+
+    # Load Database
+    db = stdb.io.load_db(fname=args.indb)
+
+    # Construct station key loop
+    allkeys = db.keys()
+    sorted(allkeys)
+
+    # Extract key subset
+    if len(args.stkeys) > 0:
+        stkeys = []
+        for skey in args.stkeys:
+            stkeys.extend([s for s in allkeys if skey in s])
+    else:
+        stkeys = db.keys()
+        sorted(stkeys)
+
+    # Loop over station keys
+    for stkey in list(stkeys):
+
+        # Data directory
+        datapath = Path("DATA") / stkey
+        if not datapath.is_dir():
+            continue
+
+        if (datapath / store.STORE_NAME).exists():
+            print("* {0}: already converted - continuing".format(stkey))
+            continue
+
+        print("* {0}: converting event folders".format(stkey))
+        nev = store.migrate(datapath, remove=args.remove, verbose=args.verb)
+        print("*   {0:d} events converted to {1}".format(
+            nev, datapath / store.STORE_NAME))
+
+
+if __name__ == "__main__":
+
+    # Run main program
+    main()
@@ -0,0 +1,1152 @@
+# Copyright 2019 Pascal Audet & Andrew Schaeffer
+#
+# This file is part of SplitPy.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+
+Module containing classes to access local archives of day-long
+seismograms:
+
+- :class:`~splitpy.archive.ArchiveIndex`
+- :class:`~splitpy.archive.LocalData`
+- :class:`~splitpy.archive.DayFilePlanner`
+- :class:`~splitpy.archive.MappedSAC`
+- :class:`~splitpy.archive.MappedSACReader`
+- :class:`~splitpy.archive.RecordIndex`
+- :class:`~splitpy.archive.SDSReader`
+
+The class :class:`~splitpy.archive.ArchiveIndex` maintains a persistent
+SQLite index of the day-long SAC files found in a set of local directories,
+keyed by network, station, year, julian day and channel. The index is
+updated incrementally: only directories whose modification time has
+changed since the last update are listed again.
+
+The class :class:`~splitpy.archive.LocalData` is a view of the index for a
+single station, which can be passed in place of the list of files returned
+by :func:`~splitpy.utils.list_local_data_stn`.
+
+The class :class:`~splitpy.archive.DayFilePlanner` groups the time windows
+of all events for a station by day file, such that each day file is read
+only once.
+
+The class :class:`~splitpy.archive.MappedSAC` parses only the header of a
+SAC file and memory-maps its data block, such that a time window can be
+extracted without reading or converting the rest of the day file. The
+class :class:`~splitpy.archive.MappedSACReader` uses it to extract event
+windows from local day files.
+
+The class :class:`~splitpy.archive.SDSReader` gives access to miniSEED
+day volumes stored in an SDS (SeisComP Data Structure) archive. Each day
+volume is indexed by record start time
+(:class:`~splitpy.archive.RecordIndex`), such that only the records
+overlapping a time window are decoded.
+
+"""
+
+# -*- coding: utf-8 -*-
+import os
+import sqlite3
+from glob import glob
+from io import BytesIO
+import numpy as np
+
+
+def parse_sac_name(filename):
+    """
+    Parses the name of a day-long SAC file of the form
+    ``YYYY.JJJ.NET.STA.LOC.CHA.SAC``
+
+    Parameters
+    ----------
+    filename : str
+        Base name of file
+
+    Returns
+    -------
+    key : tuple
+        Tuple (net, sta, loc, cha, year, jday), or `None` if the name
+        does not follow the convention
+
+    """
+
+    parts = filename.split('.')
+    if len(parts) < 7 or parts[-1] != 'SAC':
+        return None
+    try:
+        year = int(parts[0])
+        jday = int(parts[1])
+    except ValueError:
+        return None
+
+    return (parts[2], parts[3], '.'.join(parts[4:-2]), parts[-2], year, jday)
+
+
+class ArchiveIndex(object):
+    """
+    An ArchiveIndex object contains a connection to a SQLite database
+    that indexes day-long SAC files in local directories.
+
+    Note
+    ----
+    The index is only as current as the last call to
+    :meth:`~splitpy.archive.ArchiveIndex.update`.
+
+    Attributes
+    ----------
+    dbfile : str
+        Path to SQLite database file
+    db : :class:`~sqlite3.Connection`
+        Connection to database
+
+    """
+
+    def __init__(self, dbfile):
+
+        self.dbfile = str(dbfile)
+        self.db = sqlite3.connect(self.dbfile)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS dirs (
+                path TEXT PRIMARY KEY, parent TEXT, mtime REAL);
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY, dir TEXT, net TEXT, sta TEXT,
+                loc TEXT, cha TEXT, year INTEGER, jday INTEGER,
+                mtime REAL);
+            CREATE INDEX IF NOT EXISTS dirs_parent ON dirs (parent);
+            CREATE INDEX IF NOT EXISTS files_dir ON files (dir);
+            CREATE INDEX IF NOT EXISTS files_key
+                ON files (net, sta, year, jday);
+            """)
+
+    def __len__(self):
+
+        return self.db.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    def update(self, lcldrs):
+        """
+        Updates the index with the content of local directories. Each
+        directory is recursively visited, but only listed again if its
+        modification time has changed. In unchanged directories, the
+        modification time of each file is checked instead, such that
+        files rewritten in place are updated. Directories indexed by
+        previous updates that are not part of ``lcldrs`` are removed
+        from the index.
+
+        Parameters
+        ----------
+        lcldrs : List
+            List of local directories
+
+        Returns
+        -------
+        nscan : int
+            Number of directories that were listed
+
+        """
+
+        # Remove the directories of other archives
+        roots = [os.path.abspath(lcldr) for lcldr in lcldrs]
+        for row in self.db.execute(
+                "SELECT path FROM dirs WHERE parent IS NULL").fetchall():
+            if row[0] not in roots:
+                self._remove_dir(row[0])
+
+        nscan = 0
+        for root in roots:
+            nscan += self._update_dir(root, None)
+        self.db.commit()
+
+        return nscan
+
+    def _update_dir(self, path, parent):
+
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            self._remove_dir(path)
+            return 0
+
+        row = self.db.execute(
+            "SELECT mtime FROM dirs WHERE path = ?", (path,)).fetchone()
+
+        # Directory has not changed: only check files rewritten in place,
+        # and visit sub-directories
+        if row is not None and row[0] == mtime:
+            for file, fmtime in self.db.execute(
+                    "SELECT path, mtime FROM files WHERE dir = ?",
+                    (path,)).fetchall():
+                try:
+                    new = os.stat(file).st_mtime
+                except OSError:
+                    self.db.execute(
+                        "DELETE FROM files WHERE path = ?", (file,))
+                    continue
+                if new != fmtime:
+                    self.db.execute(
+                        "UPDATE files SET mtime = ? WHERE path = ?",
+                        (new, file))
+            subdirs = [r[0] for r in self.db.execute(
+                "SELECT path FROM dirs WHERE parent = ?", (path,))]
+            return sum([self._update_dir(subdir, path)
+                        for subdir in subdirs])
+
+        # Otherwise list the directory content
+        subdirs = []
+        files = {}
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    subdirs.append(entry.path)
+                elif entry.is_file():
+                    key = parse_sac_name(entry.name)
+                    if key is not None:
+                        files[entry.path] = key + (entry.stat().st_mtime,)
+
+        # Remove files and sub-directories that have disappeared
+        old = [r[0] for r in self.db.execute(
+            "SELECT path FROM files WHERE dir = ?", (path,))]
+        self.db.executemany(
+            "DELETE FROM files WHERE path = ?",
+            [(f,) for f in old if f not in files])
+        old = [r[0] for r in self.db.execute(
+            "SELECT path FROM dirs WHERE parent = ?", (path,))]
+        for subdir in old:
+            if subdir not in subdirs:
+                self._remove_dir(subdir)
+
+        self.db.executemany(
+            "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [(f, path) + key for f, key in files.items()])
+        self.db.execute(
+            "INSERT OR REPLACE INTO dirs VALUES (?, ?, ?)",
+            (path, parent, mtime))
+
+        return 1 + sum([self._update_dir(subdir, path)
+                        for subdir in subdirs])
+
+    def _remove_dir(self, path):
+
+        subdirs = [r[0] for r in self.db.execute(
+            "SELECT path FROM dirs WHERE parent = ?", (path,))]
+        for subdir in subdirs:
+            self._remove_dir(subdir)
+        self.db.execute("DELETE FROM files WHERE dir = ?", (path,))
+        self.db.execute("DELETE FROM dirs WHERE path = ?", (path,))
+
+    def find(self, net, sta, year, jday, cha=None, comp=None):
+        """
+        Finds files for a given station-day
+
+        Parameters
+        ----------
+        net : str
+            Network code
+        sta : str
+            Station code
+        year : int
+            Year
+        jday : int
+            Julian day
+        cha : str
+            Exact channel code (e.g., 'HHZ')
+        comp : str
+            Component (last letter of channel code), used if ``cha``
+            is not specified
+
+        Returns
+        -------
+        files : List
+            Sorted list of file paths
+
+        """
+
+        query = "SELECT path FROM files WHERE net = ? AND sta = ? " + \
+            "AND year = ? AND jday = ?"
+        params = [net, sta, int(year), int(jday)]
+        if cha is not None:
+            query += " AND cha = ?"
+            params.append(cha)
+        elif comp is not None:
+            query += " AND cha LIKE ?"
+            params.append('%' + comp)
+        query += " ORDER BY path"
+
+        return [r[0] for r in self.db.execute(query, params)]
+
+    def count(self, sta, nets=None):
+        """
+        Counts the files available for a station
+
+        Parameters
+        ----------
+        sta : str
+            Station code
+        nets : List
+            List of network codes (`None` for any network)
+
+        """
+
+        query = "SELECT COUNT(*) FROM files WHERE sta = ?"
+        params = [sta]
+        if nets is not None:
+            query += " AND net IN ({0})".format(",".join("?"*len(nets)))
+            params.extend(nets)
+
+        return self.db.execute(query, params).fetchone()[0]
+
+    def select(self, sta, net=None, altnet=[]):
+        """
+        Returns a view of the index for a single station
+
+        Parameters
+        ----------
+        sta : str
+            Station code
+        net : str
+            Network code (`None` for any network)
+        altnet : List
+            List of alternative networks
+
+        Returns
+        -------
+        view : :class:`~splitpy.archive.LocalData`
+            Station view of the index
+
+        """
+
+        return LocalData(self, sta, net=net, altnet=altnet)
+
+    def close(self):
+        """
+        Closes the connection to the database
+
+        """
+
+        self.db.close()
+
+
+class LocalData(object):
+    """
+    A LocalData object is a view of an :class:`~splitpy.archive.ArchiveIndex`
+    for a single station. It replaces the list of file paths used by
+    :func:`~splitpy.utils.parse_localdata_for_comp`: its length is the number
+    of files available for the station and each lookup is a single indexed
+    query.
+
+    Attributes
+    ----------
+    index : :class:`~splitpy.archive.ArchiveIndex`
+        Archive index
+    sta : str
+        Station code
+    nets : List
+        List of network codes (`None` for any network)
+
+    """
+
+    def __init__(self, index, sta, net=None, altnet=[]):
+
+        self.index = index
+        self.sta = sta
+        if net is None:
+            self.nets = None
+        else:
+            self.nets = [net] + list(altnet)
+
+    def __len__(self):
+
+        return self.index.count(self.sta, self.nets)
+
+    def find(self, net, sta, year, jday, cha=None, comp=None):
+        """
+        Finds files for a given station-day - see
+        :meth:`~splitpy.archive.ArchiveIndex.find`
+
+        """
+
+        return self.index.find(net, sta, year, jday, cha=cha, comp=comp)
+
+
+class DayFilePlanner(object):
+    """
+    A DayFilePlanner object reads local day-long SAC files for a station
+    at most once for all the time windows that fall on the same day(s).
+    The windows of all events are registered at initialization, which
+    gives the number of windows that still need each day file. Files are
+    kept in memory until their last window has been served, or released
+    (see :meth:`~splitpy.archive.DayFilePlanner.release`) for events that
+    are not retrieved from the files.
+
+    The object can be passed to :func:`~splitpy.utils.download_data` in
+    place of the station list, and implements the same interface as
+    :func:`~splitpy.utils.parse_localdata_for_comp`.
+
+    Attributes
+    ----------
+    stdata : List or :class:`~splitpy.archive.LocalData`
+        Station list or station view of a local archive index
+    sta : Dict
+        Station metadata from :mod:`~StDb` data base
+    refs : Dict
+        Number of planned windows still requiring each day file
+    nread : int
+        Number of files read from disk
+
+    """
+
+    def __init__(self, stdata, sta, windows=[], comps=['Z', 'N', 'E']):
+
+        self.stdata = stdata
+        self.sta = sta
+        self.comps = comps
+        self.refs = {}
+        self.nread = 0
+        self._files = {}
+        self._cache = {}
+
+        for start, end in windows:
+            for comp in comps:
+                for path in self._window_files(comp, start, end):
+                    self.refs[path] = self.refs.get(path, 0) + 1
+
+    def __len__(self):
+
+        return len(self.stdata)
+
+    def _day_files(self, comp, time):
+
+        from splitpy.utils import find_local_files
+
+        key = (comp, time.strftime("%Y"), time.strftime("%j"))
+        if key not in self._files:
+            self._files[key] = find_local_files(
+                self.stdata, self.sta, key[1], key[2], comp)
+        return self._files[key]
+
+    def _window_files(self, comp, start, end):
+
+        files = list(self._day_files(comp, start))
+        if start.strftime("%j") != end.strftime("%j"):
+            files.extend(self._day_files(comp, end))
+        return files
+
+    def _read(self, path):
+        """
+        Reads a day file (once), with its no-data value (`None` if not
+        set)
+
+        """
+
+        from obspy import read
+
+        if path not in self._cache:
+            st = read(path, format='SAC')
+            self.nread += 1
+            tr = None
+            stnd = None
+            if len(st) == 1:
+                tr = st[0]
+                stnd = tr.stats.sac.get('user9', -12345.0)
+                if stnd == 0.0 or stnd == -12345.0:
+                    stnd = None
+            self._cache[path] = (tr, stnd)
+
+        return self._cache[path]
+
+    def _release(self, paths):
+
+        for path in paths:
+            if path in self.refs:
+                self.refs[path] -= 1
+                if self.refs[path] > 0:
+                    continue
+                del self.refs[path]
+            self._cache.pop(path, None)
+
+    def release(self, start, end):
+        """
+        Releases the day files of a window registered at initialization,
+        for an event that is not retrieved from the files (e.g., skipped
+        or found in the waveform cache)
+
+        Parameters
+        ----------
+        start : :class:`~obspy.core.utcdatetime.UTCDateTime`
+            Start time of window
+        end : :class:`~obspy.core.utcdatetime.UTCDateTime`
+            End time of window
+
+        """
+
+        for comp in self.comps:
+            self._release(self._window_files(comp, start, end))
+
+    def parse_comp(self, comp='Z', sta=None, start=None, end=None,
+                   ndval=np.nan):
+        """
+        Extracts a time window for a given component from the day files.
+        See :func:`~splitpy.utils.parse_localdata_for_comp` for the
+        description of the parameters and return values.
+
+        """
+
+        from obspy import Stream
+
+        def window(tr, stnd, **kwargs):
+            # Copy of part of a day file, converting no-data values
+            trw = tr.slice(**kwargs).copy()
+            if stnd is not None:
+                trw.data[trw.data == stnd] = ndval
+            return trw
+
+        print(
+            ("*          {0:2s}{1:1s} - Checking Disk".format(
+                self.sta.channel.upper(), comp.upper())))
+
+        files1 = self._day_files(comp, start)
+        if start.strftime("%j") == end.strftime("%j"):
+            pairs = [(f1, None) for f1 in files1]
+            files2 = []
+        else:
+            files2 = self._day_files(comp, end)
+            pairs = [(f1, f2) for f1 in files1 for f2 in files2]
+
+        try:
+            for f1, f2 in pairs:
+                tr, stnd = self._read(f1)
+                if tr is None:
+                    continue
+                eddt = stnd is not None
+                if f2 is not None:
+                    tr2, stnd2 = self._read(f2)
+                    if tr2 is None:
+                        continue
+                    if tr.stats.endtime < \
+                            tr2.stats.starttime - tr2.stats.delta:
+                        print("*                 - Merge Failed: No Overlap")
+                        continue
+                    # Merge only the parts of the day files in the window
+                    st = Stream(traces=[
+                        window(tr, stnd, starttime=start),
+                        window(tr2, stnd2, endtime=end)])
+                    try:
+                        st.merge()
+                    except Exception:
+                        continue
+                    if len(st) != 1:
+                        continue
+                    trw = st[0]
+                    eddt = eddt or stnd2 is not None
+                    trw = trw.slice(starttime=start, endtime=end)
+                else:
+                    trw = window(tr, stnd, starttime=start, endtime=end)
+
+                # Check start/end times in range
+                if not (trw.stats.starttime <= start and
+                        trw.stats.endtime >= end):
+                    continue
+
+                # Check for Nan in stream
+                if np.any(np.isnan(trw.data)):
+                    print("*          !!! Missing Data Present !!! " +
+                          "Skipping (NaNs)")
+                    continue
+                if eddt and (ndval == 0.0):
+                    if np.any(trw.data == 0.0):
+                        print("*          !!! Missing Data Present " +
+                              "!!! (Set to Zero)")
+
+                trw.stats.update()
+                tloc = trw.stats.location
+                if len(tloc) == 0:
+                    tloc = "--"
+                print(("*          {0:3s}.{1:2s}  - From Disk".format(
+                    trw.stats.channel.upper(), tloc)))
+                return False, Stream(traces=[trw])
+
+        finally:
+            self._release(list(files1) + list(files2))
+
+        print("*              - Data Unavailable")
+        return True, None
+
+
+class MappedSAC(object):
+    """
+    A MappedSAC object gives access to a binary SAC file by parsing its
+    header and memory-mapping the data block. Time windows are returned as
+    :class:`~obspy.core.Trace` objects that refer to the mapped data, such
+    that only the samples within the window are read from disk.
+
+    The data are mapped in copy-on-write mode: modifying the data of a
+    returned trace never changes the file on disk.
+
+    Attributes
+    ----------
+    path : str
+        Path to SAC file
+    byteorder : str
+        Byte order of the file (``'<'`` or ``'>'``)
+    stats : :class:`~obspy.core.Stats`
+        Trace header (network, station, location, channel, start time,
+        sampling interval and number of samples)
+    user9 : float
+        Value of the ``user9`` header, used to flag missing data
+        (-12345. if undefined)
+    data : :class:`~numpy.memmap`
+        Mapped data samples
+
+    """
+
+    # Length of header and position of used header variables
+    HEADER = 632
+    FLOATS = {'delta': 0, 'b': 5, 'user9': 49}
+    INTS = {'nzyear': 0, 'nzjday': 1, 'nzhour': 2, 'nzmin': 3,
+            'nzsec': 4, 'nzmsec': 5, 'nvhdr': 6, 'npts': 9, 'iftype': 15,
+            'leven': 35}
+    CHARS = {'kstnm': (0, 8), 'khole': (24, 32), 'kcmpnm': (160, 168),
+             'knetwk': (168, 176)}
+
+    def __init__(self, path):
+
+        from obspy import UTCDateTime
+        from obspy.core import Stats
+
+        self.path = path
+
+        with open(path, 'rb') as f:
+            head = f.read(self.HEADER)
+        if len(head) != self.HEADER:
+            raise IOError("File too short for SAC header: " + str(path))
+
+        # The header version (6) gives the byte order
+        for byteorder in ['<', '>']:
+            ints = np.frombuffer(head, dtype=byteorder + 'i4', count=40,
+                                 offset=280)
+            if ints[self.INTS['nvhdr']] == 6:
+                break
+        else:
+            raise IOError("Not a binary SAC file: " + str(path))
+        floats = np.frombuffer(head, dtype=byteorder + 'f4', count=70)
+        chars = head[440:]
+
+        def hint(key):
+            return int(ints[self.INTS[key]])
+
+        def hchar(key):
+            val = chars[slice(*self.CHARS[key])].decode(
+                'ascii', errors='replace').strip()
+            return '' if val == '-12345' else val
+
+        npts = hint('npts')
+        if hint('iftype') != 1 or hint('leven') != 1 or npts <= 0:
+            raise IOError("Not an evenly sampled time series: " + str(path))
+        if os.path.getsize(path) < self.HEADER + 4*npts:
+            raise IOError("Truncated SAC file: " + str(path))
+
+        reftime = UTCDateTime(
+            year=hint('nzyear'), julday=hint('nzjday'), hour=hint('nzhour'),
+            minute=hint('nzmin'), second=hint('nzsec'),
+            microsecond=hint('nzmsec')*1000)
+
+        self.byteorder = byteorder
+        self.user9 = float(floats[self.FLOATS['user9']])
+        self.stats = Stats()
+        self.stats.network = hchar('knetwk')
+        self.stats.station = hchar('kstnm')
+        self.stats.location = hchar('khole')
+        self.stats.channel = hchar('kcmpnm')
+        self.stats.delta = float(floats[self.FLOATS['delta']])
+        self.stats.starttime = reftime + float(floats[self.FLOATS['b']])
+        self.stats.npts = npts
+
+        self.data = np.memmap(path, dtype=byteorder + 'f4', mode='c',
+                              offset=self.HEADER, shape=(npts,))
+
+    @property
+    def starttime(self):
+        return self.stats.starttime
+
+    @property
+    def endtime(self):
+        return self.stats.endtime
+
+    def slice(self, start=None, end=None):
+        """
+        Returns a time window of the data, selecting the samples nearest to
+        the window limits as in :meth:`~obspy.core.Trace.slice`. The data
+        of the returned trace refer to the mapped file (no copy), unless
+        the file is not in native byte order.
+
+        Parameters
+        ----------
+        start : :class:`~obspy.core.utcdatetime.UTCDateTime`
+            Start time of window (default start of file)
+        end : :class:`~obspy.core.utcdatetime.UTCDateTime`
+            End time of window (default end of file)
+
+        Returns
+        -------
+        tr : :class:`~obspy.core.Trace`
+            Windowed trace
+
+        """
+
+        from obspy import Trace
+
+        sr = self.stats.sampling_rate
+        i0 = 0
+        i1 = self.stats.npts
+        if start is not None:
+            i0 = int(np.clip(_round_away((start - self.starttime)*sr),
+                             0, self.stats.npts))
+        if end is not None:
+            i1 = int(np.clip(_round_away((end - self.starttime)*sr) + 1,
+                             i0, self.stats.npts))
+
+        data = self.data[i0:i1]
+        if not data.dtype.isnative:
+            data = data.astype(np.float32)
+
+        header = self.stats.copy()
+        header.npts = len(data)
+        header.starttime = self.starttime + i0*self.stats.delta
+        tr = Trace(data=np.asarray(data), header=header)
+
+        return tr
+
+
+def _round_away(x):
+    """
+    Rounds half away from zero, as done by ObsPy for trimming
+
+    """
+
+    return int(np.sign(x)*np.floor(abs(x) + 0.5))
+
+
+def convert_nodata(tr, user9, ndval=np.nan):
+    """
+    Converts samples flagged as missing data (value stored in the ``user9``
+    header of SAC files) to a default value. The data are only copied if
+    flagged samples are present.
+
+    Parameters
+    ----------
+    tr : :class:`~obspy.core.Trace`
+        Seismogram
+    user9 : float
+        No-data value (conversion skipped if 0 or -12345.)
+    ndval : float or nan
+        Default value for missing data
+
+    Returns
+    -------
+    eddt : bool
+        Whether no-data values are defined for this seismogram
+
+    """
+
+    if user9 == 0.0 or user9 == -12345.0:
+        return False
+    flag = tr.data == user9
+    if np.any(flag):
+        tr.data = np.array(tr.data)
+        tr.data[flag] = ndval
+    return True
+
+
+class MappedSACReader(object):
+    """
+    A MappedSACReader object extracts time windows for a station from local
+    day-long SAC files using memory-mapped data blocks
+    (:class:`~splitpy.archive.MappedSAC`), instead of reading the complete
+    day files.
+
+    The object can be passed to :func:`~splitpy.utils.download_data` in
+    place of the station list, and implements the same interface as
+    :func:`~splitpy.utils.parse_localdata_for_comp`.
+
+    Attributes
+    ----------
+    stdata : List or :class:`~splitpy.archive.LocalData`
+        Station list or station view of a local archive index
+    sta : Dict
+        Station metadata from :mod:`~StDb` data base
+
+    """
+
+    def __init__(self, stdata, sta):
+
+        self.stdata = stdata
+        self.sta = sta
+
+    def __len__(self):
+
+        return len(self.stdata)
+
+    def _open(self, path):
+
+        try:
+            return MappedSAC(path)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def parse_comp(self, comp='Z', sta=None, start=None, end=None,
+                   ndval=np.nan):
+        """
+        Extracts a time window for a given component from the day files.
+        See :func:`~splitpy.utils.parse_localdata_for_comp` for the
+        description of the parameters and return values.
+
+        """
+
+        from obspy import Stream
+        from splitpy.utils import find_local_files
+
+        print(
+            ("*          {0:2s}{1:1s} - Checking Disk".format(
+                self.sta.channel.upper(), comp.upper())))
+
+        files1 = find_local_files(
+            self.stdata, self.sta, start.strftime("%Y"),
+            start.strftime("%j"), comp)
+        if start.strftime("%j") == end.strftime("%j"):
+            pairs = [(f1, None) for f1 in files1]
+        else:
+            files2 = find_local_files(
+                self.stdata, self.sta, end.strftime("%Y"),
+                end.strftime("%j"), comp)
+            pairs = [(f1, f2) for f1 in files1 for f2 in files2]
+
+        for f1, f2 in pairs:
+            sac1 = self._open(f1)
+            if sac1 is None:
+                continue
+            if f2 is None:
+                if not (sac1.starttime <= start and sac1.endtime >= end):
+                    continue
+                tr = sac1.slice(start, end)
+                eddt = convert_nodata(tr, sac1.user9, ndval)
+            else:
+                sac2 = self._open(f2)
+                if sac2 is None:
+                    continue
+                if sac1.endtime < sac2.starttime - sac2.stats.delta:
+                    print("*                 - Merge Failed: No Overlap")
+                    continue
+                tr1 = sac1.slice(start=start)
+                tr2 = sac2.slice(end=end)
+                eddt1 = convert_nodata(tr1, sac1.user9, ndval)
+                eddt2 = convert_nodata(tr2, sac2.user9, ndval)
+                st = Stream(traces=[tr1, tr2])
+                try:
+                    st.merge()
+                except Exception:
+                    continue
+                if len(st) != 1:
+                    continue
+                tr = st[0]
+                eddt = eddt1 or eddt2
+                if not (tr.stats.starttime <= start and
+                        tr.stats.endtime >= end):
+                    continue
+
+            # Check for Nan in stream
+            if np.any(np.isnan(tr.data)):
+                print("*          !!! Missing Data Present !!! " +
+                      "Skipping (NaNs)")
+                continue
+            if eddt and (ndval == 0.0):
+                if np.any(tr.data == 0.0):
+                    print("*          !!! Missing Data Present " +
+                          "!!! (Set to Zero)")
+
+            tloc = tr.stats.location
+            if len(tloc) == 0:
+                tloc = "--"
+            print(("*          {0:3s}.{1:2s}  - From Disk".format(
+                tr.stats.channel.upper(), tloc)))
+            return False, Stream(traces=[tr])
+
+        print("*              - Data Unavailable")
+        return True, None
+
+
+class RecordIndex(object):
+    """
+    A RecordIndex object holds the position and time span of each record
+    of a miniSEED file, sorted by start time. Only the fixed headers of the
+    records are read to build the index.
+
+    Attributes
+    ----------
+    path : str
+        Path to miniSEED file
+    offset : :class:`~numpy.ndarray`
+        Byte offset of records in file
+    length : :class:`~numpy.ndarray`
+        Length of records (bytes)
+    start : :class:`~numpy.ndarray`
+        Start time of records (POSIX timestamps)
+    end : :class:`~numpy.ndarray`
+        Time of the sample following the last sample of records (POSIX
+        timestamps)
+
+    """
+
+    def __init__(self, path):
+
+        from obspy.io.mseed.util import get_record_information
+
+        self.path = path
+
+        offset = []
+        length = []
+        start = []
+        end = []
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            pos = 0
+            while pos < size:
+                info = get_record_information(f, offset=pos)
+                reclen = info['record_length']
+                if reclen <= 0:
+                    break
+                offset.append(pos)
+                length.append(reclen)
+                start.append(info['starttime'].timestamp)
+                delta = 1./info['samp_rate'] if info['samp_rate'] > 0 \
+                    else 0.
+                end.append(info['endtime'].timestamp + delta)
+                pos += reclen
+
+        order = np.argsort(start, kind='stable')
+        self.offset = np.array(offset, dtype=np.int64)[order]
+        self.length = np.array(length, dtype=np.int64)[order]
+        self.start = np.array(start, dtype=float)[order]
+        self.end = np.array(end, dtype=float)[order]
+
+    def __len__(self):
+
+        return len(self.offset)
+
+    def select(self, start, end):
+        """
+        Finds the records that overlap a time window
+
+        Parameters
+        ----------
+        start : :class:`~obspy.core.utcdatetime.UTCDateTime`
+            Start time of window
+        end : :class:`~obspy.core.utcdatetime.UTCDateTime`
+            End time of window
+
+        Returns
+        -------
+        irec : :class:`~numpy.ndarray`
+            Indices of the overlapping records, in order of start time
+
+        """
+
+        i1 = np.searchsorted(self.start, end.timestamp, side='right')
+        irec = np.arange(i1)
+        return irec[self.end[:i1] > start.timestamp]
+
+    def read(self, start, end):
+        """
+        Decodes the records that overlap a time window
+
+        Parameters
+        ----------
+        start : :class:`~obspy.core.utcdatetime.UTCDateTime`
+            Start time of window
+        end : :class:`~obspy.core.utcdatetime.UTCDateTime`
+            End time of window
+
+        Returns
+        -------
+        st : :class:`~obspy.core.Stream`
+            Stream of decoded records (not merged)
+
+        """
+
+        from obspy import read, Stream
+
+        irec = self.select(start, end)
+        if len(irec) == 0:
+            return Stream()
+
+        # Read in file order, seeking only between non-consecutive records
+        chunks = []
+        pos = -1
+        with open(self.path, 'rb') as f:
+            for i in irec[np.argsort(self.offset[irec], kind='stable')]:
+                if self.offset[i] != pos:
+                    f.seek(self.offset[i])
+                chunks.append(f.read(self.length[i]))
+                pos = self.offset[i] + self.length[i]
+
+        return read(BytesIO(b''.join(chunks)), format='MSEED')
+
+
+class SDSReader(object):
+    """
+    A SDSReader object extracts time windows for a station from miniSEED
+    day volumes stored in SDS archives, i.e., in files named
+    ``ROOT/YEAR/NET/STA/CHA.D/NET.STA.LOC.CHA.D.YEAR.JDAY``. The records
+    of each day volume are indexed by start time when the volume is first
+    accessed, and only the records that overlap a time window are decoded.
+
+    The object can be passed to :func:`~splitpy.utils.download_data` in
+    place of the station list, and implements the same interface as
+    :func:`~splitpy.utils.parse_localdata_for_comp`. The search order of
+    networks and channels is that of
+    :func:`~splitpy.utils.find_local_files`.
+
+    Attributes
+    ----------
+    roots : List
+        Root directories of SDS archives
+    sta : Dict
+        Station metadata from :mod:`~StDb` data base
+    indexes : Dict
+        Record indexes of day volumes, with the modification time of the
+        volume when it was indexed
+
+    """
+
+    def __init__(self, roots, sta):
+
+        self.roots = list(roots)
+        self.sta = sta
+        self.indexes = {}
+        self._count = None
+
+    def __len__(self):
+
+        if self._count is None:
+            self._count = 0
+            for net in [self.sta.network] + list(self.sta.altnet):
+                for root in self.roots:
+                    self._count += len(glob(os.path.join(
+                        root, '*', net.upper(), self.sta.station.upper(),
+                        '*.D', '*')))
+        return self._count
+
+    def find(self, net, sta, year, jday, cha=None, comp=None):
+        """
+        Finds the day volumes for a station-day. See
+        :meth:`~splitpy.archive.ArchiveIndex.find`.
+
+        """
+
+        if cha is None:
+            cha = '*' + comp
+        files = []
+        for root in self.roots:
+            files.extend(sorted(glob(os.path.join(
+                root, year, net, sta, cha + '.D',
+                '{0}.{1}.*.{2}.D.{3}.{4}'.format(net, sta, cha, year, jday)))))
+        return files
+
+    def index(self, path):
+        """
+        Returns the record index of a day volume, which is rebuilt if the
+        volume has changed
+
+        """
+
+        mtime = os.stat(path).st_mtime
+        if path not in self.indexes or self.indexes[path][0] != mtime:
+            self.indexes[path] = (mtime, RecordIndex(path))
+        return self.indexes[path][1]
+
+    def parse_comp(self, comp='Z', sta=None, start=None, end=None,
+                   ndval=np.nan):
+        """
+        Extracts a time window for a given component from the day volumes.
+        See :func:`~splitpy.utils.parse_localdata_for_comp` for the
+        description of the parameters and return values.
+
+        """
+
+        from obspy import Stream, UTCDateTime
+        from splitpy.utils import find_local_files
+
+        print(
+            ("*          {0:2s}{1:1s} - Checking Disk".format(
+                self.sta.channel.upper(), comp.upper())))
+
+        # Day volumes spanned by the window, grouped by channel
+        files = {}
+        day = UTCDateTime(start.date)
+        while day <= end:
+            for path in find_local_files(
+                    self, self.sta, day.strftime("%Y"), day.strftime("%j"),
+                    comp):
+                seed = '.'.join(os.path.basename(path).split('.')[0:4])
+                files.setdefault(seed, []).append(path)
+            day += 86400.
+
+        for seed, paths in files.items():
+            st = Stream()
+            try:
+                for path in paths:
+                    st += self.index(path).read(start, end)
+                st.merge()
+            except Exception:
+                continue
+            if len(st) != 1:
+                continue
+            tr = st[0]
+
+            # Check start/end times in range
+            if not (tr.stats.starttime <= start and
+                    tr.stats.endtime >= end):
+                continue
+            tr.trim(starttime=start, endtime=end)
+
+            # Gaps are missing data
+            eddt = False
+            if np.ma.isMaskedArray(tr.data):
+                if np.ma.count_masked(tr.data) > 0:
+                    tr.data = tr.data.astype(float).filled(ndval)
+                    eddt = True
+                else:
+                    tr.data = tr.data.data
+
+            # Check for Nan in stream
+            if np.any(np.isnan(tr.data)):
+                print("*          !!! Missing Data Present !!! " +
+                      "Skipping (NaNs)")
+                continue
+            if eddt and (ndval == 0.0):
+                print("*          !!! Missing Data Present " +
+                      "!!! (Set to Zero)")
+
+            tloc = tr.stats.location
+            if len(tloc) == 0:
+                tloc = "--"
+            print(("*          {0:3s}.{1:2s}  - From Disk".format(
+                tr.stats.channel.upper(), tloc)))
+            return False, Stream(traces=[tr])
+
+        print("*              - Data Unavailable")
+        return True, None
@@ -116,6 +116,93 @@ def get_arguments_calc_auto(argv=None):
         default=False,
         help="Re-calculate estimates and overwrite existing splitting "+
         "results without re-downloading data. [Default False]")
+    parser.add_argument(
+        "--compact-results",
+        action="store_true",
+        dest="compact",
+        default=False,
+        help="Save compact splitting results, without the corrected " +
+        "traces, which are recalculated from the LQT data when needed. " +
+        "Reduces the size of saved results. [Default False]")
+    parser.add_argument(
+        "--no-Emat",
+        action="store_false",
+        dest="keepEmat",
+        default=True,
+        help="Do not keep the error minimization matrices in compact " +
+        "results (only used with --compact-results). The matrices are " +
+        "then recalculated when plotting. [Default keeps matrices]")
+    parser.add_argument(
+        "--no-journal",
+        action="store_false",
+        dest="journal",
+        default=True,
+        help="Do not use the run journal of each station. By default, the " +
+        "status of each event (rejected, downloaded, analyzed or saved) " +
+        "is recorded in DATA/<STKEY>/journal_auto.jnl, and events that " +
+        "were completed with the same parameters are skipped when the " +
+        "run is repeated (unless overwriting). [Default uses journal]")
+
+    # Work Queue Settings
+    QueueGroup = parser.add_argument_group(
+        title="Work Queue Settings",
+        description="Settings associated with distributing the processing " +
+        "across processes or nodes with a work queue in a shared directory")
+    QueueGroup.add_argument(
+        "--queue",
+        action="store",
+        type=str,
+        dest="queue",
+        default=None,
+        help="Specify a shared directory for the work queue. The " +
+        "stations (or time ranges of stations) are added as tasks, and " +
+        "tasks are claimed and processed until all are completed. Run " +
+        "the same command on any number of nodes to share the work. " +
+        "[Default None, i.e., stations are processed in order]")
+    QueueGroup.add_argument(
+        "--chunk-days",
+        action="store",
+        type=float,
+        dest="chunk",
+        default=None,
+        help="Specify the length (days) of the time ranges of the tasks " +
+        "of each station in the work queue. [Default None, i.e., one " +
+        "task per station]")
+    QueueGroup.add_argument(
+        "--lease",
+        action="store",
+        type=float,
+        dest="lease",
+        default=600.,
+        help="Specify the duration (sec) of the leases on tasks. A task " +
+        "whose lease is not renewed within this duration (e.g., after a " +
+        "node failure) is claimed again by another process. [Default 600]")
+    QueueGroup.add_argument(
+        "--poll",
+        action="store",
+        type=float,
+        dest="poll",
+        default=10.,
+        help="Specify the time (sec) between attempts to claim a task " +
+        "when none is available. [Default 10]")
+    QueueGroup.add_argument(
+        "--daemon",
+        action="store_true",
+        dest="daemon",
+        default=False,
+        help="Run as a daemon that processes the jobs submitted to the " +
+        "work queue (used as a spool directory) as they arrive, keeping " +
+        "the station database, travel-time tables and clients in memory. " +
+        "Create a file named 'stop' in the queue directory to stop it. " +
+        "Requires --queue. [Default False]")
+    QueueGroup.add_argument(
+        "--submit",
+        action="store_true",
+        dest="submit",
+        default=False,
+        help="Submit the selected stations and time range as jobs to the " +
+        "work queue of a daemon, with the processing parameters of this " +
+        "command, and exit. Requires --queue. [Default False]")
 
     # Server Settings
     ServerGroup = parser.add_argument_group(
@@ -157,6 +244,58 @@ def get_arguments_calc_auto(argv=None):
         "If data exists for a seismogram is already present on " +
         "disk, it is selected preferentially over downloading " +
         "the data using the Client interface")
+    DataGroup.add_argument(
+        "--local-format",
+        action="store",
+        type=str,
+        dest="lclfmt",
+        default="SAC",
+        choices=["SAC", "SDS"],
+        help="Format of the local data. 'SAC' for day-long SAC files " +
+        "named YYYY.JJJ.NET.STA.LOC.CHA.SAC, 'SDS' for miniSEED day " +
+        "volumes in SDS archives (YEAR/NET/STA/CHA.D/ directories), " +
+        "where only the records overlapping each window are read. " +
+        "The local index and memory-mapping options only apply to SAC " +
+        "files. [Default 'SAC']")
+    DataGroup.add_argument(
+        "--local-index",
+        action="store",
+        type=str,
+        dest="lclindex",
+        default=None,
+        help="Specify a file name for a persistent (SQLite) index of the " +
+        "local data directories. The index is created if it does not " +
+        "exist and is otherwise only updated for directories that have " +
+        "changed, instead of walking all directories for each station. " +
+        "[Default no index]")
+    DataGroup.add_argument(
+        "--local-mmap",
+        action="store_true",
+        dest="lclmmap",
+        default=False,
+        help="Read event windows from local SAC files by memory-mapping " +
+        "the data blocks, instead of reading complete day files. " +
+        "[Default False]")
+    DataGroup.add_argument(
+        "--cache",
+        action="store",
+        type=str,
+        dest="wfcache",
+        default=None,
+        help="Specify a directory for an on-disk cache of raw waveforms. " +
+        "Waveforms are retrieved from the cache if the same request " +
+        "(station, channels, time window and data source) was made " +
+        "before, which avoids downloading or reading them again when " +
+        "re-running with different settings. [Default no cache]")
+    DataGroup.add_argument(
+        "--cache-size",
+        action="store",
+        type=float,
+        dest="wfcachesize",
+        default=1000.,
+        help="Specify the maximum size of the waveform cache (MB). The " +
+        "least recently used waveforms are removed when the cache " +
+        "exceeds this size. [Default 1000]")
     DataGroup.add_argument(
         "--no-data-zero",
         action="store_true",
@@ -249,6 +388,37 @@ def get_arguments_calc_auto(argv=None):
         default=0.5,
         help="Specify the maximum frequency corner for bandpass " +
         "filter (Hz). [Default 0.5]")
+    ConstGroup.add_argument(
+        "--fused-preprocessing",
+        action="store_true",
+        dest="fused",
+        default=False,
+        help="Specify to filter, resample, rotate and bandpass filter " +
+        "the downloaded (detrended and tapered) data in a single " +
+        "frequency-domain pass, instead of separate steps. The results " +
+        "agree to within 1 percent of the maximum amplitude away from " +
+        "the ends of the traces. [Default False]")
+    ConstGroup.add_argument(
+        "--prescreen-margin",
+        action="store",
+        type=float,
+        dest="prescreen",
+        default=None,
+        help="Specify a margin (dB) to reject events before preprocessing " +
+        "with a cheap SNR estimate on the raw horizontal components. " +
+        "Events with an estimate lower than the minimum SNR minus this " +
+        "margin are not processed further. [Default None, i.e., no " +
+        "pre-screen]")
+    ConstGroup.add_argument(
+        "--cluster-windows",
+        action="store_true",
+        dest="cluster",
+        default=False,
+        help="Specify to select the analysis window automatically, with " +
+        "a cluster analysis of the estimates of 100 windows starting " +
+        "between 10 and 2 sec before and ending between 15 and 35 sec " +
+        "after the predicted arrival. [Default False, i.e., the window " +
+        "starts 5 sec before and ends 25 sec after the arrival]")
 
     # Event Selection Criteria
     EventGroup = parser.add_argument_group(
@@ -327,7 +497,12 @@ def get_arguments_calc_auto(argv=None):
         dest="phase",
         default='SKS',
         help="Specify the phase name to use. Be careful with the distance. " +
-        "setting. Options are 'SKS' or 'SKKS'. [Default 'SKS']")
+        "setting. Options are 'SKS', 'SKKS', 'PKS' or 'S', or a comma " +
+        "separated list of phases (e.g., 'SKS,SKKS') to analyze each " +
+        "phase from a single retrieval of the data. The results of the " +
+        "first phase are saved as usual, and those of the other phases " +
+        "side by side, with the phase name as suffix (e.g., " +
+        "'results_auto_SKKS'). [Default 'SKS']")
 
     args = parser.parse_args(argv)
 
@@ -390,11 +565,13 @@ def get_arguments_calc_auto(argv=None):
     else:
         args.ndval = nan
 
-    # Check distances for selected phase
-    if args.phase not in ['SKS', 'SKKS']:
+    # Check distances for selected phases
+    phases = args.phase.split(',')
+    if not all(phase in ['SKS', 'SKKS', 'PKS', 'S'] for phase in phases) or \
+            len(set(phases)) < len(phases):
         parser.error(
-            "Error: choose between 'SKS' and 'SKKS.")
-    if args.phase == 'SKS' or 'SKKS':
+            "Error: choose between 'SKS', 'SKKS', 'PKS' and 'S'.")
+    if all(phase in ['SKS', 'SKKS'] for phase in phases):
         if not args.mindist:
             args.mindist = 85.
         if not args.maxdist:
@@ -404,6 +581,16 @@ def get_arguments_calc_auto(argv=None):
                 "Distances should be between 85 and 120 deg. for " +
                 "teleseismic 'SKS' and 'SKKS' waves.")
 
+    # Check work queue settings
+    if args.chunk is not None and args.chunk <= 0.:
+        parser.error("Error: --chunk-days must be positive")
+    if args.lease <= 0.:
+        parser.error("Error: --lease must be positive")
+    if (args.daemon or args.submit) and args.queue is None:
+        parser.error("Error: --daemon and --submit require --queue")
+    if args.daemon and args.submit:
+        parser.error("Error: choose between --daemon and --submit")
+
     return args
 
 
@@ -559,7 +746,7 @@ def get_arguments_average(argv=None):
     parser = ArgumentParser(
         usage="%(prog)s [arguments] <station database>",
         description="Script to plot the average splitting results for a " +
-        "given station. Loads the available .pkl files in the specified " +
+        "given station. Loads the available results in the specified " +
         "Station Directory.")
 
     # General Settings
@@ -600,6 +787,15 @@ def get_arguments_average(argv=None):
         default=False,
         help="Specify to use automatically processed split results. "+
         "[Default uses refined ('manual') split results]")
+    parser.add_argument(
+        "--stack",
+        action="store_true",
+        dest="stack",
+        default=False,
+        help="Specify to also stack the normalized Silver-Chan error " +
+        "surfaces of the selected events (Wolfe and Silver, 1998) and " +
+        "report the minimum of the stack with its confidence region. " +
+        "[Default False]")
 
     # Null Settings
     NullGroup = parser.add_argument_group(
@@ -727,3 +923,132 @@ def get_arguments_average(argv=None):
 
     return args
 
+
+
+def get_arguments_migrate(argv=None):
+
+    parser = ArgumentParser(
+        usage="%(prog)s [arguments] <station database>",
+        description="Script to convert the event folders of pickle files " +
+        "saved in the 'DATA' directory by earlier versions of the " +
+        "processing scripts to a single store file per station.")
+
+    # General Settings
+    parser.add_argument(
+        "indb",
+        help="Station Database to process from.",
+        type=str)
+    parser.add_argument(
+        "--keys",
+        action="store",
+        type=str,
+        dest="stkeys",
+        default="",
+        help="Specify a comma separated list of station keys " +
+        "for which to perform analysis. These must be " +
+        "contained within the station database. Partial keys " +
+        "will be used to match against those in the " +
+        "dictionary. For instance, providing IU will match " +
+        "with all stations in the IU network [Default " +
+        "processes all stations in the database]")
+    parser.add_argument(
+        "-v", "-V", "--verbose",
+        action="store_true",
+        dest="verb",
+        default=False,
+        help="Specify to increase verbosity.")
+    parser.add_argument(
+        "--remove",
+        action="store_true",
+        dest="remove",
+        default=False,
+        help="Specify to remove the pickle files once converted. " +
+        "Figures saved in the event folders are kept. " +
+        "[Default keeps the pickle files]")
+
+    args = parser.parse_args(argv)
+
+    # Check inputs
+    if not exist(args.indb):
+        parser.error("Input file " + args.indb + " does not exist")
+
+    # create station key list
+    if len(args.stkeys) > 0:
+        args.stkeys = args.stkeys.split(',')
+
+    return args
+
+
+def get_arguments_calc_batch(argv=None):
+
+    parser = ArgumentParser(
+        usage="%(prog)s [arguments] <station database> <job file>",
+        description="Script to process the stations of a job with several " +
+        "analysis configurations (e.g., frequency bands, phases or time " +
+        "windows), described in a job file in JSON format. The data of " +
+        "each event are retrieved and preprocessed once for all " +
+        "configurations, and the results of each configuration are saved " +
+        "in its own directory. See the documentation of the " +
+        "splitpy.batch module for the format of the job file.")
+
+    # General Settings
+    parser.add_argument(
+        "indb",
+        help="Station Database to process from.",
+        type=str)
+    parser.add_argument(
+        "spec",
+        help="Job file (JSON).",
+        type=str)
+    parser.add_argument(
+        "-v", "-V", "--verbose",
+        action="store_true",
+        dest="verb",
+        default=False,
+        help="Specify to increase verbosity.")
+
+    # Work Queue Settings
+    QueueGroup = parser.add_argument_group(
+        title="Work Queue Settings",
+        description="Settings associated with distributing the processing " +
+        "across processes or nodes with a work queue in a shared directory")
+    QueueGroup.add_argument(
+        "--queue",
+        action="store",
+        type=str,
+        dest="queue",
+        default=None,
+        help="Specify a shared directory for the work queue. The " +
+        "stations are added as tasks, and tasks are claimed and processed " +
+        "until all are completed. Run the same command on any number of " +
+        "nodes to share the work. [Default None, i.e., stations are " +
+        "processed in order]")
+    QueueGroup.add_argument(
+        "--lease",
+        action="store",
+        type=float,
+        dest="lease",
+        default=3600.,
+        help="Specify the duration (sec) of the leases on tasks. A task " +
+        "whose lease is not renewed within this duration (e.g., after a " +
+        "node failure) is claimed again by another process. [Default 3600]")
+    QueueGroup.add_argument(
+        "--poll",
+        action="store",
+        type=float,
+        dest="poll",
+        default=10.,
+        help="Specify the time (sec) between attempts to claim a task " +
+        "when none is available. [Default 10]")
+
+    args = parser.parse_args(argv)
+
+    # Check inputs
+    if not exist(args.indb):
+        parser.error("Input file " + args.indb + " does not exist")
+    if not exist(args.spec):
+        parser.error("Job file " + args.spec + " does not exist")
+    if args.lease <= 0.:
+        parser.error("Error: --lease must be positive")
+
+    return args
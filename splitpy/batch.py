@@ -0,0 +1,491 @@
+# Copyright 2019 Pascal Audet & Andrew Schaeffer
+#
+# This file is part of SplitPy.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+
+Module for batch processing of stations with several analysis
+configurations, described in a job specification file (JSON):
+
+.. code-block:: json
+
+    {
+        "stations": ["NY.MMPY"],
+        "start": "2016-01-01",
+        "end": "2017-01-01",
+        "minmag": 6.0,
+        "server": "IRIS",
+        "sampling_rate": 10.0,
+        "outdir": "BATCH",
+        "defaults": {"maxdt": 4.0, "msnr": 5.0},
+        "configs": {
+            "SKS_low": {"fmin": 0.02, "fmax": 0.2},
+            "SKS_high": {"fmin": 0.05, "fmax": 0.5},
+            "SKKS": {"phase": "SKKS", "dts": 150.0}
+        }
+    }
+
+The data of each event are retrieved and preprocessed (filtered and
+resampled) once over the union of the windows of all configurations,
+and the window of each configuration is then rotated, filtered and
+analyzed. The results of each configuration are saved in its own
+namespace, i.e., a station directory ``<outdir>/<config>/<station key>``
+with its store, results table, error surface cube and run journal (see
+:mod:`~splitpy.store`).
+
+See :data:`~splitpy.batch.JOB_DEFAULTS` and
+:data:`~splitpy.batch.CONFIG_DEFAULTS` for the available settings.
+
+"""
+
+# -*- coding: utf-8 -*-
+import re
+import json
+from pathlib import Path
+import numpy as np
+from obspy import UTCDateTime
+from splitpy import utils, store
+from splitpy.classes import Split
+
+
+# Settings of a job
+JOB_DEFAULTS = {
+    'stations': [],          # Station keys (or partial keys); [] for all
+    'start': None,           # Start time of catalogue search
+    'end': None,             # End time of catalogue search
+    'minmag': 6.0,           # Minimum magnitude
+    'maxmag': None,          # Maximum magnitude
+    'server': 'IRIS',        # FDSN data center
+    'user_auth': None,       # 'user:password' for restricted data
+    'localdata': [],         # Local SAC or SDS data directories
+    'lclfmt': 'SAC',         # Format of local data ('SAC' or 'SDS')
+    'ndval': None,           # Fill value for missing data (None for NaN)
+    'sampling_rate': 10.,    # Sampling rate of data (Hz)
+    'outdir': 'BATCH',       # Output directory
+    'defaults': {},          # Settings common to all configurations
+    'configs': {}}           # Settings of each configuration
+
+# Settings of an analysis configuration
+CONFIG_DEFAULTS = {
+    'phase': 'SKS',          # Phase ('SKS', 'SKKS', 'PKS' or 'S')
+    'mindist': 85.,          # Minimum distance (degrees)
+    'maxdist': 120.,         # Maximum distance (degrees)
+    'dts': 120.,             # Time before and after the arrival (sec)
+    'fmin': 0.02,            # Minimum frequency of bandpass filter (Hz)
+    'fmax': 0.5,             # Maximum frequency of bandpass filter (Hz)
+    'msnr': 5.,              # Minimum SNR on the Q component (dB)
+    'snrTlim': 1.,           # Maximum SNR on the T component for Nulls (dB)
+    'maxdt': 4.,             # Maximum delay time in search (sec)
+    'ddt': 0.1,              # Delay time increment (sec)
+    'dphi': 1.,              # Fast axis increment (degrees)
+    'cluster': False,        # Whether to select the window by clusters
+    'compact': False}        # Whether to save compact results
+
+
+def load_spec(file):
+    """
+    Loads and checks a job specification file
+
+    Parameters
+    ----------
+    file : str
+        Name of JSON file
+
+    Returns
+    -------
+    spec : Dict
+        Job settings, with the settings of each configuration in
+        ``spec['configs']`` completed with the defaults
+
+    """
+
+    with open(file) as f:
+        spec = json.load(f)
+
+    return check_spec(spec)
+
+
+def check_spec(spec):
+    """
+    Checks a job specification and completes it with the defaults (see
+    :func:`~splitpy.batch.load_spec`)
+
+    """
+
+    unknown = set(spec) - set(JOB_DEFAULTS)
+    if len(unknown) > 0:
+        raise ValueError("Unknown job settings: " + ", ".join(sorted(unknown)))
+    job = dict(JOB_DEFAULTS)
+    job.update(spec)
+    if len(job['configs']) == 0:
+        raise ValueError("No analysis configuration in job")
+
+    configs = {}
+    for name, settings in job['configs'].items():
+        if not re.match(r'^[\w.+-]+$', name):
+            raise ValueError("Invalid configuration name: " + name)
+        config = dict(CONFIG_DEFAULTS)
+        for source in [job['defaults'], settings]:
+            unknown = set(source) - set(CONFIG_DEFAULTS)
+            if len(unknown) > 0:
+                raise ValueError("Unknown settings in configuration " +
+                                 name + ": " + ", ".join(sorted(unknown)))
+            config.update(source)
+        if config['phase'] not in ['SKS', 'SKKS', 'PKS', 'S']:
+            raise ValueError("Phase should be 'SKS', 'SKKS', 'PKS' or 'S' " +
+                             "in configuration " + name)
+        if config['fmin'] >= config['fmax'] or \
+                config['fmax'] >= 0.5*job['sampling_rate']:
+            raise ValueError("Invalid frequency band in configuration " +
+                             name)
+        configs[name] = config
+    job['configs'] = configs
+
+    for key in ['start', 'end']:
+        if job[key] is not None:
+            job[key] = UTCDateTime(job[key])
+    if isinstance(job['stations'], str):
+        job['stations'] = job['stations'].split(',')
+    job['ndval'] = np.nan if job['ndval'] is None else float(job['ndval'])
+
+    return job
+
+
+def select_stations(spec, db):
+    """
+    Returns the keys of the station database selected in a job
+
+    """
+
+    if len(spec['stations']) == 0:
+        return sorted(db.keys())
+    return sorted(set(key for key in db.keys()
+                      for part in spec['stations'] if part in key))
+
+
+def get_clients(spec):
+    """
+    Returns the FDSN clients for the waveforms and events of a job
+
+    """
+
+    from obspy.clients.fdsn import Client
+
+    if spec['user_auth'] is None:
+        data_client = Client(spec['server'])
+    else:
+        user, password = spec['user_auth'].split(':')
+        data_client = Client(spec['server'], user=user, password=password)
+
+    return data_client, Client()
+
+
+def analyze_config(config, sta, meta, dataZNE, verbose=False):
+    """
+    Analyzes the window of an analysis configuration, taken from data
+    preprocessed for all configurations
+
+    Parameters
+    ----------
+    config : Dict
+        Settings of configuration
+    sta : :class:`~stdb.StDbElement`
+        Station metadata
+    meta : :class:`~splitpy.classes.Meta`
+        Event metadata for the phase of the configuration
+    dataZNE : :class:`~obspy.core.Stream`
+        Filtered and resampled ZNE data that cover the window
+
+    Returns
+    -------
+    split : :class:`~splitpy.classes.Split`
+        Split object
+    status : str
+        Status of event (see :data:`~splitpy.store.JOURNAL_STATUS`)
+
+    """
+
+    split = Split(sta)
+    split.meta = meta
+    meta.maxdt = config['maxdt']
+    meta.ddt = config['ddt']
+    meta.dphi = config['dphi']
+
+    # Window of configuration
+    t0 = meta.time + meta.ttime
+    split.dataZNE = dataZNE.slice(t0 - config['dts'], t0 + config['dts'])
+
+    # Rotate, filter and calculate SNR
+    split.rotate(align='LQT')
+    split.dataLQT.filter('bandpass', freqmin=config['fmin'],
+                         freqmax=config['fmax'])
+    split.calc_snr()
+    if not split.meta.snrq >= config['msnr']:
+        return split, 'rejected/SNR'
+
+    if config['cluster']:
+        split.cluster_analysis(verbose=verbose)
+    else:
+        split.analyze(verbose=verbose)
+    if split.RC_res.edtt is None or split.SC_res.edtt is None:
+        return split, 'rejected/analysis'
+    split.is_null(config['snrTlim'], verbose=verbose)
+    split.get_quality(verbose=verbose)
+
+    return split, 'analyzed'
+
+
+def save_config(config, datapath, ststore, split):
+    """
+    Saves the data and results of an analysis configuration
+
+    """
+
+    key = split.meta.time.strftime("%Y%m%d_%H%M%S")
+    ststore.put(key, 'ZNE', split.dataZNE)
+    ststore.put(key, 'LQT', split.dataLQT)
+    ststore.put(key, 'meta', split.meta)
+    ststore.put(key, 'station', split.sta)
+    results = {'SC_res': split.SC_res, 'RC_res': split.RC_res,
+               'null': split.null, 'quality': split.quality}
+    if config['compact']:
+        results['SC_res'] = split.SC_res.compact('SC')
+        results['RC_res'] = split.RC_res.compact('RC')
+    ststore.put(key, 'results_auto', results)
+    store.ResultsTable(datapath, 'results_auto').append(
+        key, split.meta, results, store=ststore)
+    store.EmatCube(datapath, 'results_auto').append(
+        key, split.meta, results, store=ststore)
+    ststore.sync()
+
+
+def process_station(spec, stkey, sta, paths=None, journals=None,
+                    data_client=None, event_client=None, tstart=None,
+                    tend=None, verbose=False):
+    """
+    Processes the events of a station with all the configurations of a
+    job. Each event is retrieved and preprocessed once, and analyzed with
+    each configuration for which it is within the distance range and that
+    has not completed the event (according to the run journal of the
+    configuration).
+
+    Parameters
+    ----------
+    spec : Dict
+        Job settings (see :func:`~splitpy.batch.load_spec`)
+    stkey : str
+        Station key
+    sta : :class:`~stdb.StDbElement`
+        Station metadata
+    paths : Dict
+        Station directory of each configuration (default
+        ``<outdir>/<config>/<stkey>``)
+    journals : Dict
+        Status of events of each configuration completed elsewhere (e.g.,
+        in the namespace of the configuration, when processing in a
+        partial directory)
+    data_client : :class:`~obspy.clients.fdsn.Client`
+        Client for waveforms
+    event_client : :class:`~obspy.clients.fdsn.Client`
+        Client for events
+    tstart : :class:`~obspy.core.UTCDateTime`
+        Start time of catalogue search (overrides the job settings)
+    tend : :class:`~obspy.core.UTCDateTime`
+        End time of catalogue search (overrides the job settings)
+
+    Returns
+    -------
+    counts : Dict
+        Number of events of each configuration with each status
+
+    """
+
+    from splitpy import archive
+
+    configs = spec['configs']
+    if paths is None:
+        paths = {name: Path(spec['outdir']) / name / stkey
+                 for name in configs}
+    if data_client is None or event_client is None:
+        data_client, event_client = get_clients(spec)
+
+    # Outputs of each configuration
+    seeds = journals
+    stores = {}
+    journals = {}
+    for name, config in configs.items():
+        Path(paths[name]).mkdir(parents=True, exist_ok=True)
+        stores[name] = store.open_store(paths[name])
+        journals[name] = store.RunJournal(paths[name], config)
+        for key, status in (seeds or {}).get(name, {}).items():
+            journals[name].status.setdefault(key, status)
+    counts = {name: {} for name in configs}
+
+    def record(name, key, status):
+        journals[name].record(key, status)
+        counts[name][status] = counts[name].get(status, 0) + 1
+
+    # Events
+    tstart = tstart or spec['start'] or sta.startdate
+    tend = tend or spec['end'] or sta.enddate
+    if tstart > sta.enddate or tend < sta.startdate:
+        return counts
+    cat = event_client.get_events(
+        starttime=tstart, endtime=tend, minmagnitude=spec['minmag'],
+        maxmagnitude=spec['maxmag'])
+
+    # Local data
+    stdata = []
+    if len(spec['localdata']) > 0:
+        if spec['lclfmt'] == 'SDS':
+            stdata = archive.SDSReader(spec['localdata'], sta)
+        else:
+            stdata = utils.list_local_data_stn(
+                lcldrs=spec['localdata'], sta=sta.station,
+                net=sta.network, altnet=sta.altnet)
+
+    # Pre-select events within the largest distance annulus
+    keep = utils.prefilter_events(
+        cat, sta, gacmin=min(c['mindist'] for c in configs.values()),
+        gacmax=max(c['maxdist'] for c in configs.values()))[0]
+
+    for iev in np.flatnonzero(keep):
+        event = cat[int(iev)]
+        key = event.origins[0].time.strftime("%Y%m%d_%H%M%S")
+
+        # Metadata of the phase of each configuration to process
+        metas = {}
+        for name, config in configs.items():
+            if journals[name].done(key):
+                continue
+            split = Split(sta)
+            if split.add_event(event, gacmin=config['mindist'],
+                               gacmax=config['maxdist'],
+                               phase=config['phase'], returned=True):
+                metas[name] = split.meta
+            else:
+                record(name, key, 'rejected/geometry')
+        if len(metas) == 0:
+            continue
+
+        # Retrieve and preprocess once over all windows
+        t0 = [metas[name].time + metas[name].ttime - configs[name]['dts']
+              for name in metas]
+        t1 = [metas[name].time + metas[name].ttime + configs[name]['dts']
+              for name in metas]
+        base = Split(sta)
+        base.meta = next(iter(metas.values()))
+        if verbose:
+            print("* Event {0}: {1}".format(key, ", ".join(metas)))
+        if not base.download_data(
+                client=data_client, stdata=stdata, ndval=spec['ndval'],
+                new_sr=spec['sampling_rate'], window=(min(t0), max(t1)),
+                returned=True, verbose=verbose):
+            continue
+
+        # Fan out to configurations
+        for name, meta in metas.items():
+            split, status = analyze_config(
+                configs[name], sta, meta, base.dataZNE, verbose=verbose)
+            if status == 'analyzed':
+                save_config(configs[name], paths[name], stores[name], split)
+                status = 'saved'
+            record(name, key, status)
+
+    return counts
+
+
+def run(spec, db, queue=None, lease=3600., poll=10., verbose=False):
+    """
+    Runs a job. Without a work queue, the stations are processed in
+    order. With a work queue (see :mod:`~splitpy.workqueue`), each station
+    is a task processed by any of the processes sharing the queue, in a
+    partial directory for each configuration that is merged in the
+    namespace of the configuration once completed.
+
+    Parameters
+    ----------
+    spec : Dict
+        Job settings (see :func:`~splitpy.batch.load_spec`)
+    db : Dict
+        Station database
+    queue : str
+        Work queue directory (optional)
+    lease : float
+        Duration of leases (sec)
+    poll : float
+        Time between attempts to claim a task (sec)
+
+    Returns
+    -------
+    counts : Dict
+        Number of events of each station and configuration with each
+        status, for the stations processed by this process
+
+    """
+
+    from splitpy import workqueue
+
+    stkeys = select_stations(spec, db)
+    configs = spec['configs']
+    clients = []
+
+    def process(stkey, paths=None, journals=None):
+        if len(clients) == 0:
+            clients.extend(get_clients(spec))
+        return process_station(
+            spec, stkey, db[stkey], paths=paths, journals=journals,
+            data_client=clients[0], event_client=clients[1],
+            verbose=verbose)
+
+    counts = {}
+    if queue is None:
+        for stkey in stkeys:
+            counts[stkey] = process(stkey)
+        return counts
+
+    wq = workqueue.WorkQueue(queue, lease=lease)
+    for stkey in stkeys:
+        wq.add(stkey, {'station': stkey})
+        wq.add(stkey + '_merge', {'station': stkey, 'merge': stkey},
+               after=[stkey])
+
+    def process_task(lease):
+        stkey = lease.task['station']
+        datapaths = {name: Path(spec['outdir']) / name / stkey
+                     for name in configs}
+        if 'merge' in lease.task:
+            part = '{0}.{1:d}'.format(
+                stkey, wq.result(stkey)['generation'])
+            for name, datapath in datapaths.items():
+                store.merge_parts(datapath, [datapath / 'parts' / part])
+            return
+
+        # Events completed in the namespaces are skipped
+        part = '{0}.{1:d}'.format(lease.name, lease.generation)
+        paths = {name: datapath / 'parts' / part
+                 for name, datapath in datapaths.items()}
+        counts[stkey] = process(stkey, paths=paths, journals={
+            name: store.RunJournal(datapaths[name], config).status
+            for name, config in configs.items()})
+
+    wq.run(process_task, poll=poll, verbose=verbose)
+
+    return counts
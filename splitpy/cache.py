@@ -0,0 +1,230 @@
+# Copyright 2019 Pascal Audet & Andrew Schaeffer
+#
+# This file is part of SplitPy.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+
+Module containing an on-disk cache of raw waveforms, placed in front of
+:func:`~splitpy.utils.download_data`.
+
+Each request is identified by a content key, i.e., a hash of the network,
+station, location, channels, time window and source (data center or local
+archive) of the request. The traces returned for the request are stored
+as a single binary ``.npz`` file named after the key. The total size of
+the cache is bounded: when it is exceeded, the least recently used files
+are removed.
+
+"""
+
+# -*- coding: utf-8 -*-
+import os
+import json
+import hashlib
+import numpy as np
+
+
+class WaveformCache(object):
+    """
+    A WaveformCache object stores raw waveforms on disk, keyed by request.
+
+    Attributes
+    ----------
+    path : str
+        Cache directory
+    maxsize : float
+        Maximum total size of the cache (bytes)
+    hits : int
+        Number of requests found in cache
+    misses : int
+        Number of requests not found in cache
+
+    """
+
+    def __init__(self, path, maxsize=1.e9):
+
+        self.path = str(path)
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._total = None
+        os.makedirs(self.path, exist_ok=True)
+
+    @staticmethod
+    def key(net, sta, loc, channels, start, end, source):
+        """
+        Returns the content key of a waveform request
+
+        Parameters
+        ----------
+        net : str
+            Network code
+        sta : str
+            Station code
+        loc : str
+            Location code
+        channels : str
+            Comma-separated list of channels
+        start : :class:`~obspy.core.utcdatetime.UTCDateTime`
+            Start time for request
+        end : :class:`~obspy.core.utcdatetime.UTCDateTime`
+            End time for request
+        source : str
+            Data source (e.g., base URL of data center, or ``'local'``)
+
+        Returns
+        -------
+        key : str
+            Hexadecimal SHA-1 digest of the request
+
+        """
+
+        request = "|".join([net, sta, loc, channels, str(start), str(end),
+                            str(source)])
+        return hashlib.sha1(request.encode('utf-8')).hexdigest()
+
+    def _file(self, key):
+
+        return os.path.join(self.path, key + '.npz')
+
+    def get(self, key):
+        """
+        Returns the waveforms stored for a request
+
+        Parameters
+        ----------
+        key : str
+            Content key of request
+
+        Returns
+        -------
+        st : :class:`~obspy.core.Stream`
+            Stored waveforms (possibly empty if the source had no data), or
+            `None` if the request is not in the cache
+
+        """
+
+        from obspy import Stream, Trace, UTCDateTime
+
+        file = self._file(key)
+        try:
+            with np.load(file) as npz:
+                headers = json.loads(str(npz['headers']))
+                traces = []
+                for i, head in enumerate(headers):
+                    tr = Trace(data=npz['data{0:d}'.format(i)])
+                    tr.stats.network = head['network']
+                    tr.stats.station = head['station']
+                    tr.stats.location = head['location']
+                    tr.stats.channel = head['channel']
+                    tr.stats.sampling_rate = head['sampling_rate']
+                    tr.stats.starttime = UTCDateTime(head['starttime'])
+                    traces.append(tr)
+        except (OSError, KeyError, ValueError):
+            self.misses += 1
+            return None
+
+        # Mark as recently used
+        try:
+            os.utime(file)
+        except OSError:
+            pass
+        self.hits += 1
+
+        return Stream(traces=traces)
+
+    def put(self, key, st):
+        """
+        Stores the waveforms returned for a request, and evicts the least
+        recently used requests if the cache exceeds its maximum size
+
+        Parameters
+        ----------
+        key : str
+            Content key of request
+        st : :class:`~obspy.core.Stream`
+            Waveforms
+
+        """
+
+        headers = [{'network': tr.stats.network,
+                    'station': tr.stats.station,
+                    'location': tr.stats.location,
+                    'channel': tr.stats.channel,
+                    'sampling_rate': tr.stats.sampling_rate,
+                    'starttime': str(tr.stats.starttime)} for tr in st]
+        arrays = {'data{0:d}'.format(i): np.asarray(tr.data)
+                  for i, tr in enumerate(st)}
+
+        file = self._file(key)
+        tmpfile = file + '.{0:d}.tmp.npz'.format(os.getpid())
+        try:
+            np.savez(tmpfile, headers=json.dumps(headers), **arrays)
+            os.replace(tmpfile, file)
+        except OSError:
+            print("* Unable to write to waveform cache " + self.path)
+            return
+
+        # Keep a running total to avoid listing the cache at each write
+        if self._total is None:
+            self._total = self.size()
+        else:
+            self._total += os.path.getsize(file)
+        if self._total > self.maxsize:
+            self.evict()
+
+    def size(self):
+        """
+        Returns the total size of the cache (bytes)
+
+        """
+
+        return sum(size for file, size, mtime in self._entries())
+
+    def _entries(self):
+
+        entries = []
+        for entry in os.scandir(self.path):
+            if entry.name.endswith('.npz') and \
+                    not entry.name.endswith('.tmp.npz'):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((entry.path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def evict(self):
+        """
+        Removes the least recently used requests until the total size of
+        the cache is below its maximum size
+
+        """
+
+        entries = self._entries()
+        total = sum(size for file, size, mtime in entries)
+        for file, size, mtime in sorted(entries, key=lambda e: e[2]):
+            if total <= self.maxsize:
+                break
+            try:
+                os.remove(file)
+            except OSError:
+                pass
+            total -= size
+        self._total = total
@@ -114,36 +114,10 @@ def split_SilverChan(trQ, trT, baz, t1, t2, maxdt, ddt, dphi):
             # Energy on transverse component (component 1)
             Ematrix[p, t] = np.sum(np.square(corrected_QT[1]))
 
-    # Find indices of minimum value of Energy matrix
-    ind = np.where(Ematrix == Ematrix.min())
-    ind_phi = ind[0][0]
-    ind_dtt = ind[1][0]
-
-    # Get best-fit phi and dt
-    shift = dtt[ind_dtt]
-    phiSC_min = phi[ind_phi]*180./np.pi
-    phiSC = np.mod((phiSC_min + baz), 180.)
-
-    if phiSC > 90.:
-        phiSC = phiSC - 180.
-
-    FS_test = np.dot(np.array(M[:, :, ind_phi]),
-                     np.array([trQ_tmp.data, trT_tmp.data]))
+    phiSC, shift, phiSC_min = best_SilverChan(Ematrix, baz, maxdt, ddt, dphi)
 
-    F0 = Trace(data=FS_test[0], header=trQ_tmp.stats)
-    F1 = Trace(data=FS_test[1], header=trT_tmp.stats)
-
-    tmpFast = tshift(F0, -shift/2.)
-    tmpSlow = tshift(F1, shift/2.)
-
-    corrected_QT = np.dot(
-        inv(np.array(M[:, :, ind_phi])), np.array([tmpFast, tmpSlow]))
-
-    trQ_c = Trace(data=corrected_QT[0], header=trQ_tmp.stats)
-    trT_c = Trace(data=corrected_QT[1], header=trT_tmp.stats)
-
-    trFast = Trace(data=tmpFast, header=trT_tmp.stats)
-    trSlow = Trace(data=tmpSlow, header=trQ_tmp.stats)
+    trQ_c, trT_c, trFast, trSlow = split_correct(
+        trQ, trT, t1, t2, phiSC_min, -shift)
 
     return Ematrix, trQ_c, trT_c, trFast, trSlow, \
         phiSC, shift, phiSC_min
@@ -239,11 +213,94 @@ def split_RotCorr(trQ, trT, baz, t1, t2, maxdt, ddt, dphi):
             Cmatrix_pos[p, t] = cor_pos[0]
             Cmatrix_neg[p, t] = cor_neg[0]
 
+    Cmap, phiRC, dtRC, phiRC_max, theta = best_RotCorr(
+        Cmatrix_pos, Cmatrix_neg, baz, maxdt, ddt, dphi)
+    shift = dtRC
+
+    trQ_c, trT_c, trFast, trSlow = split_correct(
+        trQ, trT, t1, t2, theta*180./np.pi, shift)
+
+    return Cmap, trQ_c, trT_c, trFast, trSlow, \
+        phiRC, dtRC, phiRC_max
+
+
+def best_SilverChan(Ematrix, baz, maxdt, ddt, dphi):
+    """
+    Finds the splitting parameters at the minimum of the energy matrix
+    of the Silver-Chan method
+
+    Parameters
+    ----------
+    Ematrix : :class:`~numpy.ndarray`
+        Matrix of T component energy
+    baz : float
+        Back-azimuth - pointing to earthquake from station (degrees)
+
+    Returns
+    -------
+    phiSC : float
+        Azimuth of fast axis (deg)
+    dttSC : float
+        Delay time between fast and slow axes (sec)
+    phi_min : float
+        Azimuth used in plotting routine
+
+    """
+
+    phi = np.arange(-90.0, 90.0, dphi)*np.pi/180.
+    dtt = np.arange(0., maxdt, ddt)
+
+    # Find indices of minimum value of Energy matrix
+    ind = np.where(Ematrix == Ematrix.min())
+    ind_phi = ind[0][0]
+    ind_dtt = ind[1][0]
+
+    # Get best-fit phi and dt
+    shift = dtt[ind_dtt]
+    phiSC_min = phi[ind_phi]*180./np.pi
+    phiSC = np.mod((phiSC_min + baz), 180.)
+
+    if phiSC > 90.:
+        phiSC = phiSC - 180.
+
+    return phiSC, shift, phiSC_min
+
+
+def best_RotCorr(Cmatrix_pos, Cmatrix_neg, baz, maxdt, ddt, dphi):
+    """
+    Finds the splitting parameters at the maximum absolute correlation
+    of the Rotation-Correlation method
+
+    Parameters
+    ----------
+    Cmatrix_pos : :class:`~numpy.ndarray`
+        Matrix of correlation for positive time shifts
+    Cmatrix_neg : :class:`~numpy.ndarray`
+        Matrix of correlation for negative time shifts
+    baz : float
+        Back-azimuth - pointing to earthquake from station (degrees)
+
+    Returns
+    -------
+    Cmap : :class:`~numpy.ndarray`
+        Matrix of (negative) correlation
+    phiRC : float
+        Azimuth of fast axis (deg)
+    dtRC : float
+        Delay time between fast and slow axes (sec)
+    phi_max : float
+        Azimuth used in plotting routine
+    theta : float
+        Angle of rotation used for correction (rad)
+
+    """
+
+    phi = np.arange(-90.0, 90.0, dphi)*np.pi/180.
+    dtt = np.arange(0., maxdt, ddt)
+
     # Time shift is positive: fast axis arrives after slow axis
     if abs(Cmatrix_pos).max() > abs(Cmatrix_neg).max():
 
-        # print 'Cmatrix_pos is max'
-
         ind = np.where(Cmatrix_pos == max(
             Cmatrix_pos.max(), Cmatrix_pos.min(), key=abs))
         ind_phi = ind[0][0]
@@ -276,38 +333,290 @@ def split_RotCorr(trQ, trT, baz, t1, t2, maxdt, ddt, dphi):
         S = np.sign(max(Cmatrix_neg.max(), Cmatrix_neg.min(), key=abs))
 
     Cmap = Cmap * (-S)
-    shift = dtRC
     theta = theta + np.pi/2.
 
     if phiRC > 90.:
         phiRC = phiRC - 180.
 
-    M2 = np.zeros((2, 2))
-    M2[0, 0] = np.cos(theta)
-    M2[0, 1] = -np.sin(theta)
-    M2[1, 0] = np.sin(theta)
-    M2[1, 1] = np.cos(theta)
+    return Cmap, phiRC, dtRC, phiRC_max, theta
+
+
+def split_surfaces(Q, T, delta, maxdt, ddt, dphi):
+    """
+    Calculates the grid search surfaces of the Silver-Chan and
+    Rotation-Correlation methods for a batch of windows (e.g., the same
+    event filtered in several frequency bands), in closed form from the
+    spectra of the radial and tangential components. The time shifts of
+    :func:`~splitpy.calc.tshift` are applied to a few cross-spectra
+    instead of each rotated trace, such that the surfaces are identical
+    (to within rounding errors) to the ``Cmatrix`` and ``Ematrix`` of
+    :func:`~splitpy.calc.split_RotCorr` and
+    :func:`~splitpy.calc.split_SilverChan`, at a small fraction of the
+    cost.
+
+    Parameters
+    ----------
+    Q : :class:`~numpy.ndarray`
+        Radial component in the picking window, with shape (..., npts)
+    T : :class:`~numpy.ndarray`
+        Tangential component in the picking window
+    delta : float
+        Sampling interval (sec)
+
+    Returns
+    -------
+    Ematrix : :class:`~numpy.ndarray`
+        Matrices of T component energy, with shape (..., nphi, ndt)
+    Cmatrix_pos : :class:`~numpy.ndarray`
+        Matrices of correlation for positive time shifts
+    Cmatrix_neg : :class:`~numpy.ndarray`
+        Matrices of correlation for negative time shifts
+
+    """
 
-    FS_test = np.dot(np.array(M2[:, :]), np.array(
-        [trQ_tmp.data, trT_tmp.data]))
+    from scipy.fft import rfft, irfft
+
+    phi = np.arange(-90.0, 90.0, dphi)*np.pi/180.
+    dtt = np.arange(0., maxdt, ddt)
+    c = np.cos(phi)[:, None]
+    s = np.sin(phi)[:, None]
+
+    # Hann taper of the picking window, as in split_SilverChan
+    npts = np.shape(Q)[-1]
+    taper = Trace(data=np.ones(npts)).taper(
+        max_percentage=0.1, type='hann').data
+    Q = np.asarray(Q, dtype=float)*taper
+    T = np.asarray(T, dtype=float)*taper
+
+    # Weights of one-sided spectra and phase shifts of tshift
+    freq = np.fft.rfftfreq(npts, d=delta)
+    weight = np.full(len(freq), 2.)
+    weight[0] = 1.
+    if npts % 2 == 0:
+        weight[-1] = 1.
+    shift = np.exp(2.*np.pi*1j*np.outer(freq, dtt))
+
+    def expand(a):
+        return np.asarray(a)[..., None, None]
+
+    # Silver-Chan: energy of the corrected T component (Parseval), where
+    # the fast and slow components are shifted by -dt/2 and +dt/2. At the
+    # Nyquist frequency, the shifts reduce to a cosine of T.
+    fQ = rfft(Q, axis=-1)
+    fT = rfft(T, axis=-1)
+    w = weight.copy()
+    if npts % 2 == 0:
+        w[-1] = 0.
+    QQ = np.sum(w*np.abs(fQ)**2, axis=-1)
+    TT = np.sum(w*np.abs(fT)**2, axis=-1)
+    QT = np.sum(w*np.real(np.conj(fQ)*fT), axis=-1)
+    D = (w*(np.abs(fQ)**2 - np.abs(fT)**2)) @ shift
+    P = (w*np.conj(fQ)*fT) @ shift
+    M = (w*fQ*np.conj(fT)) @ shift
+    E0 = c*c*expand(QQ) + s*s*expand(TT) - 2.*c*s*expand(QT)
+    E1 = s*s*expand(QQ) + c*c*expand(TT) + 2.*c*s*expand(QT)
+    Ematrix = s*s*E0 + c*c*E1 - 2.*s*c*np.real(
+        c*s*D[..., None, :] + c*c*P[..., None, :] - s*s*M[..., None, :])
+    if npts % 2 == 0:
+        Ematrix += expand(np.real(fT[..., -1])**2) * \
+            np.cos(np.pi*freq[-1]*dtt)**2
+    Ematrix /= npts
+
+    # Rotation-Correlation: the correlation of the rotated components is
+    # a combination of the correlations of Q and T, arranged as the
+    # output of np.correlate(mode='same') after ifftshift
+    nfft = 2*npts
+    lags = (np.arange(npts) + npts//2) % npts - npts//2
+    fQ = rfft(Q, n=nfft, axis=-1)
+    fT = rfft(T, n=nfft, axis=-1)
+    cor = np.stack([irfft(a*np.conj(b), n=nfft, axis=-1)[..., lags % nfft]
+                    for a, b in [(fQ, fQ), (fQ, fT), (fT, fQ), (fT, fT)]],
+                   axis=-2)
+    fcor = rfft(cor, axis=-1)*weight
+    Gpos = np.real(fcor @ shift)/npts
+    Gneg = np.real(fcor @ np.conj(shift))/npts
+    ns0 = c*c*expand(np.sum(Q*Q, axis=-1)) + \
+        s*s*expand(np.sum(T*T, axis=-1)) - \
+        2.*c*s*expand(np.sum(Q*T, axis=-1))
+    ns1 = s*s*expand(np.sum(Q*Q, axis=-1)) + \
+        c*c*expand(np.sum(T*T, axis=-1)) + \
+        2.*c*s*expand(np.sum(Q*T, axis=-1))
+    norm = np.sqrt(ns0*ns1)
+
+    def combine(G):
+        return (c*s*G[..., 0, None, :] + c*c*G[..., 1, None, :] -
+                s*s*G[..., 2, None, :] - s*c*G[..., 3, None, :])/norm
+
+    return Ematrix, combine(Gpos), combine(Gneg)
+
+
+def cluster_estimates(phi, dtt, maxdt, dist=0.1, min_size=5):
+    """
+    Groups splitting estimates of several analysis windows into clusters
+    and finds the most stable cluster (Teanby et al., 2004). Estimates
+    are compared with a distance where differences in fast axis
+    direction (periodic over 180 degrees) are normalized by 90 degrees
+    and differences in delay time by the maximum delay time. Clusters
+    are formed by average-linkage hierarchical clustering, cut at a
+    maximum distance. The most stable cluster is the one with the
+    smallest variance among the clusters with at least ``min_size``
+    estimates (or the largest cluster if there is none).
+
+    Parameters
+    ----------
+    phi : :class:`~numpy.ndarray`
+        Azimuths of fast axis (deg)
+    dtt : :class:`~numpy.ndarray`
+        Delay times (sec)
+    maxdt : float
+        Maximum delay time in search (sec)
+    dist : float
+        Maximum distance between clusters
+    min_size : int
+        Minimum number of estimates in a stable cluster
+
+    Returns
+    -------
+    labels : :class:`~numpy.ndarray`
+        Cluster of each estimate
+    best : int
+        Label of most stable cluster
+    ibest : int
+        Index of the estimate closest to the centre of the most stable
+        cluster
+
+    """
+
+    from scipy.cluster.hierarchy import linkage, fcluster
+
+    phi = np.asarray(phi, dtype=float)
+    dtt = np.asarray(dtt, dtype=float)
+
+    def distance(phi1, dtt1, phi2, dtt2):
+        dphi = np.abs(phi1 - phi2) % 180.
+        dphi = np.minimum(dphi, 180. - dphi)
+        return np.sqrt((dphi/90.)**2 + ((dtt1 - dtt2)/maxdt)**2)
+
+    if len(phi) == 1:
+        labels = np.zeros(1, dtype=int)
+    else:
+        i, j = np.triu_indices(len(phi), k=1)
+        Z = linkage(distance(phi[i], dtt[i], phi[j], dtt[j]),
+                    method='average')
+        labels = fcluster(Z, t=dist, criterion='distance') - 1
+
+    # Centre (circular mean of fast axis) and variance of each cluster
+    best = None
+    for label in np.unique(labels):
+        members = labels == label
+        angle = np.angle(np.mean(np.exp(2j*np.pi/180.*phi[members])))
+        centre = (angle*90./np.pi, np.mean(dtt[members]))
+        d = distance(phi, dtt, *centre)
+        var = np.mean(d[members]**2)
+        size = np.sum(members)
+        rank = (size < min_size, -size if size < min_size else var)
+        if best is None or rank < best[0]:
+            best = (rank, label, np.where(members, d, np.inf).argmin())
+
+    return labels, best[1], best[2]
+
+
+def split_correct(trQ, trT, t1, t2, theta, lag):
+    """
+    Corrects the radial and tangential components for splitting, by
+    rotating to the fast and slow directions, shifting the fast and slow
+    components by half the lag time in opposite directions, and rotating
+    back. This is the correction applied at the best-fit parameters of
+    :func:`~splitpy.calc.split_SilverChan` and
+    :func:`~splitpy.calc.split_RotCorr`.
+
+    Parameters
+    ----------
+    trQ : :class:`~obspy.core.Trace`
+        Radial component seismogram
+    trT : :class:`~obspy.core.Trace`
+        Tangential component seismogram
+    t1 : :class:`~obspy.core.utcdatetime.UTCDateTime`
+        Start time of picking window
+    t2 : :class:`~obspy.core.utcdatetime.UTCDateTime`
+        End time of picking window
+    theta : float
+        Rotation angle from the Q-T to the fast-slow system (deg)
+    lag : float
+        Lag time (sec). The fast component is shifted by lag/2 and the
+        slow component by -lag/2
+
+    Returns
+    -------
+    trQ_c : :class:`~obspy.core.Trace`
+        Trace of corrected radial component of motion
+    trT_c : :class:`~obspy.core.Trace`
+        Trace of corrected tangential component of motion
+    trFast : :class:`~obspy.core.Trace`
+        Trace of corrected fast direction of motion
+    trSlow : :class:`~obspy.core.Trace`
+        Trace of corrected slow direction of motion
+
+    """
+
+    theta = theta*np.pi/180.
+    M = np.array([[np.cos(theta), -np.sin(theta)],
+                  [np.sin(theta), np.cos(theta)]])
+
+    trQ_tmp = trQ.copy()
+    trT_tmp = trT.copy()
+    trQ_tmp.trim(t1, t2)
+    trT_tmp.trim(t1, t2)
+
+    trQ_tmp.taper(max_percentage=0.1, type='hann')
+    trT_tmp.taper(max_percentage=0.1, type='hann')
+
+    FS_test = np.dot(M, np.array([trQ_tmp.data, trT_tmp.data]))
 
     F0 = Trace(data=FS_test[0], header=trQ_tmp.stats)
     F1 = Trace(data=FS_test[1], header=trT_tmp.stats)
 
-    tmpFast = tshift(F0, shift/2.)
-    tmpSlow = tshift(F1, -shift/2.)
+    tmpFast = tshift(F0, lag/2.)
+    tmpSlow = tshift(F1, -lag/2.)
+
+    corrected_QT = np.dot(inv(M), np.array([tmpFast, tmpSlow]))
+
+    trQ_c = Trace(data=corrected_QT[0], header=trQ_tmp.stats)
+    trT_c = Trace(data=corrected_QT[1], header=trT_tmp.stats)
 
     trFast = Trace(data=tmpFast, header=trT_tmp.stats)
     trSlow = Trace(data=tmpSlow, header=trQ_tmp.stats)
 
-    corrected_QT = np.dot(
-        inv(np.array(M2[:, :])), np.array([tmpFast, tmpSlow]))
+    return trQ_c, trT_c, trFast, trSlow
 
-    trQ_c = Trace(data=corrected_QT[0], header=trQ_tmp.stats)
-    trT_c = Trace(data=corrected_QT[1], header=trT_tmp.stats)
 
-    return Cmap, trQ_c, trT_c, trFast, trSlow, \
-        phiRC, dtRC, phiRC_max
+def rotation_RotCorr(phi, phi_max, baz):
+    """
+    Returns the rotation angle to the fast-slow system used by
+    :func:`~splitpy.calc.split_RotCorr`, which depends on the sign of the
+    best-fit time shift, from the returned fast axis azimuth
+
+    Parameters
+    ----------
+    phi : float
+        Azimuth of fast axis (deg)
+    phi_max : float
+        Azimuth used in plotting routine (deg)
+    baz : float
+        Back-azimuth - pointing to earthquake from station (degrees)
+
+    Returns
+    -------
+    theta : float
+        Rotation angle (deg)
+
+    """
+
+    # Positive shift: phi = phi_max + baz - 90 (mod 180)
+    diff = np.mod(phi_max + baz - 90. - phi, 180.)
+    if min(diff, 180. - diff) < 1.e-6:
+        return phi_max
+    return phi_max + 90.
 
 
 def tshift(trace, tt):
@@ -508,3 +817,117 @@ def split_errorRC(tr, t1, t2, q, Emat, maxdt, ddt, dphi):
     err_dtt = max(0.25*(dtt[max(err[1])] - dtt[min(err[1])]), 0.25*ddt)
 
     return err_dtt, err_phi, err_contour
+
+
+def split_dof_contour(ratio, q=0.05, n_par=2):
+    """
+    Recovers the degrees of freedom used by
+    :func:`~splitpy.calc.split_errorSC` from the ratio of the error
+    contour to the minimum of the energy matrix
+
+    Parameters
+    ----------
+    ratio : float or :class:`~numpy.ndarray`
+        Ratio of error contour to minimum energy
+    q : float
+        Confidence level
+    n_par : int
+        Number of parameters
+
+    Returns
+    -------
+    dof : float or :class:`~numpy.ndarray`
+        Degrees of freedom
+
+    """
+
+    from scipy import stats
+
+    # The ratio decreases monotonically with the degrees of freedom
+    dofs = np.arange(n_par + 1, 10001)
+    ratios = 1. + n_par/(dofs - n_par)*stats.f.ppf(
+        1. - q, n_par, dofs - n_par)
+    ind = np.searchsorted(-ratios, -np.asarray(ratio, dtype=float))
+
+    return dofs[np.clip(ind, 0, len(dofs) - 1)].astype(float)
+
+
+def split_stack(Emats, errc, dof, ddt, dphi, select=None, q=0.05):
+    """
+    Stacks the energy matrices of the Silver-Chan method for a number
+    of events, after normalization by their error contour (Wolfe and
+    Silver, JGR, 1998; Restivo and Helffrich, GJI, 1999). The energy
+    matrices must be in the geographic frame, i.e., the first axis
+    corresponds to the azimuth of the fast axis from -90 to 90 degrees.
+
+    Parameters
+    ----------
+    Emats : :class:`~numpy.ndarray`
+        Energy matrices, with shape (number of events, phi, dt). This can
+        be a memory-mapped array
+    errc : :class:`~numpy.ndarray`
+        Error contours of the energy matrices
+    dof : :class:`~numpy.ndarray`
+        Degrees of freedom of the energy matrices
+    ddt : float
+        Sampling distance in delay time (sec)
+    dphi : float
+        Sampling distance in azimuth (deg)
+    select : :class:`~numpy.ndarray`
+        Boolean array of events to include [Default includes all]
+    q : float
+        Confidence level
+
+    Returns
+    -------
+    Estack : :class:`~numpy.ndarray`
+        Stacked energy matrix
+    phi : float
+        Azimuth of fast axis (deg)
+    dtt : float
+        Delay time between fast and slow axes (sec)
+    ephi : float
+        Error on azimuth of fast axis (deg)
+    edtt : float
+        Error on delay time between fast and slow axes (sec)
+    err_contour : float
+        Error contour of stacked energy matrix
+
+    """
+
+    from scipy import stats
+
+    errc = np.asarray(errc, dtype=float)
+    if select is None:
+        select = np.ones(len(errc), dtype=bool)
+    weights = np.where(select, 1./errc, 0.)
+
+    # Single pass over the matrices, in blocks to bound memory use
+    nev = len(weights)
+    shape = Emats.shape[1:]
+    Estack = np.zeros(shape)
+    for i in range(0, nev, 1024):
+        w = weights[i:i+1024]
+        if np.any(w != 0.):
+            Estack += np.dot(w, np.reshape(
+                Emats[i:i+1024], (len(w), -1))).reshape(shape)
+
+    # Degrees of freedom of the stack
+    n_par = 2
+    nu = max(np.nansum(np.asarray(dof)[select]), n_par + 1.)
+    vmin = Estack.min()
+    err_contour = vmin*(1. + n_par/(nu - n_par) *
+                        stats.f.ppf(1. - q, n_par, nu - n_par))
+
+    ind_phi, ind_dtt = np.unravel_index(np.argmin(Estack), Estack.shape)
+    phi = -90. + ind_phi*dphi
+    dtt = ind_dtt*ddt
+
+    # Extent of confidence region, with azimuths relative to minimum
+    nphi = Estack.shape[0]
+    err = np.where(Estack <= err_contour)
+    rel = np.mod(err[0] - ind_phi + nphi//2, nphi) - nphi//2
+    ephi = max(0.25*(rel.max() - rel.min())*dphi, 0.25*dphi)
+    edtt = max(0.25*(err[1].max() - err[1].min())*ddt, 0.25*ddt)
+
+    return Estack, phi, dtt, ephi, edtt, err_contour
@@ -47,12 +47,24 @@ a .png file.
 # -*- coding: utf-8 -*-
 from math import ceil
 import numpy as np
-from splitpy import utils, calc
+from splitpy import utils, calc, ttimes, store
 from obspy import Trace, Stream
 import matplotlib.pyplot as plt
 import matplotlib.gridspec as gspec
 
 
+# Record of a frequency band in the output of Split.band_sweep
+SWEEP_DTYPE = np.dtype([
+    ('fmin', '<f8'), ('fmax', '<f8'), ('snrq', '<f8'), ('snrt', '<f8'),
+    ('phiRC', '<f8'), ('dttRC', '<f8'), ('phiSC', '<f8'), ('dttSC', '<f8')])
+
+# Record of an analysis window in the output of Split.cluster_analysis
+WINDOWS_DTYPE = np.dtype([
+    ('t1', '<f8'), ('t2', '<f8'), ('phiRC', '<f8'), ('dttRC', '<f8'),
+    ('phiSC', '<f8'), ('dttSC', '<f8'), ('cluster', '<i4'),
+    ('stable', '?')])
+
+
 class Meta(object):
     """
     A Meta object contains attributes associated with the station-event
@@ -82,6 +94,12 @@ class Meta(object):
         Horizontal slowness of phase
     inc : float
         Incidence angle of phase at surface
+    phase : str
+        Phase analyzed (see :meth:`~splitpy.classes.Split.select_phase`)
+    phases : Dict
+        Travel time, slowness and incidence angle of each requested
+        phase (`None` for phases without arrival), in the requested
+        order
 
     """
 
@@ -90,7 +108,6 @@ class Meta(object):
 
         from obspy.geodetics.base import gps2dist_azimuth as epi
         from obspy.geodetics import kilometer2degrees as k2d
-        from obspy.taup import TauPyModel
 
         # Extract event 4D parameters
         self.time = event.origins[0].time
@@ -116,30 +133,32 @@ class Meta(object):
         self.epi_dist /= 1000
         self.gac = k2d(self.epi_dist)
 
+        # Requested phases, the first one with an arrival being analyzed
+        phase_list = [phase] if isinstance(phase, str) else list(phase)
+        self.phases = dict.fromkeys(phase_list)
+
         if self.gac > gacmin and self.gac < gacmax:
 
-            # Get travel time info
-            tpmodel = TauPyModel(model='iasp91')
-
-            # Get Travel times (Careful: here dep is in meters)
-            arrivals = tpmodel.get_travel_times(
-                distance_in_degree=self.gac,
-                source_depth_in_km=self.dep,
-                phase_list=[phase])
-            if len(arrivals) > 1:
-                print("arrival has many entries: ", len(arrivals))
-            elif len(arrivals) == 0:
+            # Get travel time info from lookup tables (dep is in km)
+            for name in phase_list:
+                arrivals = ttimes.get_arrivals([name], self.gac, self.dep)
+                if len(arrivals) > 0:
+                    self.phases[name] = {
+                        'ttime': arrivals[0].time,
+                        'slow': arrivals[0].ray_param_sec_degree/111.,
+                        'inc': arrivals[0].incident_angle}
+            available = [name for name in phase_list
+                         if self.phases[name] is not None]
+            if len(available) == 0:
                 print("no arrival found")
                 self.accept = False
                 return
 
-            arrival = arrivals[0]
-
             # Attributes from parameters
-            self.ttime = arrival.time
-            self.slow = arrival.ray_param_sec_degree/111.
-            self.inc = arrival.incident_angle
-            self.phase = phase
+            self.ttime = self.phases[available[0]]['ttime']
+            self.slow = self.phases[available[0]]['slow']
+            self.inc = self.phases[available[0]]['inc']
+            self.phase = available[0]
             self.accept = True
         else:
             self.ttime = None
@@ -151,6 +170,7 @@ class Meta(object):
         # Attributes that get updated as analysis progresses
         self.snrq = None
         self.snrt = None
+        self.snr_pre = None
         self.maxdt = maxdt
         self.ddt = ddt
         self.dphi = dphi
@@ -189,10 +209,15 @@ class Result(object):
         Error on delay time between fast and slow axes (sec)
     errc: float  
         Error contours on `Emat`
+    t1: :class:`~obspy.core.utcdatetime.UTCDateTime`
+        Start time of picking window
+    t2: :class:`~obspy.core.utcdatetime.UTCDateTime`
+        End time of picking window
     """
 
     def __init__(self, Emat, trQ_c, trT_c, trFast,
-                 trSlow, phi, dtt, phi_min, edtt, ephi, errc):
+                 trSlow, phi, dtt, phi_min, edtt, ephi, errc,
+                 t1=None, t2=None):
 
         self.Emat = Emat
         self.trQ_c = trQ_c
@@ -205,6 +230,166 @@ class Result(object):
         self.edtt = edtt
         self.ephi = ephi
         self.errc = errc
+        self.t1 = t1
+        self.t2 = t2
+
+    def compact(self, method, keep_Emat=True):
+        """
+        Returns a compact version of the result, without the corrected
+        traces
+
+        Parameters
+        ----------
+        method : str
+            Method used to obtain the result ('RC' or 'SC')
+        keep_Emat : bool
+            Whether to keep a compressed copy of `Emat`
+
+        Returns
+        -------
+        res : :class:`~splitpy.classes.CompactResult`
+            Compact result
+
+        """
+
+        return CompactResult(
+            method, self.phi, self.dtt, self.phi_min, self.edtt, self.ephi,
+            self.errc, getattr(self, 't1', None), getattr(self, 't2', None),
+            Emat=self.Emat if keep_Emat else None)
+
+
+class CompactResult(object):
+    """
+    A CompactResult object contains the scalar attributes of a
+    :class:`~splitpy.classes.Result` and, optionally, a copy of the error
+    minimization matrix quantized to 16 bits and compressed (see
+    :func:`~splitpy.store.pack_emat`). The corrected traces are not kept:
+    they are recalculated from the LQT data and the best-fit parameters
+    with :meth:`~splitpy.classes.CompactResult.expand`.
+
+    Attributes
+    ----------
+
+    method: str
+        Method used to obtain the result ('RC' or 'SC')
+    phi: float
+        Azimuth of fast axis (deg)
+    dtt: float
+        Delay time between fast and slow axes (sec)
+    phi_min: float
+        Azimuth used in plotting method
+    edtt: float
+        Error on delay time between fast and slow axes (sec)
+    ephi: float
+        Error on azimuth of fast axis (deg)
+    errc: float
+        Error contours on `Emat`
+    t1: :class:`~obspy.core.utcdatetime.UTCDateTime`
+        Start time of picking window
+    t2: :class:`~obspy.core.utcdatetime.UTCDateTime`
+        End time of picking window
+    Emat: :class:`~numpy.ndarray`
+        Error minimization matrix (`None` if not kept)
+    pEmat: bytes
+        Packed error minimization matrix
+
+    """
+
+    __slots__ = ['method', 'phi', 'dtt', 'phi_min', 'edtt', 'ephi', 'errc',
+                 't1', 't2', 'pEmat']
+
+    def __init__(self, method, phi, dtt, phi_min, edtt, ephi, errc,
+                 t1=None, t2=None, Emat=None):
+
+        self.method = method
+        self.phi = phi
+        self.dtt = dtt
+        self.phi_min = phi_min
+        self.edtt = edtt
+        self.ephi = ephi
+        self.errc = errc
+        self.t1 = t1
+        self.t2 = t2
+        self.pEmat = None
+        if Emat is not None:
+            self.pEmat = store.pack_emat(Emat)
+
+    @property
+    def Emat(self):
+        if self.pEmat is None:
+            return None
+        return store.unpack_emat(self.pEmat)
+
+    def expand(self, dataLQT, meta):
+        """
+        Recalculates the full result from the LQT data. The corrected
+        traces are obtained by applying the correction at the best-fit
+        parameters. If `Emat` was not kept, the full grid search is
+        carried out again.
+
+        Parameters
+        ----------
+        dataLQT : :class:`~obspy.core.Stream`
+            Stream containing the rotated (LQT) seismograms
+        meta : :class:`~splitpy.classes.Meta`
+            Meta data of the event
+
+        Returns
+        -------
+        res : :class:`~splitpy.classes.Result`
+            Full result
+
+        """
+
+        t1, t2 = self.t1, self.t2
+        if t1 is None or t2 is None:
+            t1 = meta.time + meta.ttime - 5.
+            t2 = meta.time + meta.ttime + 25.
+
+        trQ = dataLQT.select(component='Q')[0]
+        trT = dataLQT.select(component='T')[0]
+
+        Emat = self.Emat
+        if Emat is None:
+            func = calc.split_RotCorr if self.method == 'RC' else \
+                calc.split_SilverChan
+            Emat, trQ_c, trT_c, trFast, trSlow = func(
+                trQ, trT, meta.baz, t1, t2,
+                meta.maxdt, meta.ddt, meta.dphi)[:5]
+        else:
+            if self.method == 'RC':
+                theta = calc.rotation_RotCorr(self.phi, self.phi_min,
+                                              meta.baz)
+                lag = self.dtt
+            else:
+                theta = self.phi_min
+                lag = -self.dtt
+            trQ_c, trT_c, trFast, trSlow = calc.split_correct(
+                trQ, trT, t1, t2, theta, lag)
+
+        return Result(Emat, trQ_c, trT_c, trFast, trSlow, self.phi,
+                      self.dtt, self.phi_min, self.edtt, self.ephi,
+                      self.errc, t1=t1, t2=t2)
+
+
+def _array_to_stream(traces, data, comps, sampling_rate=None):
+    """
+    Returns a stream with the rows of a (3, npts) array as data (without
+    copy) and the headers of the original traces with new components
+    (and sampling rate)
+
+    """
+
+    stream = Stream()
+    for tr, row, comp in zip(traces, data, comps):
+        stats = tr.stats.copy()
+        stats.channel = stats.channel[:-1] + comp
+        if sampling_rate is not None:
+            stats.npts = len(row)
+            stats.sampling_rate = sampling_rate
+        stream.append(Trace(data=row, header=stats))
+
+    return stream
 
 
 class Split(object):
@@ -230,8 +415,18 @@ class Split(object):
     dataLQT : :class:`~splitpy.classes.Data`
         Object containing rotated trace data in :class:`~obspy.core.Trace` format
 
+    Note
+    ----
+    The data of an event saved in a :class:`~splitpy.store.StationStore`
+    can be attached with :meth:`~splitpy.classes.Split.attach` instead of
+    being loaded: ``dataZNE`` and ``dataLQT`` are then memory-mapped from
+    the store the first time they are used.
+
     """
 
+    # Lazily loaded data attributes and corresponding store items
+    _lazy = {'dataZNE': 'ZNE', 'dataLQT': 'LQT'}
+
     def __init__(self, sta):
 
         # # Load example data if initializing empty object
@@ -252,6 +447,70 @@ class Split(object):
         self.dataZNE = None
         self.dataLQT = None
 
+    def __getattr__(self, name):
+
+        # Only called when the attribute is missing
+        source = self.__dict__.get('_source')
+        if name in Split._lazy and source is not None:
+            store, key = source
+            item = Split._lazy[name]
+            if item == 'LQT':
+                item = self.item_name(item)
+            if store.has(key, item):
+                data = store.get(key, item, mmap=True)
+                self.__dict__[name] = data
+                self.__dict__['_loaded'][name] = data
+                return data
+        raise AttributeError(
+            "'Split' object has no attribute '{0}'".format(name))
+
+    def __getstate__(self):
+
+        # Load attached data, which is saved with the object
+        for name in Split._lazy:
+            getattr(self, name, None)
+        state = self.__dict__.copy()
+        state.pop('_source', None)
+        state.pop('_loaded', None)
+        state.pop('_prepared', None)
+        return state
+
+    def attach(self, store, key):
+        """
+        Attaches the data of an event saved in a store. The ZNE and LQT
+        streams are memory-mapped from the store when first accessed as
+        ``dataZNE`` and ``dataLQT``, and can be released with
+        :meth:`~splitpy.classes.Split.release`.
+
+        Parameters
+        ----------
+        store : :class:`~splitpy.store.StationStore` or
+            :class:`~splitpy.store.LegacyStore`
+            Store of the station
+        key : str
+            Event key
+
+        """
+
+        for name in Split._lazy:
+            self.__dict__.pop(name, None)
+        self._source = (store, key)
+        self._loaded = {}
+
+    def release(self):
+        """
+        Releases the streams loaded from the store attached with
+        :meth:`~splitpy.classes.Split.attach`, unless they were replaced
+        (e.g., by :meth:`~splitpy.classes.Split.rotate`). They are loaded
+        again when needed.
+
+        """
+
+        for name, data in self.__dict__.get('_loaded', {}).items():
+            if self.__dict__.get(name) is data:
+                del self.__dict__[name]
+        self.__dict__['_loaded'] = {}
+
     def add_event(self, event, gacmin=85., gacmax=120., phase='SKS',
                   returned=False):
         """
@@ -266,7 +525,6 @@ class Split(object):
 
         from obspy.geodetics.base import gps2dist_azimuth as epi
         from obspy.geodetics import kilometer2degrees as k2d
-        from obspy.taup import TauPyModel
         from obspy.core.event.event import Event
 
         # if event == 'demo' or event == 'Demo':
@@ -292,6 +550,82 @@ class Split(object):
         if returned:
             return self.meta.accept
 
+    def item_name(self, name, phase=None):
+        """
+        Returns the name of an item of the event in a store (e.g.,
+        ``'LQT'``, ``'meta'`` or ``'results_auto'``) for a phase. Items of
+        the first requested phase have the usual names, and those of other
+        phases have the name of the phase as suffix (e.g.,
+        ``'results_auto_SKKS'``), such that the results of all phases are
+        stored side by side.
+
+        Parameters
+        ----------
+        name : str
+            Name of item
+        phase : str
+            Phase (by default, the phase being analyzed)
+
+        Returns
+        -------
+        name : str
+            Name of item for the phase
+
+        """
+
+        meta = self.__dict__.get('meta')
+        phases = list(getattr(meta, 'phases', None) or [])
+        if phase is None:
+            phase = getattr(meta, 'phase', None)
+        if len(phases) == 0 or phase is None or phase == phases[0]:
+            return name
+        return name + '_' + phase
+
+    def select_phase(self, phase):
+        """
+        Selects the phase analyzed by the other methods, among the phases
+        requested in :meth:`~splitpy.classes.Split.add_event`. The ZNE
+        data are shared by all phases, while the LQT data (which depend
+        on the incidence angle), signal-to-noise ratios and results of
+        the current phase are set aside and those of the selected phase
+        are restored, such that several phases can be analyzed in turn
+        from a single retrieval of the data.
+
+        Parameters
+        ----------
+        phase : str
+            Phase to analyze
+
+        """
+
+        meta = self.meta
+        phases = getattr(meta, 'phases', None) or {meta.phase: None}
+        if phase == meta.phase:
+            return
+        if phases.get(phase) is None:
+            raise(Exception("No arrival for phase " + str(phase) +
+                            " - aborting"))
+
+        # Set aside the state of the current phase
+        stash = self.__dict__.setdefault('_phases', {})
+        state = {attr: self.__dict__.pop(attr) for attr in
+                 ['dataLQT', 'RC_res', 'SC_res', 'null', 'quality']
+                 if attr in self.__dict__}
+        for attr in ['snrq', 'snrt', 'align', 'rotated']:
+            state[attr] = getattr(meta, attr)
+        stash[meta.phase] = state
+
+        # Restore the state of the selected phase
+        meta.phase = phase
+        meta.ttime = phases[phase]['ttime']
+        meta.slow = phases[phase]['slow']
+        meta.inc = phases[phase]['inc']
+        state = stash.pop(phase, {'snrq': None, 'snrt': None,
+                                  'align': 'LQT', 'rotated': False})
+        for attr in ['snrq', 'snrt', 'align', 'rotated']:
+            setattr(meta, attr, state.pop(attr))
+        self.__dict__.update(state)
+
     def add_data(self, stream, returned=False, new_sr=5.):
         """
         Adds stream of raw data as object attribute
@@ -349,7 +683,8 @@ class Split(object):
             return self.meta.accept
 
     def download_data(self, client, stdata=[], ndval=np.nan, new_sr=5.,
-                      dts=120., returned=False, verbose=False):
+                      dts=120., returned=False, verbose=False, cache=None,
+                      bandpass=None, prescreen=None, window=None):
         """
         Downloads seismograms based on event origin time and
         P phase arrival and adds as object attribute.
@@ -368,6 +703,24 @@ class Split(object):
             Station list
         returned : bool
             Whether or not to return the ``accept`` attribute
+        cache : :class:`~splitpy.cache.WaveformCache`
+            Waveform cache (optional)
+        bandpass : tuple
+            Minimum and maximum frequency corners (Hz) of bandpass filter.
+            If given, the data are preprocessed in a single pass with
+            :func:`~splitpy.utils.fused_preprocess`, which also rotates the
+            data and sets the ``dataLQT`` attribute (i.e., replaces
+            :meth:`~splitpy.classes.Split.rotate` and filtering).
+        prescreen : float
+            Minimum SNR (dB) of the pre-screen on the raw data (see
+            :func:`~splitpy.utils.prescreen_snr`). If given, events below
+            this value are rejected before preprocessing, and the estimate
+            is stored in the ``snr_pre`` attribute of ``meta``.
+        window : tuple
+            Start and end times of the request, instead of ``dts`` seconds
+            before the first and after the last arrival of the requested
+            phases (e.g., to cover the windows of several analyses of the
+            event)
 
         Returns
         -------
@@ -382,9 +735,24 @@ class Split(object):
         if not self.meta.accept:
             return
 
-        # Define start time for request
-        tstart = self.meta.time + self.meta.ttime - dts
-        tend = self.meta.time + self.meta.ttime + dts
+        def resample():
+            if bandpass is None:
+                # Filter Traces and resample
+                self.dataZNE.filter('lowpass', freq=0.5*new_sr,
+                                    corners=2, zerophase=True)
+                self.dataZNE.resample(new_sr, no_filter=False)
+            else:
+                self._fused_preprocess(new_sr, *bandpass)
+
+        # Define start time for request, covering all phases
+        if window is None:
+            times = [arrival['ttime'] for arrival in
+                     (getattr(self.meta, 'phases', None) or {}).values()
+                     if arrival is not None] or [self.meta.ttime]
+            tstart = self.meta.time + min(times) - dts
+            tend = self.meta.time + max(times) + dts
+        else:
+            tstart, tend = window
 
         # Get waveforms
         print("* Requesting Waveforms: ")
@@ -395,7 +763,17 @@ class Split(object):
         err, stream = utils.download_data(
             client=client, sta=self.sta, start=tstart, end=tend,
             stdata=stdata, ndval=ndval, new_sr=new_sr,
-            verbose=verbose)
+            verbose=verbose, cache=cache)
+
+        # Reject events without signal before preprocessing
+        if prescreen is not None and stream is not None:
+            self.meta.snr_pre = utils.prescreen_snr(
+                stream, self.meta.time + self.meta.ttime, self.meta.baz,
+                new_sr=new_sr, azcorr=getattr(self.sta, 'azcorr', 0.))
+            if self.meta.snr_pre < prescreen:
+                if returned:
+                    return False
+                return
 
         # Store as attributes with traces in dictionary
         try:
@@ -405,9 +783,7 @@ class Split(object):
             self.dataZNE = Stream(traces=[trZ, trN, trE])
 
             # Filter Traces and resample
-            self.dataZNE.filter('lowpass', freq=0.5*new_sr,
-                             corners=2, zerophase=True)
-            self.dataZNE.resample(new_sr, no_filter=False)
+            resample()
 
         # If there is no ZNE, perhaps there is Z12?
         except:
@@ -422,9 +798,7 @@ class Split(object):
                 self.rotate(align='ZNE')
 
                 # Filter Traces and resample
-                self.dataZNE.filter('lowpass', freq=0.5*new_sr,
-                                 corners=2, zerophase=True)
-                self.dataZNE.resample(new_sr, no_filter=False)
+                resample()
 
             except:
                 self.meta.accept = False
@@ -432,15 +806,43 @@ class Split(object):
         if returned:
             return self.meta.accept
 
+    def _fused_preprocess(self, new_sr, fmin, fmax):
+        """
+        Filters and resamples the ZNE data, and rotates and bandpass
+        filters the LQT data, in a single pass (see
+        :func:`~splitpy.utils.fused_preprocess`). As in the separate
+        steps, the raw data were already detrended and tapered by
+        :func:`~splitpy.utils.download_data` before shifting and trimming.
+
+        """
+
+        traces, data = utils.stream_to_array(self.dataZNE, 'ZNE')
+        M = utils.rotation_matrix('LQT', baz=self.meta.baz,
+                                  inc=self.meta.inc)
+
+        # Data sampled at or below the new rate are not resampled
+        sr = traces[0].stats.sampling_rate
+        new_sr = min(new_sr, sr)
+        zne, lqt = utils.fused_preprocess(data, sr, new_sr, fmin, fmax, M=M,
+                                          detrend=False)
+
+        self.dataZNE = _array_to_stream(traces, zne, 'ZNE', new_sr)
+        self.dataLQT = _array_to_stream(traces, lqt, 'LQT', new_sr)
+        for tr in self.dataLQT:
+            tr.stats.back_azimuth = self.meta.baz
+            tr.stats.inclination = self.meta.inc
+        self.meta.align = 'LQT'
+        self.meta.rotated = True
+
     def rotate(self, align=None):
         """
         Rotates 3-component seismograms from vertical (Z),
         east (E) and north (N) to longitudinal (L), 
         radial (Q) and tangential (T) components of motion.
-        Note that the method 'rotate' from ``obspy.core.stream.Stream``
-        is used for the rotation ``'ZNE->ZRT'`` and ``'ZNE->LQT'``.
-        Rotation ``'ZNE->PVH'`` is implemented separately here 
-        due to different conventions.
+        The components are copied once into a (3, npts) array and
+        rotated in place with a cached rotation matrix (see
+        :func:`~splitpy.utils.rotation_matrix`), using the same
+        convention as ``'ZNE->LQT'`` in ``obspy.core.stream.Stream``.
 
         Parameters
         ----------
@@ -458,38 +860,23 @@ class Split(object):
             align = self.meta.align
 
         if align == 'ZNE':
-            # Rotating from 1,2 to N,E is the negative of
-            # rotation from RT to NE, with
-            # baz corresponding to azim of component 1
-            from obspy.signal.rotate import rotate_rt_ne
-
-            # Copy traces
-            trZ = self.dataZ12.select(component='Z')[0].copy()
-            trN = self.dataZ12.select(component='1')[0].copy()
-            trE = self.dataZ12.select(component='2')[0].copy()
-
-            azim = self.sta.azcorr
-            N, E = rotate_rt_ne(trN.data, trE.data, azim)
-            trN.data = -1.*N
-            trE.data = -1.*E
-
-            # Update stats of streams
-            trN.stats.channel = trN.stats.channel[:-1] + 'N'
-            trE.stats.channel = trE.stats.channel[:-1] + 'E'
-
-            self.dataZNE = Stream(traces=[trZ, trN, trE])
+            # Rotating from 1,2 to N,E by the azimuth of component 1
+            traces, data = utils.stream_to_array(self.dataZ12, 'Z12')
+            M = utils.rotation_matrix('ZNE', azcorr=self.sta.azcorr)
+            utils.rotate_array(data, M, out=data)
+            self.dataZNE = _array_to_stream(traces, data, 'ZNE')
 
         elif align == 'LQT':
-            data = self.dataZNE.copy()
-            data.rotate('ZNE->LQT',
-                             back_azimuth=self.meta.baz,
-                             inclination=self.meta.inc)
-            # for tr in data:
-            #     if tr.stats.channel.endswith('Q'):
-            #         tr.data = -tr.data
+            traces, data = utils.stream_to_array(self.dataZNE, 'ZNE')
+            M = utils.rotation_matrix('LQT', baz=self.meta.baz,
+                                      inc=self.meta.inc)
+            utils.rotate_array(data, M, out=data)
             self.meta.align = align
             self.meta.rotated = True
-            self.dataLQT = data.copy()
+            self.dataLQT = _array_to_stream(traces, data, 'LQT')
+            for tr in self.dataLQT:
+                tr.stats.back_azimuth = self.meta.baz
+                tr.stats.inclination = self.meta.inc
 
         else:
             raise(Exception("incorrect 'align' argument"))
@@ -524,31 +911,12 @@ class Split(object):
         if t1 is None:
             t1 = self.meta.time + self.meta.ttime
 
-        # Copy trace to signal and noise traces
-        trSigQ = self.dataLQT.select(component='Q')[0].copy()
-        trNzeQ = self.dataLQT.select(component='Q')[0].copy()
-        trSigT = self.dataLQT.select(component='T')[0].copy()
-        trNzeT = self.dataLQT.select(component='T')[0].copy()
-
-        trSigQ.detrend().taper(max_percentage=0.05)
-        trNzeQ.detrend().taper(max_percentage=0.05)
-        trSigT.detrend().taper(max_percentage=0.05)
-        trNzeT.detrend().taper(max_percentage=0.05)
-
-        # Trim around S-wave arrival
-        trSigQ.trim(t1, t1 + dt)
-        trNzeQ.trim(t1 - dt, t1)
-        trSigT.trim(t1, t1 + dt)
-        trNzeT.trim(t1 - dt, t1)
-
-        # Calculate root mean square (RMS) and SNR
-        srms = np.sqrt(np.mean(np.square(trSigQ.data)))
-        nrms = np.sqrt(np.mean(np.square(trNzeQ.data)))
-        self.meta.snrq = 10*np.log10(srms*srms/nrms/nrms)
-
-        srms = np.sqrt(np.mean(np.square(trSigT.data)))
-        nrms = np.sqrt(np.mean(np.square(trNzeT.data)))
-        self.meta.snrt = 10*np.log10(srms*srms/nrms/nrms)
+        # Signal and noise windows around S-wave arrival, calculated on
+        # a single detrended and tapered (2, npts) array
+        traces, data = utils.stream_to_array(self.dataLQT, 'QT')
+        sig = utils.trim_indices(traces[0].stats, t1, t1 + dt)
+        nze = utils.trim_indices(traces[0].stats, t1 - dt, t1)
+        self.meta.snrq, self.meta.snrt = utils.calc_snr(data, sig, nze)
 
     def analyze(self, t1=None, t2=None, verbose=False):
         """
@@ -597,7 +965,8 @@ class Split(object):
 
         # Store dictionary as attribute
         self.RC_res = Result(Emat, trQ_c, trT_c, trFast, trSlow,
-                             phi, dtt, phi_min, edtt, ephi, errc)
+                             phi, dtt, phi_min, edtt, ephi, errc,
+                             t1=t1, t2=t2)
 
         # Calculate Silver and Chan splitting estimate
         if verbose:
@@ -613,7 +982,262 @@ class Split(object):
             self.meta.maxdt, self.meta.ddt, self.meta.dphi)
 
         self.SC_res = Result(Emat, trQ_c, trT_c, trFast, trSlow,
-                             phi, dtt, phi_min, edtt, ephi, errc)
+                             phi, dtt, phi_min, edtt, ephi, errc,
+                             t1=t1, t2=t2)
+
+    def _prepare_QT(self):
+        """
+        Returns the header of the Q component and the Q and T components
+        of the LQT data as an array, with shape (2, npts). The array is
+        prepared once and kept until the LQT data are replaced or
+        filtered, such that several windows of the same data are analyzed
+        without copying the traces again.
+
+        """
+
+        arrays = [tr.data for tr in self.dataLQT]
+        prepared = self.__dict__.get('_prepared')
+        if prepared is None or len(prepared[0]) != len(arrays) or \
+                any([a is not b for a, b in zip(prepared[0], arrays)]):
+            traces, data = utils.stream_to_array(self.dataLQT, 'QT')
+            prepared = (arrays, traces[0].stats, data)
+            self.__dict__['_prepared'] = prepared
+
+        return prepared[1], prepared[2]
+
+    def preview(self, t1=None, t2=None, dphi=None, ddt=None):
+        """
+        Quickly estimates the splitting parameters of both methods, e.g.,
+        to preview the estimate of a picking window while the exact
+        analysis of :meth:`~splitpy.classes.Split.analyze` is carried out.
+        The grid search surfaces are evaluated in closed form (see
+        :func:`~splitpy.calc.split_surfaces`) from Q and T components
+        prepared once for all windows, on a coarser grid by default. On
+        the grid of ``meta``, the estimates are the same as those of
+        :meth:`~splitpy.classes.Split.analyze`.
+
+        Parameters
+        ----------
+        t1 : :class:`~obspy.core.utcdatetime.UTCDateTime`
+            Start time of picking window
+        t2 : :class:`~obspy.core.utcdatetime.UTCDateTime`
+            End time of picking window
+        dphi : float
+            Angle increment of grid (by default, at least 5 degrees)
+        ddt : float
+            Time increment of grid (by default, at least 0.2 sec)
+
+        Returns
+        -------
+        phiRC : float
+            Azimuth of fast axis (deg) of Rotation-Correlation method
+        dttRC : float
+            Delay time (sec) of Rotation-Correlation method
+        phiSC : float
+            Azimuth of fast axis (deg) of Silver-Chan method
+        dttSC : float
+            Delay time (sec) of Silver-Chan method
+
+        """
+
+        if t1 is None and t2 is None:
+            t1 = self.meta.time + self.meta.ttime - 5.
+            t2 = self.meta.time + self.meta.ttime + 25.
+        if dphi is None:
+            dphi = max(self.meta.dphi, 5.)
+        if ddt is None:
+            ddt = max(self.meta.ddt, 0.2)
+
+        stats, data = self._prepare_QT()
+        i1, i2 = utils.trim_indices(stats, t1, t2)
+        Emat, Cpos, Cneg = calc.split_surfaces(
+            data[0][i1:i2], data[1][i1:i2], stats.delta, self.meta.maxdt,
+            ddt, dphi)
+
+        grid = (self.meta.baz, self.meta.maxdt, ddt, dphi)
+        phiRC, dttRC = calc.best_RotCorr(Cpos, Cneg, *grid)[1:3]
+        phiSC, dttSC = calc.best_SilverChan(Emat, *grid)[:2]
+
+        return phiRC, dttRC, phiSC, dttSC
+
+    def band_sweep(self, bands, t1=None, t2=None, dt=30.):
+        """
+        Calculates the splitting parameters of both methods in several
+        frequency bands, e.g., to check the sensitivity of the estimate
+        to the bandpass filter. The rotated data are transformed once,
+        each band is applied as a spectral mask (see
+        :func:`~splitpy.utils.bandpass_sweep`) and the grid search
+        surfaces of all bands are evaluated together (see
+        :func:`~splitpy.calc.split_surfaces`). The estimates are the same
+        as filtering the LQT data in each band and calling
+        :meth:`~splitpy.classes.Split.analyze`, without the corrected
+        traces and errors.
+
+        Parameters
+        ----------
+        bands : List
+            Minimum and maximum frequency corners (Hz) of each band
+        t1 : :class:`~obspy.core.utcdatetime.UTCDateTime`
+            Start time of picking window
+        t2 : :class:`~obspy.core.utcdatetime.UTCDateTime`
+            End time of picking window
+        dt : float
+            Duration of SNR windows (sec)
+
+        Attributes
+        ----------
+        sweep : :class:`~numpy.ndarray`
+            Structured array with one row per band and dtype
+            :data:`~splitpy.classes.SWEEP_DTYPE`
+
+        """
+
+        if self.dataZNE is None:
+            raise(Exception("Requires ZNE data as attribute - aborting"))
+
+        if t1 is None and t2 is None:
+            t1 = self.meta.time + self.meta.ttime - 5.
+            t2 = self.meta.time + self.meta.ttime + 25.
+        t0 = self.meta.time + self.meta.ttime
+
+        # Unfiltered Q and T components, filtered in all bands at once
+        traces, data = utils.stream_to_array(self.dataZNE, 'ZNE')
+        M = utils.rotation_matrix('LQT', baz=self.meta.baz,
+                                  inc=self.meta.inc)
+        stats = traces[0].stats
+        data = utils.bandpass_sweep(
+            utils.rotate_array(data, M)[1:], stats.sampling_rate, bands)
+
+        sweep = np.zeros(len(data), dtype=SWEEP_DTYPE)
+        sweep['fmin'], sweep['fmax'] = np.reshape(bands, (-1, 2)).T
+
+        # SNR and grid search surfaces of all bands
+        sig = utils.trim_indices(stats, t0, t0 + dt)
+        nze = utils.trim_indices(stats, t0 - dt, t0)
+        snr = utils.calc_snr(data, sig, nze)
+        sweep['snrq'], sweep['snrt'] = snr[:, 0], snr[:, 1]
+        i1, i2 = utils.trim_indices(stats, t1, t2)
+        Emat, Cpos, Cneg = calc.split_surfaces(
+            data[:, 0, i1:i2], data[:, 1, i1:i2], stats.delta,
+            self.meta.maxdt, self.meta.ddt, self.meta.dphi)
+
+        grid = (self.meta.baz, self.meta.maxdt, self.meta.ddt,
+                self.meta.dphi)
+        for i in range(len(sweep)):
+            sweep['phiRC'][i], sweep['dttRC'][i] = calc.best_RotCorr(
+                Cpos[i], Cneg[i], *grid)[1:3]
+            sweep['phiSC'][i], sweep['dttSC'][i] = calc.best_SilverChan(
+                Emat[i], *grid)[:2]
+
+        self.sweep = sweep
+
+    def cluster_analysis(self, tbeg=(-10., -2.), tend=(15., 35.), nwin=10,
+                         method='SC', dist=0.1, min_size=5, verbose=False):
+        """
+        Selects the analysis window automatically with a cluster
+        analysis of the estimates of many windows (Teanby et al., 2004),
+        instead of the fixed window of
+        :meth:`~splitpy.classes.Split.analyze`. The grid search surfaces
+        of all windows of the same length are evaluated together (see
+        :func:`~splitpy.calc.split_surfaces`), the estimates are
+        clustered (see :func:`~splitpy.calc.cluster_estimates`), and the
+        window whose estimate is closest to the centre of the most
+        stable cluster is analyzed with
+        :meth:`~splitpy.classes.Split.analyze`.
+
+        Parameters
+        ----------
+        tbeg : tuple
+            Range of start times of windows, relative to the predicted
+            arrival (sec)
+        tend : tuple
+            Range of end times of windows, relative to the predicted
+            arrival (sec)
+        nwin : int
+            Number of start times and of end times (i.e., ``nwin**2``
+            windows are evaluated)
+        method : str
+            Method used for clustering ('SC' or 'RC')
+        dist : float
+            Maximum distance between clusters
+        min_size : int
+            Minimum number of estimates in a stable cluster
+
+        Attributes
+        ----------
+        windows : :class:`~numpy.ndarray`
+            Structured array with one row per window and dtype
+            :data:`~splitpy.classes.WINDOWS_DTYPE`
+        RC_res : :class:`~splitpy.classes.Result`
+            Object containing results of Rotation-Correlation method in
+            the selected window
+        SC_res : :class:`~splitpy.classes.Result`
+            Object containing results of Silver-Chan method in the
+            selected window
+
+        """
+
+        if method not in ['SC', 'RC']:
+            raise(Exception("Method should be 'SC' or 'RC' - aborting"))
+
+        t0 = self.meta.time + self.meta.ttime
+        stats, data = self._prepare_QT()
+
+        windows = np.zeros(nwin*nwin, dtype=WINDOWS_DTYPE)
+        windows['t1'] = np.repeat(np.linspace(tbeg[0], tbeg[1], nwin), nwin)
+        windows['t2'] = np.tile(np.linspace(tend[0], tend[1], nwin), nwin)
+        index = np.array([utils.trim_indices(stats, t0 + w['t1'],
+                                             t0 + w['t2'])
+                          for w in windows])
+
+        # Grid search surfaces of the windows of each length
+        if verbose:
+            print("* --> Evaluating {0:d} analysis windows".format(
+                len(windows)))
+        grid = (self.meta.baz, self.meta.maxdt, self.meta.ddt,
+                self.meta.dphi)
+        length = index[:, 1] - index[:, 0]
+        for npts in np.unique(length):
+            sel = np.flatnonzero(length == npts)
+            rows = index[sel, :1] + np.arange(npts)
+            Emat, Cpos, Cneg = calc.split_surfaces(
+                data[0][rows], data[1][rows], stats.delta,
+                self.meta.maxdt, self.meta.ddt, self.meta.dphi)
+            for k, i in enumerate(sel):
+                windows['phiRC'][i], windows['dttRC'][i] = \
+                    calc.best_RotCorr(Cpos[k], Cneg[k], *grid)[1:3]
+                windows['phiSC'][i], windows['dttSC'][i] = \
+                    calc.best_SilverChan(Emat[k], *grid)[:2]
+
+        # Most stable cluster
+        labels, best, ibest = calc.cluster_estimates(
+            windows['phi' + method], windows['dtt' + method],
+            self.meta.maxdt, dist=dist, min_size=min_size)
+        windows['cluster'] = labels
+        windows['stable'] = labels == best
+        self.windows = windows
+
+        if verbose:
+            print("* --> Selected window {0:.1f} to {1:.1f} sec".format(
+                windows['t1'][ibest], windows['t2'][ibest]) +
+                " ({0:d} of {1:d} estimates in cluster)".format(
+                    np.sum(windows['stable']), len(windows)))
+
+        self.analyze(t1=t0 + windows['t1'][ibest],
+                     t2=t0 + windows['t2'][ibest], verbose=verbose)
+
+    def restore_results(self):
+        """
+        Expands compact splitting results (see
+        :class:`~splitpy.classes.CompactResult`) into full results, by
+        recalculating the corrected traces from the LQT data.
+
+        """
+
+        for attr in ['RC_res', 'SC_res']:
+            res = getattr(self, attr, None)
+            if isinstance(res, CompactResult):
+                setattr(self, attr, res.expand(self.dataLQT, self.meta))
 
     def is_null(self, snrTlim=3., verbose=False):
         """
@@ -863,20 +1487,13 @@ class PickPlot(object):
 
     def __init__(self, split):
 
-        from obspy.taup import TauPyModel
-
         # Store split as attribute
         self.split = split
 
-        # Get travel time info
-        tpmodel = TauPyModel(model='iasp91')
+        # Get travel time info from lookup tables (dep is in km)
         self.phase_list = ['S', 'SKS', 'SKKS', 'PKS', 'ScS']
-
-        # Get Travel times (Careful: here dep is in meters)
-        self.arrivals = tpmodel.get_travel_times(
-            distance_in_degree=self.split.meta.gac,
-            source_depth_in_km=self.split.meta.dep,
-            phase_list=self.phase_list)
+        self.arrivals = ttimes.get_arrivals(
+            self.phase_list, self.split.meta.gac, self.split.meta.dep)
 
         def init_pickw(ax, title, ylab):
             """
@@ -1259,6 +1876,9 @@ class DiagPlot(object):
             t1 = self.split.meta.time + self.split.meta.ttime - 5.
             t2 = self.split.meta.time + self.split.meta.ttime + 25.
 
+        # Recalculate corrected traces of compact results
+        self.split.restore_results()
+
         def rot3D(inc, baz):
             """
             Defines rotation matrix from incidence and back-azimuth angles
@@ -0,0 +1,1375 @@
+# Copyright 2019 Pascal Audet & Andrew Schaeffer
+#
+# This file is part of SplitPy.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+
+Module containing the per-station stores of event data and splitting
+results:
+
+- :class:`~splitpy.store.StationStore`
+- :class:`~splitpy.store.LegacyStore`
+- :class:`~splitpy.store.ResultsTable`
+- :class:`~splitpy.store.EmatCube`
+- :class:`~splitpy.store.RunJournal`
+
+Both classes have the same interface: items (e.g., ``'ZNE'``, ``'LQT'``,
+``'meta'``, ``'station'``, ``'results_auto'`` or ``'results_manual'``) are
+stored and retrieved by event key (the origin time of the event, in the
+format ``YYYYMMDD_HHMMSS``).
+
+A :class:`~splitpy.store.StationStore` keeps all items of a station in a
+single append-only file. Each record holds one item of one event:
+waveforms, arrays and scalar attributes are stored as typed arrays with
+a JSON description. The position of the records is indexed by event key
+when the file is opened, such that any item can be read without reading
+the rest of the file. Writing an item again appends a new record that
+supersedes the previous one (see :meth:`~splitpy.store.StationStore.compact`
+to reclaim the space). Records are appended under a file lock, after
+those written by other objects on the same file. Trace headers keep the
+identification, timing and calibration of the traces, the back azimuth
+and inclination of rotated traces and the SAC header; other
+format-specific headers are not stored.
+
+A :class:`~splitpy.store.LegacyStore` reads and writes the original layout
+with one folder per event containing separate pickle files. Data saved in
+that layout can be converted with :func:`~splitpy.store.migrate`. Partial
+station directories written by different processes are combined with
+:func:`~splitpy.store.merge_parts`.
+
+A :class:`~splitpy.store.ResultsTable` keeps the scalar splitting results
+of a station (one row per event, see :data:`~splitpy.store.RESULTS_DTYPE`)
+in a file of fixed-size records, which is loaded as a NumPy structured
+array for selection and averaging. Similarly, an
+:class:`~splitpy.store.EmatCube` keeps the error surfaces of the
+Silver-Chan method of a station in a memory-mapped file for stacking.
+
+A :class:`~splitpy.store.RunJournal` records the processing status of
+each event of a station in an append-only file, such that an interrupted
+run can be resumed without probing the store.
+
+Error surfaces (``Emat``) can be kept in compact form with
+:func:`~splitpy.store.pack_emat`, which quantizes the surface to 16 bits
+and compresses it (about 4-5 times smaller than the float64 array).
+:func:`~splitpy.store.unpack_emats` decodes many surfaces at once into a
+single array.
+
+"""
+
+# -*- coding: utf-8 -*-
+import os
+import json
+import pickle
+import struct
+import hashlib
+import time
+import zlib
+from importlib import import_module
+from pathlib import Path
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    # File locks are not available (e.g., on Windows)
+    fcntl = None
+
+
+# Name of store file in station directory
+STORE_NAME = 'station.spl'
+
+# Items of an event
+NAMES = ['station', 'meta', 'ZNE', 'LQT', 'results_auto', 'results_manual']
+
+# Attributes of a Split object saved as results
+RESULTS = ['SC_res', 'RC_res', 'null', 'quality']
+
+# Row of results table
+RESULTS_DTYPE = np.dtype([
+    ('key', 'S15'), ('time', '<f8'), ('baz', '<f8'), ('gac', '<f8'),
+    ('snrq', '<f8'), ('snrt', '<f8'),
+    ('phiRC', '<f8'), ('ephiRC', '<f8'), ('dtRC', '<f8'), ('edtRC', '<f8'),
+    ('phiSC', '<f8'), ('ephiSC', '<f8'), ('dtSC', '<f8'), ('edtSC', '<f8'),
+    ('null', '?'), ('quality', 'S4')])
+
+# Record header: magic, header length, payload length
+_MAGIC = b'SPR1'
+_HEAD = struct.Struct('<4sIQ')
+_DLEN = struct.Struct('<I')
+_ALIGN = 16
+
+# Packed error surface: magic, rows, columns, offset, scale
+_EMAT_MAGIC = b'EMQ1'
+_EMAT_HEAD = struct.Struct('<4sIIdd')
+_EMAT_LEVELS = 65535
+
+# Error surface cube header: magic, phi samples, dt samples, dphi, ddt
+_CUBE_MAGIC = b'SPC1'
+_CUBE_HEAD = struct.Struct('<4sIIdd')
+_CUBE_OFFSET = 64
+
+# Trace header attributes that are stored, and those stored when set
+# (e.g., by the rotation to LQT, or the SAC header of local data)
+_STATS = ['network', 'station', 'location', 'channel', 'starttime',
+          'sampling_rate', 'calib']
+_STATS_OPTIONAL = ['back_azimuth', 'inclination', 'sac']
+
+
+def _encode(value, arrays):
+    """
+    Encodes a value as a JSON-compatible tree, appending arrays to a list
+
+    """
+
+    from obspy import Stream, Trace, UTCDateTime
+
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, UTCDateTime):
+        return {'__utc__': str(value)}
+    if isinstance(value, bytes):
+        arrays.append(np.frombuffer(value, dtype=np.uint8))
+        return {'__bytes__': len(arrays) - 1}
+    if isinstance(value, np.ndarray):
+        arrays.append(np.ascontiguousarray(value))
+        return {'__array__': len(arrays) - 1}
+    if isinstance(value, Stream):
+        return {'__stream__': [_encode(tr, arrays) for tr in value]}
+    if isinstance(value, Trace):
+        stats = {key: value.stats[key] for key in _STATS}
+        for key in _STATS_OPTIONAL:
+            if key in value.stats:
+                stats[key] = value.stats[key]
+                if hasattr(stats[key], 'items'):
+                    stats[key] = dict(stats[key].items())
+        return {'__trace__': _encode(stats, arrays),
+                'data': _encode(value.data, arrays)}
+    if isinstance(value, (list, tuple)):
+        return [_encode(val, arrays) for val in value]
+    if isinstance(value, dict) and all(isinstance(k, str) for k in value):
+        return {'__dict__': {k: _encode(v, arrays) for k, v in value.items()}}
+    cls = type(value)
+    if cls.__module__.startswith('splitpy') and hasattr(value, '__dict__'):
+        return {'__object__': cls.__module__ + ':' + cls.__qualname__,
+                'attrs': _encode(vars(value), arrays)}
+    if cls.__module__.startswith('splitpy') and hasattr(cls, '__slots__'):
+        attrs = {key: getattr(value, key) for key in cls.__slots__
+                 if hasattr(value, key)}
+        return {'__object__': cls.__module__ + ':' + cls.__qualname__,
+                'slots': _encode(attrs, arrays)}
+
+    # Anything else (e.g., station metadata) is pickled
+    arrays.append(np.frombuffer(pickle.dumps(value), dtype=np.uint8))
+    return {'__pickle__': len(arrays) - 1}
+
+
+def _decode(node, arrays):
+    """
+    Decodes a tree produced by :func:`~splitpy.store._encode`
+
+    """
+
+    from obspy import Stream, Trace, UTCDateTime
+
+    if isinstance(node, list):
+        return [_decode(val, arrays) for val in node]
+    if not isinstance(node, dict):
+        return node
+    if '__utc__' in node:
+        return UTCDateTime(node['__utc__'])
+    if '__bytes__' in node:
+        return arrays(node['__bytes__']).tobytes()
+    if '__array__' in node:
+        return arrays(node['__array__'])
+    if '__stream__' in node:
+        return Stream(traces=[_decode(tr, arrays)
+                              for tr in node['__stream__']])
+    if '__trace__' in node:
+        return Trace(data=_decode(node['data'], arrays),
+                     header=_decode(node['__trace__'], arrays))
+    if '__dict__' in node:
+        return {k: _decode(v, arrays) for k, v in node['__dict__'].items()}
+    if '__object__' in node:
+        module, name = node['__object__'].split(':')
+        if not module.startswith('splitpy'):
+            raise ValueError("Cannot decode object of class " + name)
+        cls = import_module(module)
+        for attr in name.split('.'):
+            cls = getattr(cls, attr)
+        obj = cls.__new__(cls)
+        if 'slots' in node:
+            for key, val in _decode(node['slots'], arrays).items():
+                setattr(obj, key, val)
+        else:
+            obj.__dict__.update(_decode(node['attrs'], arrays))
+        return obj
+    if '__pickle__' in node:
+        return pickle.loads(arrays(node['__pickle__']).tobytes())
+    raise ValueError("Unknown item in store")
+
+
+def pack_emat(Emat):
+    """
+    Packs an error surface into compressed bytes. The surface is
+    normalized between its minimum and maximum values, quantized to 16
+    bits and compressed. The minimum value is reconstructed exactly, and
+    other values to within half a quantization step, i.e.,
+    (max - min)/131070.
+
+    Parameters
+    ----------
+    Emat : :class:`~numpy.ndarray`
+        Error surface (2D)
+
+    Returns
+    -------
+    blob : bytes
+        Packed surface
+
+    """
+
+    Emat = np.asarray(Emat, dtype=float)
+    if Emat.ndim != 2:
+        raise ValueError("Emat must be a 2D array")
+    offset = float(Emat.min()) if Emat.size else 0.
+    scale = (float(Emat.max()) - offset)/_EMAT_LEVELS if Emat.size else 0.
+    if scale > 0.:
+        quant = np.rint((Emat - offset)/scale).astype('<u2')
+    else:
+        quant = np.zeros(Emat.shape, dtype='<u2')
+
+    # Group low and high bytes, which compresses better
+    planes = quant.view(np.uint8).reshape(-1, 2).T.tobytes()
+
+    return _EMAT_HEAD.pack(_EMAT_MAGIC, Emat.shape[0], Emat.shape[1],
+                           offset, scale) + zlib.compress(planes)
+
+
+def _unpack_quant(blob):
+    """
+    Returns the quantized surface, offset and scale of a packed surface
+
+    """
+
+    magic, nrow, ncol, offset, scale = _EMAT_HEAD.unpack_from(blob)
+    if magic != _EMAT_MAGIC:
+        raise ValueError("Not a packed error surface")
+    planes = np.frombuffer(zlib.decompress(blob[_EMAT_HEAD.size:]),
+                           dtype=np.uint8)
+    quant = planes.reshape(2, -1).T.copy().view('<u2')
+
+    return quant.reshape(nrow, ncol), offset, scale
+
+
+def unpack_emat(blob):
+    """
+    Unpacks an error surface packed with :func:`~splitpy.store.pack_emat`
+
+    Parameters
+    ----------
+    blob : bytes
+        Packed surface
+
+    Returns
+    -------
+    Emat : :class:`~numpy.ndarray`
+        Error surface
+
+    """
+
+    quant, offset, scale = _unpack_quant(blob)
+
+    return offset + scale*quant
+
+
+def unpack_emats(blobs):
+    """
+    Unpacks many error surfaces of the same shape into a single array
+
+    Parameters
+    ----------
+    blobs : List
+        List of packed surfaces
+
+    Returns
+    -------
+    Emats : :class:`~numpy.ndarray`
+        Error surfaces, with shape (number of surfaces, rows, columns)
+
+    """
+
+    if len(blobs) == 0:
+        return np.zeros((0, 0, 0))
+
+    parts = [_unpack_quant(blob) for blob in blobs]
+    shapes = set(part[0].shape for part in parts)
+    if len(shapes) > 1:
+        raise ValueError("Error surfaces have different shapes")
+    quant = np.stack([part[0] for part in parts])
+    offset = np.array([part[1] for part in parts])
+    scale = np.array([part[2] for part in parts])
+
+    return offset[:, None, None] + scale[:, None, None]*quant
+
+
+class StationStore(object):
+    """
+    A StationStore object contains the event data and splitting results of
+    a station in a single append-only file.
+
+    Attributes
+    ----------
+    path : str
+        Path to store file
+    index : Dict
+        Position of the latest record of each item, keyed by
+        (event key, item name)
+
+    """
+
+    def __init__(self, path):
+
+        self.path = str(path)
+        self.index = {}
+        self._end = 0
+        if os.path.exists(self.path):
+            self._scan()
+
+    def _scan(self, f=None):
+        """
+        Indexes the records of the file after those already indexed (e.g.,
+        records appended by another StationStore object on the same
+        file). A partly written record at the end of the file (e.g., after
+        an interruption) is ignored and overwritten by the next record.
+
+        """
+
+        if f is None:
+            with open(self.path, 'rb') as f:
+                return self._scan(f)
+
+        size = os.fstat(f.fileno()).st_size
+        pos = self._end
+        while pos + _HEAD.size <= size:
+            f.seek(pos)
+            magic, hlen, plen = _HEAD.unpack(f.read(_HEAD.size))
+            if magic != _MAGIC or pos + _HEAD.size + hlen + plen > size:
+                break
+            head = json.loads(f.read(hlen).decode('utf-8'))
+            self.index[(head['key'], head['name'])] = \
+                pos + _HEAD.size + hlen
+            pos += _HEAD.size + hlen + plen
+        self._end = pos
+
+    def __len__(self):
+
+        return len(self.keys())
+
+    def keys(self):
+        """
+        Returns the sorted list of event keys
+
+        """
+
+        return sorted(set(key for key, name in self.index))
+
+    def has(self, key, name):
+        """
+        Returns whether an item is stored for an event
+
+        """
+
+        return (key, name) in self.index
+
+    def figdir(self, key):
+        """
+        Returns the directory where figures of an event are saved
+
+        """
+
+        return Path(self.path).parent / key
+
+    def put(self, key, name, obj):
+        """
+        Stores an item for an event
+
+        Parameters
+        ----------
+        key : str
+            Event key
+        name : str
+            Item name
+        obj : object
+            Item (e.g., :class:`~obspy.core.Stream`,
+            :class:`~splitpy.classes.Meta` or Dict of results)
+
+        """
+
+        arrays = []
+        tree = _encode(obj, arrays)
+        head = json.dumps({'key': key, 'name': name}).encode('utf-8')
+
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        with os.fdopen(fd, 'r+b') as f:
+            # Append after the records of other objects on the same file
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            self._scan(f)
+            self._write(f, key, name, head, tree, arrays)
+
+    def _write(self, f, key, name, head, tree, arrays):
+        """
+        Writes a record at the end of the file
+
+        """
+
+        # Lay out arrays after the description, aligned in the file. The
+        # length of the description depends on the offsets of the arrays
+        start = self._end + _HEAD.size + len(head)
+        dlen = 0
+        while True:
+            offset = start + _DLEN.size + dlen
+            descs = []
+            for arr in arrays:
+                offset += -offset % _ALIGN
+                descs.append([arr.dtype.str, list(arr.shape),
+                              offset - start])
+                offset += arr.nbytes
+            desc = json.dumps({'tree': tree, 'arrays': descs}).encode(
+                'utf-8')
+            desc += b' '*(-(start + _DLEN.size + len(desc)) % _ALIGN)
+            if len(desc) <= dlen:
+                desc += b' '*(dlen - len(desc))
+                break
+            dlen = len(desc)
+        plen = offset - start
+
+        f.seek(self._end)
+        f.write(_HEAD.pack(_MAGIC, len(head), plen))
+        f.write(head)
+        f.write(_DLEN.pack(len(desc)))
+        f.write(desc)
+        for arr, (dtype, shape, offset) in zip(arrays, descs):
+            f.write(b'\0'*(start + offset - f.tell()))
+            f.write(arr.tobytes())
+        f.truncate()
+        f.flush()
+
+        self.index[(key, name)] = start
+        self._end = start + plen
+
+    def get(self, key, name, mmap=False):
+        """
+        Reads an item for an event
+
+        Parameters
+        ----------
+        key : str
+            Event key
+        name : str
+            Item name
+        mmap : bool
+            Whether to memory-map the arrays (e.g., trace data) instead of
+            reading them. The arrays are copy-on-write: they can be
+            modified in memory, but changes are not written to the file.
+
+        Returns
+        -------
+        obj : object
+            Stored item
+
+        """
+
+        start = self.index[(key, name)]
+        with open(self.path, 'rb') as f:
+            f.seek(start)
+            dlen, = _DLEN.unpack(f.read(_DLEN.size))
+            desc = json.loads(f.read(dlen).decode('utf-8'))
+
+            def arrays(i):
+                dtype, shape, offset = desc['arrays'][i]
+                count = int(np.prod(shape))
+                if mmap and count > 0:
+                    return np.memmap(self.path, dtype=dtype, mode='c',
+                                     offset=start + offset,
+                                     shape=tuple(shape))
+                f.seek(start + offset)
+                return np.fromfile(f, dtype=dtype, count=count).reshape(shape)
+
+            return _decode(desc['tree'], arrays)
+
+    def sync(self):
+        """
+        Flushes the file to disk, e.g., before recording in a
+        :class:`~splitpy.store.RunJournal` that the items of an event are
+        saved
+
+        """
+
+        if os.path.exists(self.path):
+            fd = os.open(self.path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def compact(self):
+        """
+        Rewrites the file with only the latest record of each item
+
+        """
+
+        tmp = StationStore(self.path + '.tmp')
+        if os.path.exists(tmp.path):
+            os.remove(tmp.path)
+        for key, name in sorted(self.index):
+            tmp.put(key, name, self.get(key, name))
+        if os.path.exists(tmp.path):
+            os.replace(tmp.path, self.path)
+        self.index = tmp.index
+        self._end = tmp._end
+
+    def close(self):
+
+        pass
+
+
+class LegacyStore(object):
+    """
+    A LegacyStore object reads and writes event data and splitting results
+    in the original layout, i.e., one folder per event containing separate
+    pickle files.
+
+    Attributes
+    ----------
+    path : str
+        Path to station directory
+
+    """
+
+    FILES = {'ZNE': 'ZNE_data.pkl',
+             'LQT': 'LQT_data.pkl',
+             'meta': 'Meta_data.pkl',
+             'station': 'Station_data.pkl',
+             'results_auto': 'Split_results_auto.pkl',
+             'results_manual': 'Split_results_manual.pkl'}
+
+    def __init__(self, path):
+
+        self.path = str(path)
+
+    def __len__(self):
+
+        return len(self.keys())
+
+    def keys(self):
+
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(x.name for x in Path(self.path).iterdir()
+                      if x.is_dir())
+
+    def _file(self, key, name):
+
+        if name in self.FILES:
+            file = Path(self.path) / key / self.FILES[name]
+        else:
+            # Items of additional phases (e.g., 'results_auto_SKKS') have
+            # the phase as suffix of the file name
+            base = max([item for item in self.FILES
+                        if name.startswith(item + '_')], key=len,
+                       default=None)
+            if base is None:
+                raise KeyError(name)
+            stem, ext = os.path.splitext(self.FILES[base])
+            file = Path(self.path) / key / (stem + name[len(base):] + ext)
+        if not file.exists() and name.startswith('results'):
+            # Older versions also used lower-case file names
+            lower = file.with_name(file.name.lower())
+            if lower.exists():
+                return lower
+        return file
+
+    def has(self, key, name):
+
+        return self._file(key, name).exists()
+
+    def figdir(self, key):
+
+        return Path(self.path) / key
+
+    def put(self, key, name, obj):
+
+        # Write to a temporary file that replaces the pickle file once
+        # complete, such that an interruption never leaves a partial file
+        file = self._file(key, name)
+        file.parent.mkdir(parents=True, exist_ok=True)
+        tmpfile = file.with_name(file.name + '.tmp')
+        with open(tmpfile, 'wb') as f:
+            if name.startswith('results'):
+                for attr in RESULTS:
+                    pickle.dump(obj[attr], f)
+            else:
+                pickle.dump(obj, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmpfile, file)
+
+    def sync(self):
+
+        # Pickle files are flushed when written
+        pass
+
+    def get(self, key, name, mmap=False):
+
+        # Pickled items cannot be memory-mapped and are read in full
+        with open(self._file(key, name), 'rb') as f:
+            if name.startswith('results'):
+                return {attr: pickle.load(f) for attr in RESULTS}
+            return pickle.load(f)
+
+    def close(self):
+
+        pass
+
+
+def meta_name(name):
+    """
+    Returns the name of the metadata item of a results item. Results of
+    additional phases (e.g., ``'results_auto_SKKS'``, see
+    :meth:`~splitpy.classes.Split.item_name`) have their own metadata
+    (e.g., ``'meta_SKKS'``).
+
+    Parameters
+    ----------
+    name : str
+        Name of results item
+
+    Returns
+    -------
+    name : str
+        Name of metadata item
+
+    """
+
+    for prefix in ['results_auto', 'results_manual']:
+        if name.startswith(prefix + '_'):
+            return 'meta' + name[len(prefix):]
+    return 'meta'
+
+
+def _float(value):
+
+    return np.nan if value is None else float(value)
+
+
+def results_row(key, meta, results):
+    """
+    Returns the row of the results table for an event
+
+    Parameters
+    ----------
+    key : str
+        Event key
+    meta : :class:`~splitpy.classes.Meta`
+        Event metadata
+    results : Dict
+        Splitting results (``SC_res``, ``RC_res``, ``null`` and
+        ``quality``)
+
+    Returns
+    -------
+    row : :class:`~numpy.ndarray`
+        Structured array of length 1 with dtype
+        :data:`~splitpy.store.RESULTS_DTYPE`
+
+    """
+
+    row = np.zeros(1, dtype=RESULTS_DTYPE)
+    row['key'] = key
+    row['time'] = meta.time.timestamp
+    row['baz'] = meta.baz
+    row['gac'] = meta.gac
+    row['snrq'] = _float(meta.snrq)
+    row['snrt'] = _float(meta.snrt)
+    for tag in ['RC', 'SC']:
+        res = results[tag + '_res']
+        row['phi' + tag] = _float(res.phi)
+        row['ephi' + tag] = _float(res.ephi)
+        row['dt' + tag] = _float(res.dtt)
+        row['edt' + tag] = _float(res.edtt)
+    row['null'] = bool(results['null'])
+    row['quality'] = results['quality'] or ''
+
+    return row
+
+
+class ResultsTable(object):
+    """
+    A ResultsTable object contains the scalar splitting results of a
+    station, stored as fixed-size records (one per event) in the station
+    directory. Rows are appended when results are saved; the latest row of
+    each event is used when the table is loaded.
+
+    Attributes
+    ----------
+    path : str
+        Path to table file
+
+    """
+
+    def __init__(self, datapath, name='results_auto'):
+
+        self.path = str(Path(datapath) / (name + '.tbl'))
+        self.name = name
+
+    def exists(self):
+
+        return os.path.exists(self.path)
+
+    def append(self, key, meta, results, store=None):
+        """
+        Appends the results of an event. See
+        :func:`~splitpy.store.results_row` for the parameters. If the
+        table does not exist yet and the ``store`` of the station is given,
+        the table is instead built from all the results in the store
+        (which must already contain these results).
+
+        """
+
+        if not self.exists() and store is not None:
+            self.build(store)
+            return
+
+        row = results_row(key, meta, results)
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        mode = 'r+b' if self.exists() else 'wb'
+        with open(self.path, mode) as f:
+            # Drop a partly written row
+            size = os.fstat(f.fileno()).st_size
+            f.seek(size - size % RESULTS_DTYPE.itemsize)
+            f.write(row.tobytes())
+            f.truncate()
+            f.flush()
+            os.fsync(f.fileno())
+
+    def load(self):
+        """
+        Loads the table
+
+        Returns
+        -------
+        table : :class:`~numpy.ndarray`
+            Structured array with dtype :data:`~splitpy.store.RESULTS_DTYPE`
+            with the latest row of each event, sorted by event key
+
+        """
+
+        if not self.exists():
+            return np.zeros(0, dtype=RESULTS_DTYPE)
+        count = os.path.getsize(self.path)//RESULTS_DTYPE.itemsize
+        table = np.fromfile(self.path, dtype=RESULTS_DTYPE, count=count)
+
+        # Keep the latest row of each event
+        keys, index = np.unique(table['key'][::-1], return_index=True)
+        return table[len(table) - 1 - index]
+
+    def build(self, store):
+        """
+        Rebuilds the table from the results saved in a store
+
+        Parameters
+        ----------
+        store : :class:`~splitpy.store.StationStore` or
+            :class:`~splitpy.store.LegacyStore`
+            Store of the station
+
+        Returns
+        -------
+        nrow : int
+            Number of rows
+
+        """
+
+        meta = meta_name(self.name)
+        rows = [results_row(key, store.get(key, meta),
+                            store.get(key, self.name))
+                for key in store.keys()
+                if store.has(key, self.name) and store.has(key, meta)]
+        table = np.concatenate(rows) if len(rows) > 0 else \
+            np.zeros(0, dtype=RESULTS_DTYPE)
+
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        tmpfile = self.path + '.tmp'
+        table.tofile(tmpfile)
+        os.replace(tmpfile, self.path)
+
+        return len(table)
+
+
+def _cube_dtype(nphi, ndt):
+    """
+    Returns the record dtype of an :class:`~splitpy.store.EmatCube`
+
+    """
+
+    return np.dtype([('key', 'S16'), ('errc', '<f8'), ('vmin', '<f8'),
+                     ('dof', '<f8'), ('Emat', '<f4', (nphi, ndt))])
+
+
+class EmatCube(object):
+    """
+    An EmatCube object contains the energy matrices of the Silver-Chan
+    method for the events of a station, in the geographic frame (i.e.,
+    rotated such that the first axis is the azimuth of the fast axis from
+    -90 to 90 degrees, to the nearest sample). The matrices are stored as
+    fixed-size float32 records (one per event) after a short header giving
+    the grid, and are memory-mapped when loaded, such that matrices of
+    many events can be stacked without reading them into memory. Records
+    are appended when results are saved; the latest record of each event
+    is used.
+
+    Attributes
+    ----------
+    path : str
+        Path to cube file
+    nphi : int
+        Number of samples in azimuth
+    ndt : int
+        Number of samples in delay time
+    dphi : float
+        Sampling distance in azimuth (deg)
+    ddt : float
+        Sampling distance in delay time (sec)
+
+    """
+
+    def __init__(self, datapath, name='results_auto'):
+
+        self.path = str(Path(datapath) / (name + '.emc'))
+        self.name = name
+        self.nphi = self.ndt = None
+        self.dphi = self.ddt = None
+        if self.exists():
+            with open(self.path, 'rb') as f:
+                head = f.read(_CUBE_HEAD.size)
+            if len(head) == _CUBE_HEAD.size:
+                magic, nphi, ndt, dphi, ddt = _CUBE_HEAD.unpack(head)
+                # A cube without records has no grid yet
+                if magic == _CUBE_MAGIC and nphi > 0:
+                    self.nphi, self.ndt = nphi, ndt
+                    self.dphi, self.ddt = dphi, ddt
+
+    def exists(self):
+
+        return os.path.exists(self.path)
+
+    @staticmethod
+    def row(key, meta, results):
+        """
+        Returns the record of an event, or `None` if the Silver-Chan
+        energy matrix is not available
+
+        Parameters
+        ----------
+        key : str
+            Event key
+        meta : :class:`~splitpy.classes.Meta`
+            Meta data of the event
+        results : Dict
+            Splitting results (``SC_res``, ``RC_res``, ``null`` and
+            ``quality``)
+
+        Returns
+        -------
+        row : :class:`~numpy.ndarray`
+            Record with a single row
+        ddt : float
+            Sampling distance in delay time (sec)
+
+        """
+
+        from splitpy import calc
+
+        res = results['SC_res']
+        Emat = res.Emat
+        errc = _float(res.errc)
+        if Emat is None or not np.isfinite(errc) or errc <= 0.:
+            return None, None
+        nphi, ndt = Emat.shape
+        vmin = float(Emat.min())
+
+        # Rotate to geographic frame
+        shift = int(round((res.phi - res.phi_min)/(180./nphi)))
+
+        row = np.zeros(1, dtype=_cube_dtype(nphi, ndt))
+        row['key'] = key
+        row['errc'] = errc
+        row['vmin'] = vmin
+        row['dof'] = calc.split_dof_contour(errc/vmin) if vmin > 0. \
+            else np.nan
+        row['Emat'] = np.roll(Emat, shift, axis=0)
+
+        return row, meta.ddt
+
+    def _write(self, rows, ddt, mode):
+        """
+        Writes records, with the header if the file is created
+
+        """
+
+        nphi, ndt = rows.dtype['Emat'].shape
+        with open(self.path, mode) as f:
+            if mode == 'wb':
+                head = _CUBE_HEAD.pack(_CUBE_MAGIC, nphi, ndt, 180./nphi,
+                                       ddt)
+                f.write(head + b'\0'*(_CUBE_OFFSET - len(head)))
+            else:
+                # Drop a partly written record
+                size = os.fstat(f.fileno()).st_size - _CUBE_OFFSET
+                f.seek(_CUBE_OFFSET + size - size % rows.dtype.itemsize)
+            f.write(rows.tobytes())
+            f.truncate()
+            f.flush()
+            os.fsync(f.fileno())
+        self.nphi, self.ndt = nphi, ndt
+        self.dphi, self.ddt = 180./nphi, ddt
+
+    def append(self, key, meta, results, store=None):
+        """
+        Appends the energy matrix of an event. See
+        :meth:`~splitpy.store.EmatCube.row` for the parameters. If the
+        cube does not exist yet and the ``store`` of the station is given,
+        the cube is instead built from all the results in the store
+        (which must already contain these results).
+
+        Returns
+        -------
+        success : bool
+            Whether the matrix was added. Matrices that are not available
+            or that have a different grid than the cube are not added.
+
+        """
+
+        if not self.exists() and store is not None:
+            self.build(store)
+            return True
+
+        row, ddt = self.row(key, meta, results)
+        if row is None:
+            return False
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        if self.nphi is None:
+            self._write(row, ddt, 'wb')
+        elif (row.dtype['Emat'].shape != (self.nphi, self.ndt) or
+                not np.isclose(ddt, self.ddt)):
+            return False
+        else:
+            self._write(row, ddt, 'r+b')
+
+        return True
+
+    def load(self):
+        """
+        Memory-maps the cube
+
+        Returns
+        -------
+        cube : :class:`~numpy.memmap`
+            Structured array of records, with fields ``key``, ``errc``,
+            ``vmin``, ``dof`` and ``Emat``
+
+        """
+
+        if self.nphi is None:
+            return np.zeros(0, dtype=_cube_dtype(0, 0))
+        dtype = _cube_dtype(self.nphi, self.ndt)
+        count = (os.path.getsize(self.path) - _CUBE_OFFSET)//dtype.itemsize
+        if count == 0:
+            return np.zeros(0, dtype=dtype)
+
+        return np.memmap(self.path, dtype=dtype, mode='r',
+                         offset=_CUBE_OFFSET, shape=(count,))
+
+    def select(self, cube, keys=None):
+        """
+        Selects the latest record of events
+
+        Parameters
+        ----------
+        cube : :class:`~numpy.ndarray`
+            Records returned by :meth:`~splitpy.store.EmatCube.load`
+        keys : List
+            Event keys (str or bytes) to select [Default selects all]
+
+        Returns
+        -------
+        select : :class:`~numpy.ndarray`
+            Boolean array of selected records
+
+        """
+
+        select = np.zeros(len(cube), dtype=bool)
+        ckeys = np.asarray(cube['key'])
+        uniq, index = np.unique(ckeys[::-1], return_index=True)
+        select[len(cube) - 1 - index] = True
+        if keys is not None:
+            keys = [key.encode() if isinstance(key, str) else key
+                    for key in keys]
+            select &= np.isin(ckeys, keys)
+
+        return select
+
+    def build(self, store):
+        """
+        Rebuilds the cube from the results saved in a store. Events with
+        a different grid than the first one are left out.
+
+        Parameters
+        ----------
+        store : :class:`~splitpy.store.StationStore` or
+            :class:`~splitpy.store.LegacyStore`
+            Store of the station
+
+        Returns
+        -------
+        nrow : int
+            Number of records
+
+        """
+
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        tmpfile = self.path + '.tmp'
+        if os.path.exists(tmpfile):
+            os.remove(tmpfile)
+        tmp = EmatCube.__new__(EmatCube)
+        tmp.path = tmpfile
+        tmp.nphi = tmp.ndt = tmp.dphi = tmp.ddt = None
+
+        nrow = 0
+        meta = meta_name(self.name)
+        for key in store.keys():
+            if not (store.has(key, self.name) and store.has(key, meta)):
+                continue
+            if tmp.append(key, store.get(key, meta),
+                          store.get(key, self.name)):
+                nrow += 1
+
+        if nrow == 0:
+            # Empty cube, such that later events are appended instead of
+            # building the cube again
+            head = _CUBE_HEAD.pack(_CUBE_MAGIC, 0, 0, 0., 0.)
+            with open(tmpfile, 'wb') as f:
+                f.write(head + b'\0'*(_CUBE_OFFSET - len(head)))
+            os.replace(tmpfile, self.path)
+            self.nphi = self.ndt = self.dphi = self.ddt = None
+            return 0
+
+        os.replace(tmpfile, self.path)
+        self.nphi, self.ndt = tmp.nphi, tmp.ndt
+        self.dphi, self.ddt = tmp.dphi, tmp.ddt
+
+        return nrow
+
+
+# Statuses of events recorded in a RunJournal. Nothing is left to do for
+# an event with one of the final statuses, whereas events that were only
+# downloaded or analyzed are resumed from the data in the store
+JOURNAL_STATUS = ['rejected/geometry', 'rejected/SNR', 'rejected/analysis',
+                  'downloaded', 'analyzed', 'saved']
+JOURNAL_FINAL = ['rejected/geometry', 'rejected/SNR', 'rejected/analysis',
+                 'saved']
+
+
+class RunJournal(object):
+    """
+    A RunJournal object records the processing status of the events of a
+    station in an append-only file of JSON lines, one line per change of
+    status. Each line carries a digest of the processing parameters:
+    statuses recorded with different parameters are ignored, such that
+    changing a parameter reprocesses the events. A partly written line at
+    the end of the file (e.g., after an interruption) is ignored.
+
+    Attributes
+    ----------
+    path : str
+        Path to journal file
+    params : Dict
+        Processing parameters
+    digest : str
+        Digest of the processing parameters
+    status : Dict
+        Latest status of each event recorded with the same parameters,
+        keyed by event key
+
+    """
+
+    def __init__(self, datapath, params, name='journal_auto'):
+
+        self.path = str(Path(datapath) / (name + '.jnl'))
+        self.params = params
+        self.digest = self.make_digest(params)
+        self.status = {}
+        self._newline = False
+        self._started = False
+        if os.path.exists(self.path):
+            self._load()
+
+    @staticmethod
+    def make_digest(params):
+        """
+        Returns a short digest of processing parameters
+
+        """
+
+        text = json.dumps(params, sort_keys=True, default=str)
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]
+
+    def _load(self):
+
+        with open(self.path, 'rb') as f:
+            lines = f.read().split(b'\n')
+
+        # The last element is empty if the file ends with a complete line
+        self._newline = len(lines[-1]) > 0
+        for line in lines[:-1]:
+            try:
+                entry = json.loads(line.decode('utf-8'))
+            except ValueError:
+                continue
+            if entry.get('params') == self.digest and 'key' in entry:
+                self.status[entry['key']] = entry['status']
+
+    def get(self, key):
+        """
+        Returns the latest status of an event, or `None`
+
+        """
+
+        return self.status.get(key)
+
+    def done(self, key):
+        """
+        Returns whether nothing is left to do for an event
+
+        """
+
+        return self.status.get(key) in JOURNAL_FINAL
+
+    def _append(self, entry):
+
+        line = json.dumps(entry, default=str).encode('utf-8') + b'\n'
+        if self._newline:
+            line = b'\n' + line
+            self._newline = False
+
+        # A single write on a file opened in append mode
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+                     0o644)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+
+    def record(self, key, status, **info):
+        """
+        Records the status of an event
+
+        Parameters
+        ----------
+        key : str
+            Event key
+        status : str
+            Status (one of :data:`~splitpy.store.JOURNAL_STATUS`)
+        info : Dict
+            Additional information saved with the status (e.g., SNR)
+
+        """
+
+        if status not in JOURNAL_STATUS:
+            raise ValueError("Unknown status: " + str(status))
+
+        # Parameters are saved once per run
+        if not self._started:
+            self._append({'params': self.digest, 'args': self.params,
+                          'time': time.strftime('%Y-%m-%dT%H:%M:%S')})
+            self._started = True
+
+        entry = {'params': self.digest, 'key': key, 'status': status}
+        entry.update(info)
+        self._append(entry)
+        self.status[key] = status
+
+
+def open_store(datapath):
+    """
+    Opens the store of a station directory. The original layout of one
+    folder per event is used if the directory contains data in that layout
+    and no store file, otherwise a :class:`~splitpy.store.StationStore`.
+
+    Parameters
+    ----------
+    datapath : str or :class:`~pathlib.Path`
+        Station directory (e.g., ``DATA/NY.MMPY``)
+
+    Returns
+    -------
+    store : :class:`~splitpy.store.StationStore` or
+        :class:`~splitpy.store.LegacyStore`
+
+    """
+
+    datapath = Path(datapath)
+    if not (datapath / STORE_NAME).exists() and datapath.is_dir() and \
+            any(True for x in datapath.glob('*/*.pkl')):
+        return LegacyStore(datapath)
+    return StationStore(datapath / STORE_NAME)
+
+
+def migrate(datapath, remove=False, verbose=False):
+    """
+    Converts the event folders of a station directory to a
+    :class:`~splitpy.store.StationStore`. Figures saved in the event
+    folders are kept.
+
+    Parameters
+    ----------
+    datapath : str or :class:`~pathlib.Path`
+        Station directory (e.g., ``DATA/NY.MMPY``)
+    remove : bool
+        Whether to remove the pickle files once converted
+    verbose : bool
+        Whether to print the events converted
+
+    Returns
+    -------
+    nev : int
+        Number of events converted
+
+    """
+
+    legacy = LegacyStore(datapath)
+    file = Path(datapath) / STORE_NAME
+
+    # Write to a temporary file, such that an interrupted conversion is
+    # started over
+    tmpfile = file.with_suffix('.tmp')
+    if tmpfile.exists():
+        os.remove(tmpfile)
+    store = StationStore(tmpfile)
+
+    converted = []
+    for key in legacy.keys():
+        names = [name for name in NAMES if legacy.has(key, name)]
+        if len(names) == 0:
+            continue
+        for name in names:
+            store.put(key, name, legacy.get(key, name))
+        converted.append((key, names))
+        if verbose:
+            print("*   {0}: {1}".format(key, ", ".join(names)))
+
+    if len(converted) > 0:
+        os.replace(tmpfile, file)
+        store = StationStore(file)
+        for name in ['results_auto', 'results_manual']:
+            ResultsTable(datapath, name).build(store)
+
+    if remove:
+        for key, names in converted:
+            for name in names:
+                os.remove(legacy._file(key, name))
+            try:
+                os.rmdir(Path(datapath) / key)
+            except OSError:
+                pass
+
+    return len(converted)
+
+
+def merge_parts(datapath, parts, remove=True):
+    """
+    Merges partial station directories (e.g., written by different
+    processes for different time ranges, see :mod:`~splitpy.workqueue`)
+    into a station directory: the items of the stores are copied to the
+    store of the station, the journals are appended to the journals of
+    the station, and the results are appended to the results tables and
+    cube. Merging again after an interruption gives the same result.
+
+    Parameters
+    ----------
+    datapath : str or :class:`~pathlib.Path`
+        Station directory (e.g., ``DATA/NY.MMPY``)
+    parts : List
+        Partial station directories
+    remove : bool
+        Whether to remove the partial directories once merged
+
+    Returns
+    -------
+    nitem : int
+        Number of items merged
+
+    """
+
+    import shutil
+
+    datapath = Path(datapath)
+    datapath.mkdir(parents=True, exist_ok=True)
+    store = open_store(datapath)
+
+    nitem = 0
+    results = []
+    for part in parts:
+        part = Path(part)
+        if (part / STORE_NAME).exists():
+            src = StationStore(part / STORE_NAME)
+            for key, name in sorted(src.index):
+                store.put(key, name, src.get(key, name))
+                nitem += 1
+                if name.startswith('results'):
+                    results.append((key, name))
+        for file in sorted(part.glob('*.jnl')):
+            with open(file, 'rb') as f:
+                lines = f.read()
+            if len(lines) > 0 and not lines.endswith(b'\n'):
+                lines = lines[:lines.rfind(b'\n') + 1]
+            with open(datapath / file.name, 'ab') as f:
+                f.write(lines)
+    store.sync()
+
+    for key, name in results:
+        if not store.has(key, meta_name(name)):
+            continue
+        meta = store.get(key, meta_name(name))
+        res = store.get(key, name)
+        ResultsTable(datapath, name).append(key, meta, res, store=store)
+        if name.startswith('results_auto'):
+            EmatCube(datapath, name).append(key, meta, res, store=store)
+
+    if remove:
+        for part in parts:
+            shutil.rmtree(part, ignore_errors=True)
+
+    return nitem
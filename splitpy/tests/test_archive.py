@@ -0,0 +1,186 @@
+import os
+from types import SimpleNamespace
+from splitpy import archive, utils
+
+
+def test_archive_index(tmp_path):
+    root = tmp_path / 'data'
+    (root / '2016').mkdir(parents=True)
+    names = ['2016.237.NY.MMPY..HHZ.SAC', '2016.237.NY.MMPY..HHN.SAC',
+             '2016.237.NY.MMPY..BH1.SAC', '2016.238.XX.MMPY..HHE.SAC',
+             'notes.txt']
+    for name in names:
+        (root / '2016' / name).touch()
+
+    index = archive.ArchiveIndex(tmp_path / 'index.db')
+    assert index.update([str(root)]) == 2
+    assert len(index) == 4
+
+    sta = SimpleNamespace(station='MMPY', network='NY', channel='HH',
+                          altnet=['XX'])
+    view = utils.list_local_data_stn(
+        lcldrs=[str(root)], sta='MMPY', net='NY', altnet=['XX'], index=index)
+    stalist = utils.list_local_data_stn(
+        lcldrs=[str(root)], sta='MMPY', net='NY', altnet=['XX'])
+    assert len(view) == len(stalist) == 4
+    for jday, comp in [('237', 'Z'), ('237', '1'), ('238', 'E')]:
+        assert utils.find_local_files(view, sta, '2016', jday, comp) == \
+            utils.find_local_files(stalist, sta, '2016', jday, comp)
+    assert len(utils.find_local_files(view, sta, '2016', '238', 'E')) == 1
+
+    # Unchanged directories are not listed again
+    assert index.update([str(root)]) == 0
+
+    os.remove(root / '2016' / names[0])
+    assert index.update([str(root)]) == 1
+    assert utils.find_local_files(view, sta, '2016', '237', 'Z') == []
+
+    # Files rewritten in place are checked in unchanged directories
+    file = str(root / '2016' / names[1])
+    os.utime(file, (1., 1.))
+    assert index.update([str(root)]) == 0
+    assert index.db.execute("SELECT mtime FROM files WHERE path = ?",
+                            (file,)).fetchone()[0] == 1.
+
+    # Archives no longer listed are removed from the index
+    other = tmp_path / 'other'
+    other.mkdir()
+    (other / names[0]).touch()
+    assert index.update([str(other)]) == 1
+    assert len(index) == 1
+    assert utils.find_local_files(view, sta, '2016', '237', 'N') == []
+
+
+def _write_days(root, npts=86400):
+    import numpy as np
+    from obspy import Trace, UTCDateTime
+    for jday in [237, 238]:
+        for comp in 'ZNE':
+            tr = Trace(data=np.arange(npts, dtype=np.float32)*(jday - 236))
+            tr.stats.network = 'NY'
+            tr.stats.station = 'MMPY'
+            tr.stats.channel = 'HH' + comp
+            tr.stats.sampling_rate = 1.
+            tr.stats.starttime = UTCDateTime(2016, 1, 1) + (jday - 1)*86400.
+            tr.write(str(root / '2016.{0:d}.NY.MMPY..HH{1}.SAC'.format(
+                jday, comp)), format='SAC')
+
+
+def test_dayfile_planner(tmp_path):
+    from obspy import UTCDateTime
+    _write_days(tmp_path)
+    sta = SimpleNamespace(station='MMPY', network='NY', channel='HH',
+                          altnet=[])
+    stalist = utils.list_local_data_stn(
+        lcldrs=[str(tmp_path)], sta='MMPY', net='NY')
+    t0 = UTCDateTime(2016, 8, 24)
+    windows = [(t0 + 3600., t0 + 3840.), (t0 + 7200., t0 + 7440.),
+               (t0 + 86280., t0 + 86520.)]
+    planner = archive.DayFilePlanner(stalist, sta, windows=windows)
+    for start, end in windows:
+        err1, st1 = planner.parse_comp(
+            comp='N', sta=sta, start=start, end=end)
+        err2, st2 = utils.parse_localdata_for_comp(
+            comp='N', stdata=stalist, sta=sta, start=start, end=end)
+        assert not err1 and not err2
+        assert st1[0].stats.starttime == st2[0].stats.starttime
+        assert (st1[0].data == st2[0].data).all()
+    # Two day files read once each; released after their last window
+    assert planner.nread == 2
+    assert len(planner._cache) == 0
+
+    # Windows of events that are not retrieved are released
+    planner = archive.DayFilePlanner(stalist, sta, windows=windows[1:])
+    planner.parse_comp(comp='N', sta=sta, start=windows[1][0],
+                       end=windows[1][1])
+    assert len(planner._cache) == 1
+    planner.release(*windows[2])
+    assert len(planner._cache) == 0
+    assert not any(['HHN' in path for path in planner.refs])
+
+    # No-data values are converted to the value of the request
+    from obspy import read
+    file = stalist[0]
+    tr = read(file)[0]
+    tr.stats.sac.user9 = 3600.
+    tr.write(file, format='SAC')
+    planner = archive.DayFilePlanner([file], sta)
+    err, st = planner.parse_comp(comp=tr.stats.channel[-1], sta=sta,
+                                 start=windows[0][0], end=windows[0][1],
+                                 ndval=0.)
+    assert not err and st[0].data[0] == 0. and st[0].data[1] == 3601.
+    err, st = planner.parse_comp(comp=tr.stats.channel[-1], sta=sta,
+                                 start=windows[0][0], end=windows[0][1])
+    assert err
+
+
+def test_mapped_sac(tmp_path):
+    import numpy as np
+    from obspy import UTCDateTime
+    _write_days(tmp_path)
+    sta = SimpleNamespace(station='MMPY', network='NY', channel='HH',
+                          altnet=[])
+    stalist = utils.list_local_data_stn(
+        lcldrs=[str(tmp_path)], sta='MMPY', net='NY')
+    reader = archive.MappedSACReader(stalist, sta)
+    t0 = UTCDateTime(2016, 8, 24)
+    windows = [(t0 + 3600.4, t0 + 3840.6), (t0 + 86280., t0 + 86520.)]
+    for start, end in windows:
+        err1, st1 = reader.parse_comp(
+            comp='E', sta=sta, start=start, end=end)
+        err2, st2 = utils.parse_localdata_for_comp(
+            comp='E', stdata=stalist, sta=sta, start=start, end=end)
+        assert not err1 and not err2
+        assert st1[0].id == st2[0].id
+        assert st1[0].stats.starttime == st2[0].stats.starttime
+        assert (st1[0].data == st2[0].data).all()
+
+    # Windows refer to the mapped file; no-data values are converted on copy
+    sac = archive.MappedSAC(str(tmp_path / '2016.237.NY.MMPY..HHZ.SAC'))
+    tr = sac.slice(t0 + 10., t0 + 20.)
+    assert len(tr) == 11 and np.shares_memory(tr.data, sac.data)
+    sac.user9 = 15.
+    assert archive.convert_nodata(tr, sac.user9)
+    assert np.isnan(tr.data[5]) and not np.isnan(sac.data).any()
+
+
+def test_sds_reader(tmp_path):
+    import numpy as np
+    from obspy import Trace, UTCDateTime
+    t0 = UTCDateTime(2016, 8, 24)
+    for day in [t0, t0 + 86400.]:
+        for cha in ['HHZ', 'HH1']:
+            tr = Trace(data=np.arange(86400, dtype=np.int32) +
+                       int(day - t0))
+            tr.stats.network = 'NY'
+            tr.stats.station = 'MMPY'
+            tr.stats.channel = cha
+            tr.stats.starttime = day
+            path = tmp_path / day.strftime('%Y') / 'NY' / 'MMPY' / \
+                (cha + '.D')
+            path.mkdir(parents=True, exist_ok=True)
+            tr.write(str(path / 'NY.MMPY..{0}.D.{1}'.format(
+                cha, day.strftime('%Y.%j'))), format='MSEED', reclen=512)
+
+    sta = SimpleNamespace(station='MMPY', network='NY', channel='HH',
+                          altnet=[])
+    reader = archive.SDSReader([str(tmp_path)], sta)
+    assert len(reader) == 4
+
+    start = t0 + 3600.
+    err, st = reader.parse_comp(comp='Z', sta=sta, start=start,
+                                end=start + 240.)
+    assert not err and st[0].id == 'NY.MMPY..HHZ'
+    assert (st[0].data == np.arange(3600, 3841)).all()
+    # Only the overlapping records are selected
+    index = list(reader.indexes.values())[0][1]
+    assert 0 < len(index.select(start, start + 240.)) < len(index) // 10
+
+    # Window across midnight
+    start = t0 + 86280.
+    err, st = reader.parse_comp(comp='1', sta=sta, start=start,
+                                end=start + 240.)
+    assert not err and st[0].stats.channel == 'HH1'
+    assert (st[0].data == np.arange(86280, 86521)).all()
+    assert reader.parse_comp(comp='E', sta=sta, start=start,
+                             end=start + 240.) == (True, None)
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+from types import SimpleNamespace
+from obspy import Stream, Trace, UTCDateTime
+from splitpy import batch, utils
+
+
+def _zne(phi=30., dt=1.2, baz=60.):
+    # Split SKS wavelet on Z, N and E components sampled at 10 Hz, with
+    # the arrival 300 sec after the start of the traces
+    t0 = UTCDateTime('2016-08-24T01:02:03')
+    t = np.arange(6000)/10.
+    theta = (phi - baz)*np.pi/180.
+    fast = np.cos(theta)*np.exp(-((t - 300.)/4.)**2) * \
+        np.sin(2.*np.pi*0.1*(t - 300.))
+    slow = np.sin(theta)*np.exp(-((t - 300. - dt)/4.)**2) * \
+        np.sin(2.*np.pi*0.1*(t - 300. - dt))
+    q = np.cos(theta)*fast + np.sin(theta)*slow
+    tt = -np.sin(theta)*fast + np.cos(theta)*slow
+    zne = utils.rotation_matrix('LQT', baz=baz, inc=10.).T @ np.array(
+        [0.*t, q, tt])
+    zne += 0.01*np.random.default_rng(0).standard_normal(zne.shape)
+    st = Stream()
+    for comp, data in zip('ZNE', zne):
+        st.append(Trace(data=data, header={
+            'channel': 'BH' + comp, 'sampling_rate': 10., 'starttime': t0}))
+    return st, t0
+
+
+def test_check_spec():
+    spec = batch.check_spec({
+        'stations': 'NY.MMPY,IU', 'start': '2016-01-01',
+        'defaults': {'maxdt': 3.},
+        'configs': {'low': {'fmax': 0.2}, 'SKKS': {'phase': 'SKKS'}}})
+    assert spec['stations'] == ['NY.MMPY', 'IU']
+    assert spec['start'] == UTCDateTime(2016, 1, 1)
+    assert spec['configs']['low']['maxdt'] == 3.
+    assert spec['configs']['low']['fmax'] == 0.2
+    assert spec['configs']['SKKS']['phase'] == 'SKKS'
+    assert batch.select_stations(spec, {'NY.MMPY': 0, 'IU.ANMO': 0,
+                                        'CN.LMN': 0}) == ['IU.ANMO',
+                                                          'NY.MMPY']
+
+    for bad in [{'configs': {}}, {'confs': {'a': {}}},
+                {'configs': {'a': {'fmin': 1., 'fmax': 0.5}}},
+                {'configs': {'a': {'band': 1.}}},
+                {'configs': {'../a': {}}}]:
+        with pytest.raises(ValueError):
+            batch.check_spec(bad)
+
+
+def test_analyze_config():
+    spec = batch.check_spec({'configs': {
+        'wide': {'dts': 150., 'maxdt': 3., 'ddt': 0.2, 'dphi': 5.},
+        'narrow': {'dts': 60., 'fmax': 0.2, 'maxdt': 3., 'ddt': 0.2,
+                   'dphi': 5.},
+        'strict': {'msnr': 100.}}})
+    st, t0 = _zne()
+    sta = SimpleNamespace(station='TEST', azcorr=0.)
+
+    # Configurations share the preprocessed data
+    for name, config in spec['configs'].items():
+        meta = SimpleNamespace(
+            accept=True, align='ZNE', rotated=False, time=t0, ttime=300.,
+            baz=60., inc=10.)
+        split, status = batch.analyze_config(config, sta, meta, st)
+        if name == 'strict':
+            assert status == 'rejected/SNR'
+            continue
+        assert status == 'analyzed'
+        assert len(split.dataZNE[0]) == 2*10*config['dts'] + 1
+        assert split.meta.maxdt == 3.
+        assert abs(split.SC_res.phi - 30.) <= 5.
+        assert abs(split.SC_res.dtt - 1.2) <= 0.2
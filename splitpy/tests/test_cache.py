@@ -0,0 +1,86 @@
+import os
+import numpy as np
+from types import SimpleNamespace
+from obspy import Stream, Trace, UTCDateTime
+from splitpy import cache, utils
+
+
+class FakeClient(object):
+    base_url = 'http://fake'
+
+    def __init__(self):
+        self.nrequest = 0
+
+    def get_waveforms(self, network, station, location, channel,
+                      starttime, endtime, attach_response=False):
+        self.nrequest += 1
+        traces = []
+        for cha in channel.split(','):
+            tr = Trace(data=np.random.randn(
+                int(endtime - starttime)*10 + 1).astype(np.float32))
+            tr.stats.network = network
+            tr.stats.station = station
+            tr.stats.channel = cha
+            tr.stats.sampling_rate = 10.
+            tr.stats.starttime = starttime
+            traces.append(tr)
+        return Stream(traces=traces)
+
+
+def test_waveform_cache(tmp_path):
+    client = FakeClient()
+    wfcache = cache.WaveformCache(tmp_path, maxsize=1.e9)
+    sta = SimpleNamespace(station='MMPY', network='NY', channel='HH',
+                          location=[''], altnet=[])
+    start = UTCDateTime(2016, 8, 24, 1)
+    err1, st1 = utils.download_data(client=client, sta=sta, start=start,
+                                    end=start + 240., cache=wfcache)
+    err2, st2 = utils.download_data(client=client, sta=sta, start=start,
+                                    end=start + 240., cache=wfcache)
+    assert not err1 and not err2
+    assert client.nrequest == 1 and wfcache.hits == 1
+    for tr1, tr2 in zip(st1, st2):
+        assert tr1.id == tr2.id and tr1.stats == tr2.stats
+        assert np.allclose(tr1.data, tr2.data)
+
+    # Least recently used requests are evicted first
+    for file in tmp_path.glob('*.npz'):
+        os.utime(file, (1., 1.))
+    key = wfcache.key('NY', 'MMPY', '', 'HHZ', start, start + 1., 'x')
+    wfcache.put(key, Stream())
+    size = wfcache.size()
+    wfcache.maxsize = size - 1
+    wfcache.evict()
+    assert wfcache.get(key) is not None
+    assert wfcache.size() < size
+
+
+def test_cache_sources(tmp_path):
+    from obspy.clients.fdsn.header import FDSNNoDataException
+    from splitpy import archive
+
+    # Local data are identified by backend and files
+    sta = SimpleNamespace(station='MMPY', network='NY', channel='HH',
+                          location=[''], altnet=[])
+    files = [str(tmp_path / 'a.SAC'), str(tmp_path / 'b.SAC')]
+    source = utils.local_source(files)
+    assert source == utils.local_source(files[::-1])
+    assert source != utils.local_source(files[:1])
+    assert source != utils.local_source(archive.MappedSACReader(files, sta))
+    assert utils.local_source(files, ndval=0.) != source
+
+    # Requests without data are not cached
+    class NoDataClient(FakeClient):
+        def get_waveforms(self, *args, **kwargs):
+            self.nrequest += 1
+            raise FDSNNoDataException('No data')
+
+    client = NoDataClient()
+    wfcache = cache.WaveformCache(tmp_path / 'cache')
+    start = UTCDateTime(2016, 8, 24, 1)
+    for i in range(2):
+        st = utils.get_waveforms(client=client, sta=sta, channels='HHZ',
+                                 start=start, end=start + 60.,
+                                 cache=wfcache)
+        assert len(st) == 0
+    assert client.nrequest == 2
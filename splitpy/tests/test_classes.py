@@ -0,0 +1,228 @@
+import numpy as np
+from types import SimpleNamespace
+from obspy import Stream, Trace, UTCDateTime
+from splitpy import calc, store
+from splitpy.classes import Result, CompactResult
+
+
+def _lqt(phi=30., baz=60., noise=0.):
+    # Radially polarized wavelet split by a fast axis with azimuth phi,
+    # on Q and T components sampled at 5 Hz
+    t0 = UTCDateTime('2016-08-24T01:02:03')
+    t = np.arange(300)/5.
+    theta = (phi - baz)*np.pi/180.
+    fast = np.cos(theta)*np.exp(-((t - 30.)/2.)**2) * \
+        np.sin(2.*np.pi*0.1*(t - 30.))
+    slow = np.sin(theta)*np.exp(-((t - 31.2)/2.)**2) * \
+        np.sin(2.*np.pi*0.1*(t - 31.2))
+    rng = np.random.default_rng(int(baz))
+    st = Stream()
+    for comp, data in zip('LQT', [0.*t, np.cos(theta)*fast +
+                                  np.sin(theta)*slow,
+                                  -np.sin(theta)*fast + np.cos(theta)*slow]):
+        data = data + noise*rng.standard_normal(len(t))
+        st.append(Trace(data=data, header={
+            'channel': 'BH' + comp, 'sampling_rate': 5., 'starttime': t0}))
+    meta = SimpleNamespace(time=t0, ttime=25., baz=baz, maxdt=3., ddt=0.2,
+                           dphi=5.)
+    return st, meta
+
+
+def test_compact_result(tmp_path):
+    st, meta = _lqt()
+    trQ = st.select(component='Q')[0]
+    trT = st.select(component='T')[0]
+    t1 = meta.time + meta.ttime - 5.
+    t2 = meta.time + meta.ttime + 25.
+
+    for method, func in [('RC', calc.split_RotCorr),
+                         ('SC', calc.split_SilverChan)]:
+        out = func(trQ, trT, meta.baz, t1, t2, meta.maxdt, meta.ddt,
+                   meta.dphi)
+        res = Result(*out[:8], 0.1, 5., 0.4, t1=t1, t2=t2)
+
+        # Compact result survives the store and reproduces the traces
+        ststore = store.StationStore(tmp_path / (method + '.spl'))
+        ststore.put('key', 'results_auto', {'res': res.compact(method)})
+        comp = ststore.get('key', 'results_auto')['res']
+        assert isinstance(comp, CompactResult)
+        assert not hasattr(comp, '__dict__')
+        full = comp.expand(st, meta)
+        assert full.Emat.min() == res.Emat.min()
+        assert np.allclose(full.Emat, res.Emat, rtol=0.,
+                           atol=np.ptp(res.Emat)/65535.)
+        for attr in ['trQ_c', 'trT_c', 'trFast', 'trSlow']:
+            assert np.allclose(getattr(full, attr).data,
+                               getattr(res, attr).data)
+            assert getattr(full, attr).stats.starttime == \
+                getattr(res, attr).stats.starttime
+
+        # Without Emat, the grid search is carried out again
+        full = res.compact(method, keep_Emat=False).expand(st, meta)
+        assert np.allclose(full.Emat, res.Emat)
+        assert np.allclose(full.trT_c.data, res.trT_c.data)
+
+
+def test_split_attach(tmp_path):
+    import pickle
+    from obspy import read
+    from splitpy import Split
+    ststore = store.StationStore(tmp_path / store.STORE_NAME)
+    ststore.put('key', 'ZNE', read())
+    split = Split({'station': 'MMPY'})
+    split.attach(ststore, 'key')
+    assert 'dataZNE' not in vars(split)
+    assert not hasattr(split, 'dataLQT')
+
+    # Data are memory-mapped when used, and modified in memory only
+    tr = split.dataZNE[0]
+    assert isinstance(tr.data, np.memmap)
+    tr.data[:] = 0.
+    assert (ststore.get('key', 'ZNE')[0].data == read()[0].data).all()
+    split.release()
+    assert 'dataZNE' not in vars(split)
+    assert (split.dataZNE[0].data == read()[0].data).all()
+
+    # Replaced data are kept; attached data are saved with the object
+    split.dataLQT = read()
+    split.release()
+    split = pickle.loads(pickle.dumps(split))
+    assert len(split.dataZNE) == 3 and len(split.dataLQT) == 3
+
+
+def test_band_sweep():
+    from splitpy import Split, utils
+    st, meta = _lqt(noise=0.02)
+    meta.inc = 10.
+    meta.accept = True
+    M = utils.rotation_matrix('LQT', baz=meta.baz, inc=meta.inc)
+    zne = M.T @ utils.stream_to_array(st, 'LQT')[1]
+    split = Split({'station': 'MMPY'})
+    split.meta = meta
+    split.dataZNE = Stream([Trace(data=data, header={
+        'channel': 'BH' + comp, 'sampling_rate': 5.,
+        'starttime': meta.time}) for comp, data in zip('ZNE', zne)])
+
+    # Same surfaces as the grid searches
+    t1 = meta.time + meta.ttime - 5.
+    t2 = meta.time + meta.ttime + 25.
+    trQ = st.select(component='Q')[0]
+    trT = st.select(component='T')[0]
+    i1, i2 = utils.trim_indices(trQ.stats, t1, t2)
+    Emat = calc.split_surfaces(trQ.data[i1:i2], trT.data[i1:i2], 0.2,
+                               meta.maxdt, meta.ddt, meta.dphi)[0]
+    assert np.allclose(Emat, calc.split_SilverChan(
+        trQ, trT, meta.baz, t1, t2, meta.maxdt, meta.ddt, meta.dphi)[0])
+
+    # Same estimates as filtering and analyzing each band
+    bands = [(0.02, 0.5), (0.05, 0.2)]
+    nodata = Split({'station': 'MMPY'})
+    nodata.meta = meta
+    try:
+        nodata.band_sweep(bands)
+        assert False
+    except Exception as e:
+        assert 'ZNE data' in str(e)
+    split.band_sweep(bands)
+    for row, (fmin, fmax) in zip(split.sweep, bands):
+        split.rotate(align='LQT')
+        split.dataLQT.filter('bandpass', freqmin=fmin, freqmax=fmax)
+        split.calc_snr()
+        split.analyze()
+        assert abs(row['snrq'] - split.meta.snrq) < 0.01
+        assert (row['phiRC'], row['dttRC']) == (split.RC_res.phi,
+                                                split.RC_res.dtt)
+        assert (row['phiSC'], row['dttSC']) == (split.SC_res.phi,
+                                                split.SC_res.dtt)
+
+
+def test_cluster_analysis():
+    from splitpy import Split
+    st, meta = _lqt(noise=0.02)
+    meta.accept = True
+    split = Split({'station': 'MMPY'})
+    split.meta = meta
+    split.dataLQT = st
+
+    # Windows of the same length are batched: same estimates as analyze
+    split.cluster_analysis(tbeg=(-8., -2.), tend=(20., 26.), nwin=4)
+    assert len(split.windows) == 16
+    assert split.windows['stable'].sum() >= 5
+    assert np.all(np.abs(split.windows['phiSC'][split.windows['stable']] -
+                         30.) <= 10.)
+    t0 = meta.time + meta.ttime
+    t1, t2 = split.SC_res.t1, split.SC_res.t2
+    row = split.windows[(split.windows['t1'] == t1 - t0) &
+                        (split.windows['t2'] == t2 - t0)][0]
+    assert row['stable']
+    assert (row['phiSC'], row['dttSC']) == (split.SC_res.phi,
+                                            split.SC_res.dtt)
+
+    labels, best, ibest = calc.cluster_estimates(
+        [30., 32., -88., 89., 31., 0.], [1., 1.2, 2., 2.1, 1.1, 3.], 3.,
+        min_size=3)
+    assert len(set(labels[[0, 1, 4]])) == 1 and labels[2] == labels[3]
+    assert best == labels[0] and ibest == 4
+
+
+def test_select_phase():
+    from splitpy import Split
+    st, meta = _lqt()
+    meta.phase = 'SKS'
+    meta.phases = {'SKS': {'ttime': 25., 'slow': 0.05, 'inc': 10.},
+                   'SKKS': {'ttime': 40., 'slow': 0.03, 'inc': 6.},
+                   'PKS': None}
+    meta.snrq, meta.snrt, meta.align, meta.rotated = 12., 3., 'LQT', True
+    split = Split({'station': 'MMPY'})
+    split.meta = meta
+    split.dataLQT = st
+    assert split.item_name('results_auto') == 'results_auto'
+    assert split.item_name('LQT', 'SKKS') == 'LQT_SKKS'
+
+    # State of each phase is set aside while another phase is analyzed
+    split.select_phase('SKKS')
+    assert split.item_name('meta') == 'meta_SKKS'
+    assert (meta.ttime, meta.inc, meta.snrq, meta.rotated) == \
+        (40., 6., None, False)
+    assert not hasattr(split, 'dataLQT')
+    split.select_phase('SKS')
+    assert (meta.ttime, meta.inc, meta.snrq, meta.rotated) == \
+        (25., 10., 12., True)
+    assert split.dataLQT is st
+    try:
+        split.select_phase('PKS')
+        assert False
+    except Exception as e:
+        assert 'PKS' in str(e)
+
+    # Items of additional phases are stored side by side
+    legacy = store.LegacyStore('DATA')
+    assert legacy._file('key', 'results_auto_SKKS').name == \
+        'Split_results_auto_SKKS.pkl'
+    assert store.meta_name('results_auto_SKKS') == 'meta_SKKS'
+    assert store.meta_name('results_manual') == 'meta'
+
+
+def test_preview():
+    import pickle
+    from splitpy import Split
+    st, meta = _lqt(noise=0.02)
+    split = Split({'station': 'MMPY'})
+    split.meta = meta
+    split.dataLQT = st
+
+    # Same estimates as analyze on the same grid, from data prepared once
+    t1 = meta.time + meta.ttime - 4.
+    t2 = meta.time + meta.ttime + 22.
+    est = split.preview(t1=t1, t2=t2, dphi=meta.dphi, ddt=meta.ddt)
+    split.analyze(t1=t1, t2=t2)
+    assert est == (split.RC_res.phi, split.RC_res.dtt, split.SC_res.phi,
+                   split.SC_res.dtt)
+    prepared = split._prepare_QT()[1]
+    assert split._prepare_QT()[1] is prepared
+    assert abs(split.preview()[2] - 30.) <= 5.
+
+    # Prepared data are updated with the LQT data, and not saved
+    split.dataLQT.filter('bandpass', freqmin=0.05, freqmax=0.2)
+    assert split._prepare_QT()[1] is not prepared
+    assert '_prepared' not in vars(pickle.loads(pickle.dumps(split)))
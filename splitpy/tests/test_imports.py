@@ -6,7 +6,8 @@ def test_obspy_import():
 
 def test_splitpy_modules():
     import splitpy
-    from splitpy import utils, calc, classes, arguments, gui
+    from splitpy import utils, calc, classes, arguments, gui, ttimes, archive, \
+        cache, store, workqueue, batch
     from splitpy.classes import Meta, Result, Split
     from splitpy import Pick, Keep, Save, Repeat
     from splitpy import PickPlot, DiagPlot
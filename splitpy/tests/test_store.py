@@ -0,0 +1,241 @@
+import pickle
+from types import SimpleNamespace
+import numpy as np
+from obspy import read
+from splitpy import store
+from splitpy.classes import Result
+
+
+def _results():
+    st = read()
+    res = Result(np.random.rand(5, 4), st[0], st[1], st[2], st[0],
+                 45., 1.2, 30., 0.1, 5., 0.4)
+    return {'SC_res': res, 'RC_res': res, 'null': False, 'quality': 'Good'}
+
+
+def test_station_store(tmp_path):
+    # Event folders in the original layout
+    datapath = tmp_path / 'NY.MMPY'
+    legacy = store.LegacyStore(datapath)
+    keys = ['20160824_010203', '20160901_000000']
+    for key in keys:
+        legacy.put(key, 'ZNE', read())
+        legacy.put(key, 'station', {'station': 'MMPY'})
+        legacy.put(key, 'results_auto', _results())
+    with open(datapath / keys[0] / 'Split_results_auto.pkl', 'rb') as f:
+        assert pickle.load(f).phi == 45.
+    assert isinstance(store.open_store(datapath), store.LegacyStore)
+
+    assert store.migrate(datapath, remove=True) == 2
+    ststore = store.open_store(datapath)
+    assert isinstance(ststore, store.StationStore)
+    assert ststore.keys() == keys
+    assert not ststore.has(keys[0], 'LQT')
+    st = ststore.get(keys[1], 'ZNE')
+    assert (st[2].data == read()[2].data).all()
+    assert st[2].stats.starttime == read()[2].stats.starttime
+    res = ststore.get(keys[1], 'results_auto')
+    assert isinstance(res['SC_res'], Result) and res['quality'] == 'Good'
+    assert res['SC_res'].Emat.shape == (5, 4)
+
+    # Latest record is used; partly written records are ignored
+    ststore.put(keys[0], 'station', {'station': 'TGTN'})
+    with open(ststore.path, 'ab') as f:
+        f.write(b'SPR1\x10\x00')
+    ststore = store.StationStore(ststore.path)
+    assert ststore.get(keys[0], 'station') == {'station': 'TGTN'}
+    ststore.put(keys[0], 'LQT', read())
+    ststore.compact()
+    ststore = store.StationStore(ststore.path)
+    assert len(ststore.index) == 7
+    assert ststore.get(keys[0], 'LQT')[0].stats.npts == 3000
+
+    # Headers set by the rotation and SAC headers are kept
+    st = read()
+    for tr in st:
+        tr.stats.back_azimuth = 60.
+        tr.stats.inclination = 10.
+    st[0].stats.sac = {'user9': -12345., 'kstnm': 'MMPY'}
+    ststore.put(keys[0], 'LQT', st)
+    for mmap in [False, True]:
+        stats = ststore.get(keys[0], 'LQT', mmap=mmap)[0].stats
+        assert (stats.back_azimuth, stats.inclination) == (60., 10.)
+        assert stats.sac.kstnm == 'MMPY' and stats.sac.user9 == -12345.
+
+    # Objects on the same file append after each other's records
+    other = store.StationStore(ststore.path)
+    ststore.put(keys[1], 'meta', 'first')
+    other.put(keys[1], 'station', 'second')
+    ststore.put(keys[1], 'LQT', read())
+    ststore = store.StationStore(ststore.path)
+    assert ststore.get(keys[1], 'meta') == 'first'
+    assert ststore.get(keys[1], 'station') == 'second'
+    assert len(ststore.get(keys[1], 'LQT')) == 3
+
+
+def test_results_table(tmp_path):
+    from types import SimpleNamespace
+    from obspy import UTCDateTime
+    ststore = store.StationStore(tmp_path / store.STORE_NAME)
+    table = store.ResultsTable(tmp_path, 'results_auto')
+    for i, key in enumerate(['20160824_010203', '20160901_000000']):
+        meta = SimpleNamespace(time=UTCDateTime(key), baz=10.*i, gac=90.,
+                               snrq=5., snrt=None)
+        results = _results()
+        results['null'] = bool(i)
+        ststore.put(key, 'meta', meta)
+        ststore.put(key, 'results_auto', results)
+        table.append(key, meta, results, store=ststore)
+    # Results saved again supersede earlier rows
+    results['quality'] = 'Poor'
+    table.append(key, meta, results)
+
+    res = table.load()
+    assert list(res['key']) == [b'20160824_010203', b'20160901_000000']
+    assert list(res['quality']) == [b'Good', b'Poor']
+    assert list(res['null']) == [False, True]
+    assert np.isnan(res['snrt']).all() and (res['phiRC'] == 45.).all()
+
+
+def test_pack_emat():
+    Emats = np.random.rand(4, 36, 20)*1.e3 - 10.
+    blobs = [store.pack_emat(Emat) for Emat in Emats]
+    assert sum(len(blob) for blob in blobs) < Emats.nbytes/3
+    Emat = store.unpack_emat(blobs[1])
+    assert Emat.min() == Emats[1].min()
+    assert np.abs(Emat - Emats[1]).max() <= np.ptp(Emats[1])/131070.*1.01
+    assert np.array_equal(store.unpack_emats(blobs)[1], Emat)
+    assert (store.unpack_emat(store.pack_emat(np.ones((2, 3)))) == 1.).all()
+
+
+def test_emat_cube(tmp_path):
+    from splitpy import calc
+    from splitpy.tests.test_classes import _lqt
+    ststore = store.StationStore(tmp_path / store.STORE_NAME)
+    for i, baz in enumerate([60., 75., 165., 255.]):
+        st, meta = _lqt(phi=30., baz=baz, noise=0.05)
+        trQ, trT = st[1], st[2]
+        t1 = meta.time + meta.ttime - 5.
+        t2 = meta.time + meta.ttime + 25.
+        out = calc.split_SilverChan(trQ, trT, baz, t1, t2, meta.maxdt,
+                                    meta.ddt, meta.dphi)
+        edtt, ephi, errc = calc.split_errorSC(
+            out[2], t1, t2, 0.05, out[0], meta.maxdt, meta.ddt, meta.dphi)
+        res = Result(*out[:8], edtt, ephi, errc)
+        key = '2016010{0}_000000'.format(i)
+        results = {'SC_res': res.compact('SC'), 'RC_res': None}
+        ststore.put(key, 'meta', meta)
+        ststore.put(key, 'results_auto', results)
+        store.EmatCube(tmp_path).append(key, meta, results, store=ststore)
+
+    cube = store.EmatCube(tmp_path)
+    assert (cube.nphi, cube.ndt) == (36, 15)
+    assert cube.ddt == 0.2 and cube.dphi == 5.
+    Emats = cube.load()
+    assert isinstance(Emats, np.memmap) and len(Emats) == 4
+    assert (Emats['dof'] > 3).all()
+
+    # Matrices are in the geographic frame
+    for row in Emats:
+        ind = np.unravel_index(np.argmin(row['Emat']), (36, 15))
+        assert abs(ind[0] - 24) <= 1
+
+    select = cube.select(Emats, ['20160100_000000', '20160102_000000'])
+    assert select.sum() == 2
+    Estack, phi, dtt, ephi, edtt, errc = calc.split_stack(
+        Emats['Emat'], Emats['errc'], Emats['dof'], cube.ddt, cube.dphi)
+    assert phi == 30. and abs(dtt - 1.2) < 0.21
+    assert ephi < 10. and edtt < 0.5
+    assert Estack.min() < errc
+
+
+def test_emat_cube_empty(tmp_path, monkeypatch):
+    # Results without a usable energy matrix leave an empty cube, which
+    # is not built again for each event
+    st = read()
+    res = Result(None, st[0], st[1], st[2], st[0], 45., 1.2, 30., 0.1, 5.,
+                 None)
+    results = {'SC_res': res, 'RC_res': res, 'null': False,
+               'quality': 'Good'}
+    ststore = store.StationStore(tmp_path / store.STORE_NAME)
+    calls = []
+    build = store.EmatCube.build
+    monkeypatch.setattr(store.EmatCube, 'build', lambda self, source: (
+        calls.append(1), build(self, source))[1])
+    for i in range(3):
+        key = '2016010{0}_000000'.format(i)
+        ststore.put(key, 'meta', None)
+        ststore.put(key, 'results_auto', results)
+        store.EmatCube(tmp_path).append(key, None, results, store=ststore)
+    assert len(calls) == 1
+    cube = store.EmatCube(tmp_path)
+    assert cube.exists() and cube.nphi is None and len(cube.load()) == 0
+
+    # The grid is set by the first matrix
+    results = _results()
+    ststore.put('20160105_000000', 'results_auto', results)
+    assert cube.append('20160105_000000', SimpleNamespace(ddt=0.1), results,
+                       store=ststore)
+    cube = store.EmatCube(tmp_path)
+    assert (cube.nphi, cube.ndt) == (5, 4) and len(cube.load()) == 1
+    assert len(calls) == 1
+
+
+def test_run_journal(tmp_path):
+    params = {'msnr': 5., 'phase': 'SKS'}
+    journal = store.RunJournal(tmp_path, params)
+    journal.record('20160824_010203', 'rejected/SNR', snrq=2.5)
+    journal.record('20160825_010203', 'downloaded')
+    journal.record('20160825_010203', 'saved')
+    journal.record('20160826_010203', 'downloaded')
+
+    # Interrupted while writing a line
+    with open(journal.path, 'ab') as f:
+        f.write(b'{"params": "' + journal.digest.encode() + b'", "ke')
+
+    journal = store.RunJournal(tmp_path, dict(params))
+    assert journal.done('20160824_010203')
+    assert journal.done('20160825_010203')
+    assert not journal.done('20160826_010203')
+    assert journal.get('20160826_010203') == 'downloaded'
+    journal.record('20160826_010203', 'saved')
+    assert store.RunJournal(tmp_path, params).done('20160826_010203')
+
+    # Other parameters
+    journal = store.RunJournal(tmp_path, {'msnr': 10., 'phase': 'SKS'})
+    assert journal.status == {}
+
+
+def test_legacy_store_atomic(tmp_path):
+    legacy = store.LegacyStore(tmp_path)
+    legacy.put('20160824_010203', 'ZNE', read())
+    legacy.put('20160824_010203', 'ZNE', read()[:2])
+    assert len(legacy.get('20160824_010203', 'ZNE')) == 2
+    assert [x.name for x in (tmp_path / '20160824_010203').iterdir()] == \
+        ['ZNE_data.pkl']
+
+
+def test_merge_parts(tmp_path):
+    from types import SimpleNamespace
+    from obspy import UTCDateTime
+    parts = []
+    for i, key in enumerate(['20160824_010203', '20160825_010203']):
+        part = tmp_path / 'parts' / str(i)
+        ststore = store.StationStore(part / store.STORE_NAME)
+        ststore.put(key, 'meta', SimpleNamespace(
+            time=UTCDateTime(key), baz=10.*i, gac=90., snrq=5., snrt=1.,
+            ddt=0.1))
+        ststore.put(key, 'results_auto', _results())
+        journal = store.RunJournal(part, {'msnr': 5.})
+        journal.record(key, 'saved')
+        parts.append(part)
+    assert store.merge_parts(tmp_path, parts) == 4
+    assert not parts[0].exists()
+
+    ststore = store.StationStore(tmp_path / store.STORE_NAME)
+    assert ststore.keys() == ['20160824_010203', '20160825_010203']
+    assert ststore.get('20160825_010203', 'meta').baz == 10.
+    assert len(store.ResultsTable(tmp_path).load()) == 2
+    journal = store.RunJournal(tmp_path, {'msnr': 5.})
+    assert journal.done('20160824_010203')
+    assert journal.done('20160825_010203')
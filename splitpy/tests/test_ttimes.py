@@ -0,0 +1,26 @@
+import numpy as np
+from splitpy import ttimes
+
+
+def test_ttable_lookup(tmp_path):
+    table = ttimes.TTable('SKS', dist=[95., 96., 97.], depth=[10., 20.])
+    table.build()
+    assert table.valid.all()
+    arrival = table.lookup(95.5, 15.)
+    exact = ttimes.taup_arrivals(['SKS'], 95.5, 15.)[0]
+    assert abs(arrival.time - exact.time) < 0.1
+    assert abs(arrival.incident_angle - exact.incident_angle) < 0.1
+    assert table.lookup(100., 15.) is None
+
+    table.save(tmp_path / 'table.npz')
+    table2 = ttimes.TTable.load(tmp_path / 'table.npz')
+    assert np.allclose(table.time, table2.time)
+    assert table2.tol_rayp == table.tol_rayp
+
+    # Ray parameter and incidence angle are checked separately
+    for tols in [{'tol_rayp': 0.}, {'tol_inc': 0.}]:
+        table = ttimes.TTable('SKS', dist=[95., 96., 97.], depth=[10., 20.],
+                              **tols)
+        table.build()
+        assert not table.valid.any()
+        assert table.lookup(95.5, 15.) is None
@@ -0,0 +1,186 @@
+import numpy as np
+from obspy.geodetics.base import gps2dist_azimuth as epi
+from obspy.geodetics import kilometer2degrees as k2d
+from splitpy import utils
+
+
+def test_event_geometry():
+    evlat = np.array([-30., 10., 55., 70.])
+    evlon = np.array([-70., 140., 160., 20.])
+    gac, az, baz = utils.event_geometry(evlat, evlon, 40., -120.)
+    for i in range(len(evlat)):
+        dist, azi, bazi = epi(evlat[i], evlon[i], 40., -120.)
+        assert abs(gac[i] - k2d(dist/1000.)) < 0.5
+        assert abs((az[i] - azi + 180.) % 360. - 180.) < 1.
+        assert abs((baz[i] - bazi + 180.) % 360. - 180.) < 1.
+
+
+def test_rotation():
+    from types import SimpleNamespace
+    from obspy import read
+    from obspy.signal.rotate import rotate_rt_ne
+    from splitpy import Split
+
+    split = Split(SimpleNamespace(azcorr=12.))
+    split.meta = SimpleNamespace(accept=True, baz=231., inc=8.,
+                                 align='LQT', rotated=False)
+    split.dataZNE = read()
+    split.rotate(align='LQT')
+    lqt = read()
+    lqt.rotate('ZNE->LQT', back_azimuth=231., inclination=8.)
+    for tr1, tr2 in zip(split.dataLQT, lqt):
+        assert tr1.stats.channel == tr2.stats.channel
+        assert np.allclose(tr1.data, tr2.data)
+    assert (split.dataZNE[0].data == read()[0].data).all()
+
+    # Z12 to ZNE
+    split.dataZ12 = read()
+    for tr, comp in zip(split.dataZ12, 'Z12'):
+        tr.stats.channel = tr.stats.channel[:-1] + comp
+    split.rotate(align='ZNE')
+    N, E = rotate_rt_ne(read()[1].data, read()[2].data, 12.)
+    assert split.dataZNE[1].stats.channel == 'EHN'
+    assert np.allclose(split.dataZNE[1].data, -N)
+    assert np.allclose(split.dataZNE[2].data, -E)
+
+    # Cached matrices and batch rotation
+    M = utils.rotation_matrix('LQT', baz=231., inc=8.)
+    assert utils.rotation_matrix('LQT', baz=231, inc=8) is M
+    data = np.random.rand(4, 3, 100)
+    Ms = np.stack([utils.rotation_matrix('LQT', baz=b, inc=8.)
+                   for b in [0., 90., 180., 270.]])
+    out = utils.rotate_batch(data, Ms)
+    assert np.allclose(out[1], utils.rotate_array(data[1], Ms[1]))
+    utils.rotate_array(data[2], Ms[2], out=data[2], block=7)
+    assert np.allclose(out[2], data[2])
+
+
+def test_fused_preprocess():
+    from obspy import Stream, Trace
+
+    # Noisy wavelet with offset and trend, at 40 Hz
+    rng = np.random.default_rng(0)
+    t = np.arange(9640)/40.
+    M = utils.rotation_matrix('LQT', baz=40., inc=10.)
+    st = Stream()
+    for comp in 'ZNE':
+        data = 5.*np.exp(-((t - 120.)/4.)**2)*np.sin(2.*np.pi*0.12*t) + \
+            rng.standard_normal(len(t)) + 3. + 0.01*t
+        st.append(Trace(data=data, header={
+            'channel': 'BH' + comp, 'sampling_rate': 40.}))
+
+    # Separate steps
+    ref = st.copy()
+    ref.detrend('linear').taper(max_percentage=0.05, max_length=5.)
+    ref.filter('lowpass', freq=5., corners=2, zerophase=True)
+    ref.resample(10., no_filter=False)
+    traces, lqt = utils.stream_to_array(ref, 'ZNE')
+    lqt = utils.rotate_array(lqt, M)
+    lqt = Stream([Trace(data=data, header={'sampling_rate': 10.})
+                  for data in lqt])
+    lqt.filter('bandpass', freqmin=0.02, freqmax=0.5)
+
+    traces, data = utils.stream_to_array(st, 'ZNE')
+    out, outbp = utils.fused_preprocess(data, 40., 10., 0.02, 0.5, M=M)
+    assert out.shape == (3, 2410)
+    mid = slice(2410//4, 3*2410//4)
+    for i in range(3):
+        for new, old in [(out[i], ref[i].data), (outbp[i], lqt[i].data)]:
+            err = np.abs(new[mid] - old[mid]).max()/np.abs(old).max()
+            assert err < utils.FUSED_TOL
+
+    # Same result from data detrended and tapered beforehand, as
+    # returned by download_data
+    traces, data = utils.stream_to_array(st.copy().detrend('linear').taper(
+        max_percentage=0.05, max_length=5.), 'ZNE')
+    out, outbp = utils.fused_preprocess(data, 40., 10., 0.02, 0.5, M=M,
+                                        detrend=False)
+    for i in range(3):
+        for new, old in [(out[i], ref[i].data), (outbp[i], lqt[i].data)]:
+            err = np.abs(new[mid] - old[mid]).max()/np.abs(old).max()
+            assert err < utils.FUSED_TOL
+
+    # Data sampled below the new sampling rate are only filtered
+    ref = st.copy().decimate(4, no_filter=True)
+    ref.detrend('linear').taper(max_percentage=0.05, max_length=5.)
+    lqt = ref.copy().filter('bandpass', freqmin=0.02, freqmax=0.5)
+    traces, data = utils.stream_to_array(st.copy().decimate(
+        4, no_filter=True), 'ZNE')
+    out, outbp = utils.fused_preprocess(data, 10., 20., 0.02, 0.5)
+    assert out.shape == (3, 2410)
+    for i in range(3):
+        assert np.allclose(out[i], ref[i].data)
+        err = np.abs(outbp[i][mid] - lqt[i].data[mid]).max() / \
+            np.abs(lqt[i].data).max()
+        assert err < utils.FUSED_TOL
+
+
+def test_prescreen_snr():
+    from obspy import Stream, Trace, UTCDateTime
+
+    # Radially polarized wavelet at 120 s on components 1 and 2 rotated
+    # by 30 degrees, with white noise and a trend, at 40 Hz
+    rng = np.random.default_rng(0)
+    t0 = UTCDateTime('2016-08-24T01:02:03')
+    t = np.arange(9600)/40.
+    baz, azcorr = 70., 30.
+    rad = 4.*np.exp(-((t - 130.)/5.)**2)*np.sin(2.*np.pi*0.1*t)
+    a = np.radians(baz - azcorr)
+    st = Stream()
+    for comp, proj in zip('12', [np.cos(a), np.sin(a)]):
+        data = proj*rad + rng.standard_normal(len(t)) + 0.01*t
+        st.append(Trace(data=data, header={
+            'channel': 'BH' + comp, 'sampling_rate': 40., 'starttime': t0}))
+    snr = utils.prescreen_snr(st, t0 + 120., baz, azcorr=azcorr)
+    assert 10. < snr < 25.
+    assert utils.prescreen_snr(st, t0 + 120., baz + 90.,
+                               azcorr=azcorr) < snr - 10.
+
+    # No signal, or windows outside of the traces
+    for tr in st:
+        tr.data = rng.standard_normal(len(t))
+    assert abs(utils.prescreen_snr(st, t0 + 120., baz)) < 3.
+    assert np.isnan(utils.prescreen_snr(st, t0 + 220., baz))
+    assert np.isnan(utils.prescreen_snr(st.select(component='1'),
+                                        t0 + 120., baz))
+
+
+def test_calc_snr():
+    from obspy import Stream, Trace, UTCDateTime
+
+    rng = np.random.default_rng(1)
+    t0 = UTCDateTime('2016-08-24T01:02:03.013')
+    st = Stream([Trace(data=rng.standard_normal(2401) + 0.02*np.arange(2401),
+                       header={'sampling_rate': 10., 'starttime': t0})
+                 for i in range(2)])
+
+    # Trimmed samples, including windows partly outside of the trace
+    for t1, t2 in [(91.23, 121.23), (-5., 10.), (230., 260.), (0., 0.),
+                   (240., 250.), (250., 260.), (100.04, 100.06)]:
+        tr = st[0].copy().trim(t0 + t1, t0 + t2)
+        i1, i2 = utils.trim_indices(st[0].stats, t0 + t1, t0 + t2)
+        assert np.array_equal(tr.data, st[0].data[i1:i2])
+
+    # Same values as with trimmed copies of the traces
+    snr = []
+    for t1 in [t0 + 120., t0 + 97.36]:
+        ref = []
+        for tr in st:
+            sig = tr.copy().detrend().taper(max_percentage=0.05)
+            nze = tr.copy().detrend().taper(max_percentage=0.05)
+            sig.trim(t1, t1 + 30.)
+            nze.trim(t1 - 30., t1)
+            srms = np.sqrt(np.mean(np.square(sig.data)))
+            nrms = np.sqrt(np.mean(np.square(nze.data)))
+            ref.append(10*np.log10(srms*srms/nrms/nrms))
+        data = np.array([tr.data for tr in st])
+        sig = utils.trim_indices(st[0].stats, t1, t1 + 30.)
+        nze = utils.trim_indices(st[0].stats, t1 - 30., t1)
+        snr.append((data, sig, nze))
+        assert np.array_equal(utils.calc_snr(data, sig, nze), ref)
+
+    # Batch of events with different windows
+    data, sig, nze = [np.array(x) for x in zip(*(snr + snr[:1]))]
+    batch = utils.calc_snr_batch(data, sig, nze)
+    for i in range(3):
+        assert np.array_equal(batch[i], utils.calc_snr(*snr[i % 2]))
@@ -0,0 +1,181 @@
+import os
+import time
+import multiprocessing
+from splitpy import workqueue
+
+
+def _worker(path, outdir):
+    wq = workqueue.WorkQueue(path, lease=5.)
+
+    def func(lease):
+        # Prerequisites are completed before a task is claimed
+        for dep in wq.get(lease.name)['after']:
+            assert wq.done(dep)
+        file = os.path.join(outdir, '{0}.{1:d}.{2:d}'.format(
+            lease.name, lease.generation, os.getpid()))
+        open(file, 'w').close()
+        time.sleep(0.01)
+
+    wq.run(func, poll=0.05)
+
+
+def test_work_queue_processes(tmp_path):
+    wq = workqueue.WorkQueue(tmp_path / 'queue')
+    for sta in ['AA.STA1', 'AA.STA2', 'BB.STA3']:
+        parts = []
+        for i in range(8):
+            name = '{0}_{1:d}'.format(sta, i)
+            assert wq.add(name, {'station': sta, 'chunk': i})
+            parts.append(name)
+        wq.add(sta + '_merge', {'station': sta}, after=parts)
+    assert not wq.add('AA.STA1_0', {})
+    assert len(wq.pending()) == 27
+
+    # Processes stand in for nodes
+    outdir = tmp_path / 'out'
+    outdir.mkdir()
+    ctx = multiprocessing.get_context('fork')
+    procs = [ctx.Process(target=_worker, args=(str(tmp_path / 'queue'),
+                                               str(outdir)))
+             for i in range(4)]
+    for proc in procs:
+        proc.start()
+    for proc in procs:
+        proc.join()
+        assert proc.exitcode == 0
+
+    # Each task was processed exactly once
+    assert wq.pending() == []
+    names = sorted(x.rsplit('.', 2)[0] for x in os.listdir(outdir))
+    assert names == wq.tasks()
+
+
+def test_work_queue_lease(tmp_path):
+    wq = workqueue.WorkQueue(tmp_path, lease=0.2)
+    wq.add('task', {'value': 1})
+    lease = wq.claim()
+    assert lease.task == {'value': 1} and lease.generation == 0
+    assert wq.claim() is None
+
+    # The lease is renewed while held
+    with lease:
+        time.sleep(0.4)
+        assert wq.claim() is None
+
+    # Expired lease is reclaimed by another process
+    time.sleep(0.3)
+    other = workqueue.WorkQueue(tmp_path, lease=0.2).claim()
+    assert other.name == 'task' and other.generation == 1
+    assert not lease.valid() and not lease.renew()
+    assert not wq.complete(lease)
+    assert wq.complete(other)
+    assert wq.result('task')['generation'] == 1
+    assert wq.claim() is None and wq.pending() == []
+
+
+def test_work_queue_complete_expired(tmp_path):
+    wq = workqueue.WorkQueue(tmp_path, lease=0.2)
+    wq.add('task', {'value': 1})
+    lease = wq.claim()
+    time.sleep(0.3)
+
+    # Lease expires and is reclaimed between the check and the write
+    others = []
+
+    def valid():
+        if len(others) == 0:
+            others.append(workqueue.WorkQueue(tmp_path, lease=0.2).claim())
+            return True
+        return workqueue.Lease.valid(lease)
+
+    lease.valid = valid
+    assert not wq.complete(lease)
+    assert others[0].generation == 1 and not wq.done('task')
+    assert wq.complete(others[0])
+    assert wq.result('task')['generation'] == 1
+
+    # Completion records are never replaced
+    lease.valid = lambda: True
+    assert not wq.complete(lease)
+    assert wq.result('task')['generation'] == 1
+    assert os.listdir(tmp_path / 'done') == ['task']
+
+
+def test_submit_job(tmp_path):
+    import threading
+    names = [workqueue.submit_job(tmp_path, 'AA.STA1', args={'msnr': 8.})
+             for i in range(2)]
+    names.append(workqueue.submit_job(tmp_path, 'AA.STA2'))
+    wq = workqueue.WorkQueue(tmp_path)
+    assert len(set(names)) == 3 and len(wq.pending()) == 6
+
+    # Merges of a station are carried out in order of submission
+    assert wq.get(names[1] + '_merge')['after'] == \
+        [names[1], names[0] + '_merge']
+    assert wq.get(names[0])['task']['args'] == {'msnr': 8.}
+
+    # Daemon keeps polling, records failed jobs and stops on request
+    order = []
+
+    def func(lease):
+        order.append(lease.name)
+        if lease.name == names[2]:
+            raise ValueError('no data')
+
+    thread = threading.Thread(target=wq.run, args=(func,),
+                              kwargs={'poll': 0.02, 'forever': True})
+    thread.start()
+    while len(wq.pending()) > 0:
+        time.sleep(0.02)
+    assert thread.is_alive()
+    (tmp_path / 'stop').touch()
+    thread.join()
+
+    assert order.index(names[0] + '_merge') < order.index(names[1] + '_merge')
+    assert wq.result(names[2])['error'] == "ValueError('no data')"
+    assert wq.result(names[0])['error'] is None
+
+
+def test_daemon_local_index(tmp_path, monkeypatch):
+    import importlib.util
+    import matplotlib
+    from types import SimpleNamespace
+    from splitpy import archive
+
+    # The script selects an interactive backend on import
+    monkeypatch.setattr(matplotlib, 'use', lambda *args, **kwargs: None)
+    spec = importlib.util.spec_from_file_location(
+        'split_calc_auto', os.path.join(os.path.dirname(__file__), '..', '..',
+                                        'Scripts', 'split_calc_auto.py'))
+    script = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(script)
+    monkeypatch.setattr(script, 'get_client', lambda *args: None)
+    monkeypatch.setattr(script.ttimes, 'get_table', lambda phase: None)
+    monkeypatch.chdir(tmp_path)
+
+    root = tmp_path / 'data'
+    root.mkdir()
+    (root / '2016.237.NY.MMPY..HHZ.SAC').touch()
+    lclindex = archive.ArchiveIndex(tmp_path / 'index.db')
+    lclindex.update([str(root)])
+
+    # Files written after start-up are seen by the next job
+    nfiles = []
+
+    def process_station(args, stkey, sta, datapath, jparams, lclindex=None,
+                        **kwargs):
+        nfiles.append(len(lclindex))
+        if len(nfiles) == 1:
+            (root / '2016.237.NY.MMPY..HHN.SAC').touch()
+            workqueue.submit_job(args.queue, stkey)
+        else:
+            (tmp_path / 'queue' / 'stop').touch()
+
+    monkeypatch.setattr(script, 'process_station', process_station)
+    args = SimpleNamespace(
+        queue=str(tmp_path / 'queue'), lease=5., submit=False, daemon=True,
+        phase='SKS', Server=None, UserAuth=[], poll=0.02, verb=False,
+        journal=False, localdata=[str(root)])
+    workqueue.submit_job(args.queue, 'NY.MMPY')
+    script.run_queue(args, {'NY.MMPY': None}, [], {}, lclindex=lclindex)
+    assert nfiles == [1, 2]
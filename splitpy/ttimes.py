@@ -0,0 +1,398 @@
+# Copyright 2019 Pascal Audet & Andrew Schaeffer
+#
+# This file is part of SplitPy.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+
+Module containing travel-time lookup tables used in place of
+per-event calls to :class:`~obspy.taup.TauPyModel`.
+
+A :class:`~splitpy.ttimes.TTable` holds the travel time, ray parameter
+and incidence angle of the first arrival of a single phase on a regular
+(distance, depth) grid. Tables are built once with TauP, saved to disk
+and bilinearly interpolated afterwards. Cells where the interpolation
+error of any quantity exceeds its tolerance (e.g., near caustics or where
+the phase does not exist) are flagged and the exact TauP calculation is used
+instead.
+
+"""
+
+# -*- coding: utf-8 -*-
+import os
+import tempfile
+from collections import namedtuple
+from pathlib import Path
+import numpy as np
+
+
+# Lightweight arrival container with the attributes used in SplitPy
+Arrival = namedtuple(
+    'Arrival', ['name', 'time', 'ray_param_sec_degree', 'incident_angle'])
+
+# Default grid
+DIST = np.arange(80., 131., 1.)
+DEPTH = np.concatenate(([0., 10., 20., 35., 50., 75.],
+                        np.arange(100., 701., 50.)))
+
+# Module-level caches for TauP models and tables
+_models = {}
+_tables = {}
+
+
+def cache_dir():
+    """
+    Returns the directory where travel-time tables are stored. This
+    can be changed by setting the ``SPLITPY_CACHE`` environment variable.
+
+    Returns
+    -------
+    path : :class:`~pathlib.Path`
+        Cache directory
+
+    """
+
+    return Path(os.environ.get(
+        'SPLITPY_CACHE', Path.home() / '.splitpy')) / 'ttimes'
+
+
+def get_model(model='iasp91'):
+    """
+    Returns a (cached) :class:`~obspy.taup.TauPyModel` object
+
+    Parameters
+    ----------
+    model : str
+        Name of velocity model
+
+    """
+
+    from obspy.taup import TauPyModel
+
+    if model not in _models:
+        _models[model] = TauPyModel(model=model)
+    return _models[model]
+
+
+def taup_arrivals(phase_list, gac, dep, model='iasp91'):
+    """
+    Calculates exact arrivals using TauP
+
+    Parameters
+    ----------
+    phase_list : List
+        List of phase names
+    gac : float
+        Great arc circle distance (degrees)
+    dep : float
+        Source depth (km)
+    model : str
+        Name of velocity model
+
+    Returns
+    -------
+    arrivals : List
+        List of :class:`~splitpy.ttimes.Arrival` objects
+
+    """
+
+    arrivals = get_model(model).get_travel_times(
+        distance_in_degree=gac, source_depth_in_km=dep,
+        phase_list=phase_list)
+
+    return [Arrival(a.name, a.time, a.ray_param_sec_degree,
+                    a.incident_angle) for a in arrivals]
+
+
+class TTable(object):
+    """
+    A TTable object contains travel-time information for the first
+    arrival of a single phase on a (distance, depth) grid.
+
+    Attributes
+    ----------
+    phase : str
+        Name of phase
+    model : str
+        Name of velocity model
+    dist : :class:`~numpy.ndarray`
+        Great arc circle distances of grid nodes (degrees)
+    depth : :class:`~numpy.ndarray`
+        Source depths of grid nodes (km)
+    time : :class:`~numpy.ndarray`
+        Travel times (sec) - NaN where the phase does not exist
+    rayp : :class:`~numpy.ndarray`
+        Ray parameters (sec/degree)
+    inc : :class:`~numpy.ndarray`
+        Incidence angles at the surface (degrees)
+    tol : float
+        Tolerance on travel time (sec)
+    tol_rayp : float
+        Tolerance on ray parameter (sec/degree)
+    tol_inc : float
+        Tolerance on incidence angle (degrees)
+    valid : :class:`~numpy.ndarray`
+        Boolean array of grid cells where interpolation is accurate to
+        within ``tol``, ``tol_rayp`` and ``tol_inc``
+
+    """
+
+    def __init__(self, phase, model='iasp91', dist=DIST, depth=DEPTH,
+                 tol=0.1, tol_rayp=0.01, tol_inc=0.1):
+
+        self.phase = phase
+        self.model = model
+        self.dist = np.asarray(dist, dtype=float)
+        self.depth = np.asarray(depth, dtype=float)
+        self.tol = tol
+        self.tol_rayp = tol_rayp
+        self.tol_inc = tol_inc
+
+        shape = (len(self.dist), len(self.depth))
+        self.time = np.full(shape, np.nan)
+        self.rayp = np.full(shape, np.nan)
+        self.inc = np.full(shape, np.nan)
+        self.valid = np.zeros((shape[0] - 1, shape[1] - 1), dtype=bool)
+
+    def build(self):
+        """
+        Fills the table using exact TauP calculations at the grid nodes,
+        and flags the cells where bilinear interpolation at the cell centre
+        differs from TauP by more than ``tol`` seconds in travel time,
+        ``tol_rayp`` in ray parameter or ``tol_inc`` in incidence angle.
+
+        """
+
+        for i, gac in enumerate(self.dist):
+            for j, dep in enumerate(self.depth):
+                arrivals = taup_arrivals([self.phase], gac, dep, self.model)
+                if len(arrivals) == 0:
+                    continue
+                self.time[i, j] = arrivals[0].time
+                self.rayp[i, j] = arrivals[0].ray_param_sec_degree
+                self.inc[i, j] = arrivals[0].incident_angle
+
+        # Check accuracy at the centre of each cell
+        self.valid[:] = True
+        for i in range(len(self.dist) - 1):
+            for j in range(len(self.depth) - 1):
+                nodes = self.time[i:i+2, j:j+2]
+                if np.any(np.isnan(nodes)):
+                    self.valid[i, j] = False
+                    continue
+                gac = 0.5*(self.dist[i] + self.dist[i+1])
+                dep = 0.5*(self.depth[j] + self.depth[j+1])
+                arrivals = taup_arrivals([self.phase], gac, dep, self.model)
+                if len(arrivals) == 0:
+                    self.valid[i, j] = False
+                    continue
+                exact = arrivals[0]
+                for arr, value, tol in [
+                        (self.time, exact.time, self.tol),
+                        (self.rayp, exact.ray_param_sec_degree, self.tol_rayp),
+                        (self.inc, exact.incident_angle, self.tol_inc)]:
+                    if abs(np.mean(arr[i:i+2, j:j+2]) - value) > tol:
+                        self.valid[i, j] = False
+
+    def lookup(self, gac, dep):
+        """
+        Interpolates travel time, ray parameter and incidence angle
+
+        Parameters
+        ----------
+        gac : float
+            Great arc circle distance (degrees)
+        dep : float
+            Source depth (km)
+
+        Returns
+        -------
+        arrival : :class:`~splitpy.ttimes.Arrival`
+            Interpolated arrival, or `None` if outside the accuracy
+            envelope of the table
+
+        """
+
+        if not (self.dist[0] <= gac <= self.dist[-1] and
+                self.depth[0] <= dep <= self.depth[-1]):
+            return None
+
+        i = min(np.searchsorted(self.dist, gac, side='right') - 1,
+                len(self.dist) - 2)
+        j = min(np.searchsorted(self.depth, dep, side='right') - 1,
+                len(self.depth) - 2)
+        if not self.valid[i, j]:
+            return None
+
+        # Bilinear weights
+        x = (gac - self.dist[i])/(self.dist[i+1] - self.dist[i])
+        y = (dep - self.depth[j])/(self.depth[j+1] - self.depth[j])
+        w = np.array([[(1. - x)*(1. - y), (1. - x)*y],
+                      [x*(1. - y), x*y]])
+
+        def interp(arr):
+            return float(np.sum(w*arr[i:i+2, j:j+2]))
+
+        return Arrival(self.phase, interp(self.time), interp(self.rayp),
+                       interp(self.inc))
+
+    def save(self, file):
+        """
+        Saves table to a ``.npz`` file
+
+        Parameters
+        ----------
+        file : str
+            File name for table
+
+        """
+
+        np.savez(file, phase=self.phase, model=self.model, dist=self.dist,
+                 depth=self.depth, tol=self.tol, tol_rayp=self.tol_rayp,
+                 tol_inc=self.tol_inc, time=self.time, rayp=self.rayp,
+                 inc=self.inc, valid=self.valid)
+
+    @classmethod
+    def load(cls, file):
+        """
+        Loads table from a ``.npz`` file
+
+        Parameters
+        ----------
+        file : str
+            File name for table
+
+        Returns
+        -------
+        table : :class:`~splitpy.ttimes.TTable`
+            Travel-time table
+
+        """
+
+        with np.load(file) as npz:
+            table = cls(str(npz['phase']), model=str(npz['model']),
+                        dist=npz['dist'], depth=npz['depth'],
+                        tol=float(npz['tol']),
+                        tol_rayp=float(npz['tol_rayp']),
+                        tol_inc=float(npz['tol_inc']))
+            table.time = npz['time']
+            table.rayp = npz['rayp']
+            table.inc = npz['inc']
+            table.valid = npz['valid']
+
+        return table
+
+
+def get_table(phase, model='iasp91'):
+    """
+    Returns the travel-time table for a given phase. The table is taken
+    from memory if available, otherwise loaded from the cache directory,
+    otherwise built (which takes a few tens of seconds) and saved.
+
+    Parameters
+    ----------
+    phase : str
+        Name of phase
+    model : str
+        Name of velocity model
+
+    Returns
+    -------
+    table : :class:`~splitpy.ttimes.TTable`
+        Travel-time table
+
+    """
+
+    key = (model, phase)
+    if key in _tables:
+        return _tables[key]
+
+    file = cache_dir() / "ttable_{0}_{1}.npz".format(model, phase)
+    table = None
+    if file.exists():
+        try:
+            table = TTable.load(file)
+            if not (np.array_equal(table.dist, DIST) and
+                    np.array_equal(table.depth, DEPTH)):
+                table = None
+        except Exception:
+            table = None
+
+    if table is None:
+        print("* Building travel-time table for phase " + phase)
+        table = TTable(phase, model=model)
+        table.build()
+        try:
+            file.parent.mkdir(parents=True, exist_ok=True)
+            # Unique temporary file, since other processes may be saving
+            # the same table
+            with tempfile.NamedTemporaryFile(
+                    dir=file.parent, suffix='.npz', delete=False) as tmp:
+                tmpfile = tmp.name
+            try:
+                table.save(tmpfile)
+                os.replace(tmpfile, file)
+            finally:
+                if os.path.exists(tmpfile):
+                    os.remove(tmpfile)
+        except OSError:
+            print("* Unable to save travel-time table to " + str(file))
+
+    _tables[key] = table
+
+    return table
+
+
+def get_arrivals(phase_list, gac, dep, model='iasp91'):
+    """
+    Returns the first arrival of each phase, interpolated from the
+    travel-time tables, with a fallback to exact TauP calculations
+    outside of the accuracy envelope of the tables.
+
+    Parameters
+    ----------
+    phase_list : List
+        List of phase names
+    gac : float
+        Great arc circle distance (degrees)
+    dep : float
+        Source depth (km)
+    model : str
+        Name of velocity model
+
+    Returns
+    -------
+    arrivals : List
+        List of :class:`~splitpy.ttimes.Arrival` objects, sorted by time
+
+    """
+
+    arrivals = []
+    for phase in phase_list:
+        arrival = get_table(phase, model).lookup(gac, dep)
+        if arrival is None:
+            exact = taup_arrivals([phase], gac, dep, model)
+            if len(exact) == 0:
+                continue
+            arrival = exact[0]
+        arrivals.append(arrival)
+
+    arrivals.sort(key=lambda a: a.time)
+
+    return arrivals
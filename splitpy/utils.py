@@ -1,4 +1,5 @@
 import math
+from functools import lru_cache
 from obspy import UTCDateTime
 from numpy import nan, isnan, abs
 import numpy as np
@@ -38,7 +39,111 @@ def traceshift(trace, tt):
     return rtrace
 
 
-def list_local_data_stn(lcldrs=list, sta=None, net=None, altnet=[]):
+def event_geometry(evlat, evlon, stlat, stlon):
+    """
+    Function to calculate the great-circle distance, azimuth and back-azimuth
+    between a station and arrays of event locations on a spherical Earth.
+
+    Parameters
+    ----------
+    evlat : :class:`~numpy.ndarray`
+        Latitudes of epicenters (degrees)
+    evlon : :class:`~numpy.ndarray`
+        Longitudes of epicenters (degrees)
+    stlat : float
+        Latitude of station (degrees)
+    stlon : float
+        Longitude of station (degrees)
+
+    Returns
+    -------
+    gac : :class:`~numpy.ndarray`
+        Great arc circle between station and epicenters (degrees)
+    az : :class:`~numpy.ndarray`
+        Azimuth - pointing to station from earthquakes (degrees)
+    baz : :class:`~numpy.ndarray`
+        Back-azimuth - pointing to earthquakes from station (degrees)
+
+    """
+
+    lat1 = np.radians(np.asarray(evlat, dtype=float))
+    lon1 = np.radians(np.asarray(evlon, dtype=float))
+    lat2 = np.radians(stlat)
+    lon2 = np.radians(stlon)
+    dlon = lon2 - lon1
+
+    # Haversine formula for the angular distance
+    hav = np.sin((lat2 - lat1)/2.)**2 + \
+        np.cos(lat1)*np.cos(lat2)*np.sin(dlon/2.)**2
+    gac = np.degrees(2.*np.arcsin(np.sqrt(np.clip(hav, 0., 1.))))
+
+    # Forward and backward azimuths
+    az = np.degrees(np.arctan2(
+        np.sin(dlon)*np.cos(lat2),
+        np.cos(lat1)*np.sin(lat2) - np.sin(lat1)*np.cos(lat2)*np.cos(dlon)))
+    baz = np.degrees(np.arctan2(
+        -np.sin(dlon)*np.cos(lat1),
+        np.cos(lat2)*np.sin(lat1) - np.sin(lat2)*np.cos(lat1)*np.cos(dlon)))
+
+    return gac, np.mod(az, 360.), np.mod(baz, 360.)
+
+
+def prefilter_events(cat, sta, gacmin=85., gacmax=120., tol=1.):
+    """
+    Function to select, in a single vectorized pass, the events of a
+    catalogue that fall within the distance annulus around a station.
+    This is only a coarse filter that avoids building
+    :class:`~splitpy.classes.Meta` objects for events that are clearly
+    rejected - the exact ellipsoidal distance is still checked for the
+    retained events.
+
+    Parameters
+    ----------
+    cat : :class:`~obspy.core.event.Catalog`
+        Catalogue of events
+    sta : Dict
+        Station metadata from :mod:`~StDb` data base
+    gacmin : float
+        Minimum great arc circle distance (degrees)
+    gacmax : float
+        Maximum great arc circle distance (degrees)
+    tol : float
+        Tolerance added on both sides of the annulus to account for the
+        difference between spherical and ellipsoidal distances (degrees)
+
+    Returns
+    -------
+    keep : :class:`~numpy.ndarray`
+        Boolean array of same length as ``cat``, `True` for events to retain
+    gac : :class:`~numpy.ndarray`
+        Spherical great arc circle distances (degrees)
+    az : :class:`~numpy.ndarray`
+        Azimuths - pointing to station from earthquakes (degrees)
+    baz : :class:`~numpy.ndarray`
+        Back-azimuths - pointing to earthquakes from station (degrees)
+
+    """
+
+    evlat = np.full(len(cat), np.nan)
+    evlon = np.full(len(cat), np.nan)
+    for iev, ev in enumerate(cat):
+        if len(ev.origins) == 0:
+            continue
+        if ev.origins[0].latitude is None or ev.origins[0].longitude is None:
+            continue
+        evlat[iev] = ev.origins[0].latitude
+        evlon[iev] = ev.origins[0].longitude
+
+    gac, az, baz = event_geometry(evlat, evlon, sta.latitude, sta.longitude)
+
+    # NaN distances (missing origins) compare as False
+    keep = (gac > gacmin - tol) & (gac < gacmax + tol)
+
+    return keep, gac, az, baz
+
+
+def list_local_data_stn(lcldrs=list, sta=None, net=None, altnet=[],
+                        index=None):
     """
     Function to take the list of local directories and recursively 
     find all data that matches the station name
@@ -53,10 +158,15 @@ def list_local_data_stn(lcldrs=list, sta=None, net=None, altnet=[]):
         Network name
     altnet : List
         List of alternative networks
+    index : :class:`~splitpy.archive.ArchiveIndex`
+        Persistent index of the local directories. If specified, the
+        directories are not walked and a station view of the index is
+        returned instead (the index should be up to date - see
+        :meth:`~splitpy.archive.ArchiveIndex.update`)
 
     Returns
     -------
-    fpathmatch : List
+    fpathmatch : List or :class:`~splitpy.archive.LocalData`
         Sorted list of matched directories
 
     """
@@ -66,6 +176,8 @@ def list_local_data_stn(lcldrs=list, sta=None, net=None, altnet=[]):
 
     if sta is None:
         return []
+    if index is not None:
+        return index.select(sta, net=net, altnet=altnet)
     else:
         if net is None:
             sstrings = ['*.{0:s}.*.SAC'.format(sta)]
@@ -90,6 +202,61 @@ def list_local_data_stn(lcldrs=list, sta=None, net=None, altnet=[]):
     return fpathmatch
 
 
+def find_local_files(stdata=[], sta=None, year='', jday='', comp='Z'):
+    """
+    Function to find the local day-long SAC files for a given station-day
+    and component. The exact channel code is searched for first, then any
+    channel ending with the component. The network of the station is searched
+    for first, then the alternate networks.
+
+    Parameters
+    ----------
+    stdata : List or :class:`~splitpy.archive.LocalData`
+        Station list or station view of a local archive index
+    sta : Dict
+        Station metadata from :mod:`~StDb` data base
+    year : str
+        Year (4 digits)
+    jday : str
+        Julian day (3 digits)
+    comp : str
+        Channel for seismogram (one letter only)
+
+    Returns
+    -------
+    lclfiles : List
+        List of matched files
+
+    """
+
+    from fnmatch import filter
+
+    comp = comp.upper()
+    cha = sta.channel.upper()[0:2] + comp
+    station = sta.station.upper()
+
+    for nets in [[sta.network.upper()], [anet.upper() for anet in sta.altnet]]:
+        # Format 1: exact channel code; Format 2: any channel
+        for fcha in [cha, None]:
+            lclfiles = []
+            for net in nets:
+                if hasattr(stdata, 'find'):
+                    lclfiles.extend(stdata.find(
+                        net, station, year, jday, cha=fcha, comp=comp))
+                elif fcha is not None:
+                    lclfiles.extend(filter(
+                        stdata, '*/{0:4s}.{1:3s}.{2:s}.{3:s}.*.{4:3s}.SAC'.format(
+                            year, jday, net, station, fcha)))
+                else:
+                    lclfiles.extend(filter(
+                        stdata, '*/{0:4s}.{1:3s}.{2:s}.{3:s}.*.*{4:1s}.SAC'.format(
+                            year, jday, net, station, comp)))
+            if len(lclfiles) > 0:
+                return lclfiles
+
+    return []
+
+
 def parse_localdata_for_comp(comp='Z', stdata=[], sta=None,
                              start=UTCDateTime, end=UTCDateTime, ndval=nan):
     """
@@ -99,7 +266,7 @@ def parse_localdata_for_comp(comp='Z', stdata=[], sta=None,
     ----------
     comp : str
         Channel for seismogram (one letter only)
-    stdata : List
+    stdata : List or :class:`~splitpy.archive.LocalData`
         Station list
     sta : Dict
         Station metadata from :mod:`~StDb` data base
@@ -119,8 +286,6 @@ def parse_localdata_for_comp(comp='Z', stdata=[], sta=None,
 
     """
 
-    from fnmatch import filter
-
     # Get start and end parameters
     styr = start.strftime("%Y")
     stjd = start.strftime("%j")
@@ -136,47 +301,7 @@ def parse_localdata_for_comp(comp='Z', stdata=[], sta=None,
 
     # Time Window Spans Single Day
     if stjd == edjd:
-        # Format 1
-        lclfiles = list(filter(
-            stdata,
-            '*/{0:4s}.{1:3s}.{2:s}.{3:s}.*.{4:2s}{5:1s}.SAC'.format(
-                styr, stjd, sta.network.upper(
-                ), sta.station.upper(), sta.channel.upper()[0:2],
-                comp.upper())))
-        # Format 2
-        if len(lclfiles) == 0:
-            lclfiles = list(filter(
-                stdata,
-                '*/{0:4s}.{1:3s}.{2:s}.{3:s}.*.*{4:1s}.SAC'.format(
-                    styr, stjd, sta.network.upper(), sta.station.upper(),
-                    comp.upper())))
-
-        # Alternate Nets (for CN/PO issues) Format 1
-        if len(lclfiles) == 0:
-            lclfiles = []
-            for anet in sta.altnet:
-                lclfiles.extend(
-                    list(
-                        filter(
-                            stdata,
-                            '*/{0:4s}.{1:3s}.{2:s}.{3:s}.*.' +
-                            '{4:2s}{5:1s}.SAC'.format(
-                                styr, stjd, anet.upper(), sta.station.upper(),
-                                sta.channel.upper()[0:2], comp.upper()))))
-
-        # Alternate Nets (for CN/PO issues) Format 2
-        if len(lclfiles) == 0:
-            # Check Alternate Networks
-            lclfiles = []
-            for anet in sta.altnet:
-                lclfiles.extend(
-                    list(
-                        filter(
-                            stdata,
-                            '*/{0:4s}.{1:3s}.{2:s}.{3:s}.*.*' +
-                            '{4:1s}.SAC'.format(
-                                styr, stjd, sta.network.upper(),
-                                sta.station.upper(), comp.upper()))))
+        lclfiles = find_local_files(stdata, sta, styr, stjd, comp)
 
         # If still no Local files stop
         if len(lclfiles) == 0:
@@ -196,7 +321,7 @@ def parse_localdata_for_comp(comp='Z', stdata=[], sta=None,
 
             else:
                 # Check for NoData and convert to NaN
-                stnd = st[0].stats.sac['user9']
+                stnd = st[0].stats.sac.get('user9', -12345.0)
                 eddt = False
                 if (not stnd == 0.0) and (not stnd == -12345.0):
                     st[0].data[st[0].data == stnd] = ndval
@@ -232,83 +357,8 @@ def parse_localdata_for_comp(comp='Z', stdata=[], sta=None,
 
     # Time Window spans Multiple days
     else:
-        # Day 1 Format 1
-        lclfiles1 = list(
-            filter(stdata,
-                   '*/{0:4s}.{1:3s}.{2:s}.{3:s}.*.{4:2s}{5:1s}.SAC'.format(
-                       styr, stjd, sta.network.upper(), sta.station.upper(),
-                       sta.channel.upper()[0:2], comp.upper())))
-        # Day 1 Format 2
-        if len(lclfiles1) == 0:
-            lclfiles1 = list(
-                filter(stdata,
-                       '*/{0:4s}.{1:3s}.{2:s}.{3:s}.*.*{4:1s}.SAC'.format(
-                           styr, stjd, sta.network.upper(),
-                           sta.station.upper(), comp.upper())))
-        # Day 1 Alternate Nets (for CN/PO issues) Format 1
-        if len(lclfiles1) == 0:
-            lclfiles1 = []
-            for anet in sta.altnet:
-                lclfiles1.extend(
-                    list(
-                        filter(
-                            stdata,
-                            '*/{0:4s}.{1:3s}.{2:s}.{3:s}.*.' +
-                            '{4:2s}{5:1s}.SAC'.format(
-                                styr, stjd, anet.upper(), sta.station.upper(
-                                ), sta.channel.upper()[0:2],
-                                comp.upper()))))
-        # Day 1 Alternate Nets (for CN/PO issues) Format 2
-        if len(lclfiles1) == 0:
-            lclfiles1 = []
-            for anet in sta.altnet:
-                lclfiles1.extend(
-                    list(
-                        filter(
-                            stdata,
-                            '*/{0:4s}.{1:3s}.{2:s}.{3:s}.*.*{4:1s}.SAC'.format(
-                                styr, stjd, anet.upper(),
-                                sta.station.upper(), comp.upper()))))
-
-        # Day 2 Format 1
-        lclfiles2 = list(
-            filter(stdata,
-                   '*/{0:4s}.{1:3s}.{2:s}.{3:s}.*.{4:2s}{5:1s}.SAC'.format(
-                       edyr, edjd, sta.network.upper(
-                       ), sta.station.upper(), sta.channel.upper()[0:2],
-                       comp.upper())))
-        # Day 2 Format 2
-        if len(lclfiles2) == 0:
-            lclfiles2 = list(
-                filter(stdata,
-                       '*/{0:4s}.{1:3s}.{2:s}.{3:s}.*.*' +
-                       '{4:1s}.SAC'.format(
-                           edyr, edjd, sta.network.upper(),
-                           sta.station.upper(),
-                           comp.upper())))
-        # Day 2 Alternate Nets (for CN/PO issues) Format 1
-        if len(lclfiles2) == 0:
-            lclfiles2 = []
-            for anet in sta.altnet:
-                lclfiles2.extend(
-                    list(
-                        filter(
-                            stdata,
-                            '*/{0:4s}.{1:3s}.{2:s}.{3:s}.*.' +
-                            '{4:2s}{5:1s}.SAC'.format(
-                                edyr, edjd, anet.upper(), sta.station.upper(),
-                                sta.channel.upper()[0:2], comp.upper()))))
-        # Day 2 Alternate Nets (for CN/PO issues) Format 2
-        if len(lclfiles2) == 0:
-            lclfiles2 = []
-            for anet in sta.altnet:
-                lclfiles2.extend(
-                    list(
-                        filter(
-                            stdata,
-                            '*/{0:4s}.{1:3s}.{2:s}.{3:s}.*.*{4:1s}.SAC'.format(
-                                edyr, edjd, anet.upper(), sta.station.upper(),
-                                comp.upper()))))
+        lclfiles1 = find_local_files(stdata, sta, styr, stjd, comp)
+        lclfiles2 = find_local_files(stdata, sta, edyr, edjd, comp)
 
         # If still no Local files stop
         if len(lclfiles1) == 0 and len(lclfiles2) == 0:
@@ -328,8 +378,10 @@ def parse_localdata_for_comp(comp='Z', stdata=[], sta=None,
                     if st1[0].stats.endtime >= \
                             st2[0].stats.starttime-st2[0].stats.delta:
                         # Check for NoData and convert to NaN
-                        st1nd = st1[0].stats.sac['user9']
-                        st2nd = st2[0].stats.sac['user9']
+                        st1nd = st1[0].stats.sac.get(
+                            'user9', -12345.0)
+                        st2nd = st2[0].stats.sac.get(
+                            'user9', -12345.0)
                         eddt1 = False
                         eddt2 = False
                         if (not st1nd == 0.0) and (not st1nd == -12345.0):
@@ -397,8 +449,115 @@ def parse_localdata_for_comp(comp='Z', stdata=[], sta=None,
     return erd, None
 
 
+def local_source(stdata, ndval=nan):
+    """
+    Returns the source of local data in the keys of the waveform cache
+    (see :meth:`~splitpy.cache.WaveformCache.key`), such that streams read
+    from other directories, with another backend or before files were
+    added are not returned from the cache.
+
+    Parameters
+    ----------
+    stdata : List, :class:`~splitpy.archive.LocalData` or local backend
+        Station list, or object with a ``parse_comp`` method
+    ndval : float or nan
+        Default value for missing data
+
+    Returns
+    -------
+    source : str
+        Source of local data
+
+    """
+
+    import os
+    import hashlib
+    from splitpy import archive
+
+    # Backends wrapping a list of files or an index
+    backends = []
+    while True:
+        backends.append(type(stdata).__name__)
+        if not hasattr(stdata, 'stdata'):
+            break
+        stdata = stdata.stdata
+
+    if isinstance(stdata, archive.SDSReader):
+        items = sorted([str(root) for root in stdata.roots])
+    elif isinstance(stdata, archive.LocalData):
+        dbfile = stdata.index.dbfile
+        items = [dbfile, str(os.path.getmtime(dbfile)), str(stdata.sta),
+                 str(stdata.nets)]
+    else:
+        items = sorted([str(file) for file in stdata])
+    digest = hashlib.sha1('\n'.join(items).encode('utf-8')).hexdigest()
+
+    return ':'.join(['local', str(ndval)] + backends + [digest])
+
+
+def get_waveforms(client=None, sta=None, loc='', channels='', start=None,
+                  end=None, cache=None):
+    """
+    Function to request waveforms from a client, checking first if the
+    request is already stored in a waveform cache
+
+    Parameters
+    ----------
+    client : :class:`~obspy.client.fdsn.Client`
+        Client object
+    sta : Dict
+        Station metadata from :mod:`~StDb` data base
+    loc : str
+        Location code
+    channels : str
+        Comma-separated list of channels
+    start : :class:`~obspy.core.utcdatetime.UTCDateTime`
+        Start time for request
+    end : :class:`~obspy.core.utcdatetime.UTCDateTime`
+        End time for request
+    cache : :class:`~splitpy.cache.WaveformCache`
+        Waveform cache (optional)
+
+    Returns
+    -------
+    st : :class:`~obspy.core.Stream`
+        Stream returned for the request (empty if no data are available),
+        or `None` if the request failed. Empty streams are not cached,
+        since the data may become available later.
+
+    """
+
+    from obspy import Stream
+    from obspy.clients.fdsn.header import FDSNNoDataException
+
+    key = None
+    if cache is not None:
+        key = cache.key(sta.network, sta.station, loc, channels, start, end,
+                        getattr(client, 'base_url', None))
+        st = cache.get(key)
+        if st is not None:
+            print("*              - From Cache")
+            return st
+
+    try:
+        st = client.get_waveforms(
+            network=sta.network, station=sta.station, location=loc,
+            channel=channels, starttime=start, endtime=end,
+            attach_response=False)
+    except FDSNNoDataException:
+        st = Stream()
+    except Exception:
+        return None
+
+    if key is not None and len(st) > 0:
+        cache.put(key, st)
+
+    return st
+
+
 def download_data(client=None, sta=None, start=None, end=None,
-                  stdata=[], ndval=nan, new_sr=0., verbose=False):
+                  stdata=[], ndval=nan, new_sr=0., verbose=False,
+                  cache=None):
     """
     Function to build a stream object for a seismogram in a given time window either
     by downloading data from the client object or alternatively first checking if the
@@ -418,10 +577,14 @@ def download_data(client=None, sta=None, start=None, end=None,
         Start time for request
     end : :class:`~obspy.core.utcdatetime.UTCDateTime`
         End time for request
-    stdata : List
-        Station list
+    stdata : List, :class:`~splitpy.archive.LocalData` or local backend
+        Station list, or object with a ``parse_comp`` method
+        (e.g., :class:`~splitpy.archive.DayFilePlanner`)
     ndval : float or nan
         Default value for missing data
+    cache : :class:`~splitpy.cache.WaveformCache`
+        Waveform cache, checked before the local data and the client
+        (optional)
 
     Returns
     -------
@@ -450,25 +613,43 @@ def download_data(client=None, sta=None, start=None, end=None,
     erd = True
 
     # Check if there is local data
-    if len(stdata) > 0:
+    if len(stdata) > 0 and cache is not None:
+        key = cache.key(sta.network, sta.station, '*',
+                        sta.channel.upper() + '[ZNE]', start, end,
+                        local_source(stdata, ndval))
+        st = cache.get(key)
+        if st is not None:
+            print("*          {0:2s}[ZNE] - From Cache".format(
+                sta.channel.upper()))
+            erd = False
+            # Day files planned for the window are not read
+            if hasattr(stdata, 'release'):
+                stdata.release(start, end)
+    if len(stdata) > 0 and erd:
+        # Local data backends provide their own parser
+        if hasattr(stdata, 'parse_comp'):
+            parse_comp = stdata.parse_comp
+        else:
+            def parse_comp(**kwargs):
+                return parse_localdata_for_comp(stdata=stdata, **kwargs)
+
         # Only a single day: Search for local data
         # Get Z localdata
-        errZ, stZ = parse_localdata_for_comp(
-            comp='Z', stdata=stdata, sta=sta, start=start, end=end,
-            ndval=ndval)
+        errZ, stZ = parse_comp(
+            comp='Z', sta=sta, start=start, end=end, ndval=ndval)
         # Get N localdata
-        errN, stN = parse_localdata_for_comp(
-            comp='N', stdata=stdata, sta=sta, start=start, end=end,
-            ndval=ndval)
+        errN, stN = parse_comp(
+            comp='N', sta=sta, start=start, end=end, ndval=ndval)
         # Get E localdata
-        errE, stE = parse_localdata_for_comp(
-            comp='E', stdata=stdata, sta=sta, start=start, end=end,
-            ndval=ndval)
+        errE, stE = parse_comp(
+            comp='E', sta=sta, start=start, end=end, ndval=ndval)
         # Retreived Succesfully?
         erd = errZ or errN or errE
         if not erd:
             # Combine Data
             st = stZ + stN + stE
+            if cache is not None:
+                cache.put(key, st)
 
     # No local data? Request using client
     if erd:
@@ -488,11 +669,9 @@ def download_data(client=None, sta=None, start=None, end=None,
             # Get waveforms, with extra 1 second to avoid
             # traces cropped too short - traces are trimmed later
             try:
-                st = client.get_waveforms(
-                    network=sta.network,
-                    station=sta.station, location=loc,
-                    channel=channelsZNE, starttime=start,
-                    endtime=end+1., attach_response=False)
+                st = get_waveforms(
+                    client=client, sta=sta, loc=loc, channels=channelsZNE,
+                    start=start, end=end+1., cache=cache)
                 if len(st) == 3:
                     print("*              - ZNE Data Downloaded")
 
@@ -506,11 +685,10 @@ def download_data(client=None, sta=None, start=None, end=None,
                             sta.station, sta.channel.upper(), tloc)
                     print(msg)
                     try:
-                        st = client.get_waveforms(
-                            network=sta.network,
-                            station=sta.station, location=loc,
-                            channel=channelsZ12, starttime=start,
-                            endtime=end+1., attach_response=False)
+                        st = get_waveforms(
+                            client=client, sta=sta, loc=loc,
+                            channels=channelsZ12, start=start, end=end+1.,
+                            cache=cache)
                         if len(st) == 3:
                             print("*              - Z12 Data Downloaded")
                         else:
@@ -582,3 +760,561 @@ def download_data(client=None, sta=None, start=None, end=None,
         else:
             print("* Waveforms Retrieved...")
             return False, st
+
+
+@lru_cache(maxsize=4096)
+def _rotation_matrix(align, baz, inc, azcorr):
+
+    if align == 'LQT':
+        # Same convention as obspy.signal.rotate.rotate_zne_lqt
+        ba = math.radians(baz)
+        ic = math.radians(inc)
+        M = np.array(
+            [[math.cos(ic), -math.sin(ic)*math.cos(ba),
+              -math.sin(ic)*math.sin(ba)],
+             [math.sin(ic), math.cos(ic)*math.cos(ba),
+              math.cos(ic)*math.sin(ba)],
+             [0., math.sin(ba), -math.cos(ba)]])
+    elif align == 'ZNE':
+        # Components 1 and 2 rotated by the azimuth of component 1
+        az = math.radians(azcorr)
+        M = np.array([[1., 0., 0.],
+                      [0., math.cos(az), -math.sin(az)],
+                      [0., math.sin(az), math.cos(az)]])
+    else:
+        raise ValueError("incorrect 'align' argument")
+
+    M.setflags(write=False)
+    return M
+
+
+def rotation_matrix(align, baz=0., inc=0., azcorr=0.):
+    """
+    Returns the 3x3 rotation matrix from ZNE to LQT components, or from
+    Z12 to ZNE components. Matrices are cached and read-only.
+
+    Parameters
+    ----------
+    align : str
+        Alignment of coordinate system after rotation ('LQT' or 'ZNE')
+    baz : float
+        Back-azimuth (degrees) - for 'LQT'
+    inc : float
+        Incidence angle (degrees) - for 'LQT'
+    azcorr : float
+        Azimuth of component 1 (degrees) - for 'ZNE'
+
+    Returns
+    -------
+    M : :class:`~numpy.ndarray`
+        Rotation matrix, to be applied to a (3, npts) array of ZNE (or
+        Z12) components
+
+    """
+
+    return _rotation_matrix(align, float(baz), float(inc), float(azcorr))
+
+
+def rotate_array(data, M, out=None, block=65536):
+    """
+    Applies a rotation matrix to a (3, npts) array of components
+
+    Parameters
+    ----------
+    data : :class:`~numpy.ndarray`
+        Array of components
+    M : :class:`~numpy.ndarray`
+        Rotation matrix
+    out : :class:`~numpy.ndarray`
+        Output array, which can be ``data`` itself for a rotation in
+        place. [Default allocates a new array]
+    block : int
+        Number of samples rotated at a time in place
+
+    Returns
+    -------
+    out : :class:`~numpy.ndarray`
+        Rotated components
+
+    """
+
+    if out is None:
+        return np.matmul(M, data)
+    if np.shares_memory(out, data):
+        # Rotate in blocks to only use a small buffer
+        for i in range(0, data.shape[-1], block):
+            out[:, i:i+block] = np.matmul(M, data[:, i:i+block])
+        return out
+    return np.matmul(M, data, out=out)
+
+
+def rotate_batch(data, M, out=None):
+    """
+    Rotates the components of many events in a single matrix product
+
+    Parameters
+    ----------
+    data : :class:`~numpy.ndarray`
+        Components with shape (number of events, 3, npts)
+    M : :class:`~numpy.ndarray`
+        Rotation matrices with shape (number of events, 3, 3), e.g.,
+        stacked from :func:`~splitpy.utils.rotation_matrix`
+    out : :class:`~numpy.ndarray`
+        Output array. [Default allocates a new array]
+
+    Returns
+    -------
+    out : :class:`~numpy.ndarray`
+        Rotated components
+
+    """
+
+    if out is not None and np.shares_memory(out, data):
+        out[...] = np.matmul(M, data)
+        return out
+    return np.matmul(M, data, out=out)
+
+
+def stream_to_array(stream, comps):
+    """
+    Copies the data of the components of a stream into a contiguous
+    (ncomp, npts) array
+
+    Parameters
+    ----------
+    stream : :class:`~obspy.core.Stream`
+        Stream with the components
+    comps : str
+        Components in order (e.g., 'ZNE')
+
+    Returns
+    -------
+    traces : List
+        List of :class:`~obspy.core.Trace` objects in order
+    data : :class:`~numpy.ndarray`
+        Array of components
+
+    """
+
+    traces = [stream.select(component=comp)[0] for comp in comps]
+    npts = set(tr.stats.npts for tr in traces)
+    if len(npts) > 1:
+        raise ValueError("Components have different lengths")
+    data = np.empty((len(comps), npts.pop()))
+    for i, tr in enumerate(traces):
+        data[i] = tr.data
+
+    return traces, data
+
+
+# Tolerance of fused preprocessing with respect to the separate ObsPy
+# steps: maximum absolute difference over the central half of the traces,
+# relative to the maximum absolute amplitude
+FUSED_TOL = 0.01
+
+
+@lru_cache(maxsize=64)
+def _taper(npts, sr, max_percentage, max_length):
+
+    from obspy import Trace
+
+    taper = Trace(data=np.ones(npts), header={'sampling_rate': sr}).taper(
+        max_percentage=max_percentage, max_length=max_length).data
+    taper.setflags(write=False)
+    return taper
+
+
+@lru_cache(maxsize=64)
+def _fused_response(sr, new_sr, nfft, nfreq, fmin, fmax):
+
+    from scipy.signal import iirfilter, cheb2ord, cheby2, sosfreqz
+
+    f = np.arange(nfreq)*sr/nfft
+
+    if new_sr >= sr:
+        # No resampling
+        H = np.ones(nfreq, dtype=complex)
+    else:
+        # Zero-phase Butterworth lowpass at the new Nyquist frequency
+        sos = iirfilter(2, new_sr/sr, btype='lowpass', ftype='butter',
+                        output='sos')
+        H = np.abs(sosfreqz(sos, worN=f, fs=sr)[1])**2
+
+        # Chebyshev anti-alias filter, designed as in ObsPy's resample
+        ws = new_sr/sr
+        wp = new_sr/sr
+        order = 1e99
+        while order > 12:
+            wp = wp*0.99
+            order, wn = cheb2ord(wp, ws, 1, 96, analog=0)
+        sos = cheby2(order, 96, wn, btype='low', analog=0, output='sos')
+        H = H*sosfreqz(sos, worN=f, fs=sr)[1]
+
+        # Hann window of ObsPy's frequency-domain resampling
+        H = H*0.5*(1. + np.cos(2.*np.pi*f/sr))
+
+    # Causal Butterworth bandpass at the new sampling rate
+    Hbp = None
+    if fmin is not None and fmax is not None:
+        sos = iirfilter(4, [fmin/(0.5*new_sr), fmax/(0.5*new_sr)],
+                        btype='band', ftype='butter', output='sos')
+        Hbp = H*sosfreqz(sos, worN=f, fs=new_sr)[1]
+        Hbp.setflags(write=False)
+
+    H.setflags(write=False)
+    return H, Hbp
+
+
+def fused_preprocess(data, sr, new_sr, fmin=None, fmax=None, M=None,
+                     detrend=True, max_percentage=0.05, max_length=5.):
+    """
+    Preprocesses the three components of a seismogram in a single
+    frequency-domain pass. This is equivalent (to within
+    :data:`~splitpy.utils.FUSED_TOL`, away from the ends of the traces)
+    to the following sequence of ObsPy operations on each component:
+    linear detrend and Hann taper, zero-phase Butterworth lowpass
+    filter (2 corners) at the new Nyquist frequency, resampling to the
+    new sampling rate (with the Chebyshev anti-alias filter), rotation
+    and Butterworth bandpass filter (4 corners). The traces are padded
+    with zeros to avoid wrap-around of the filter responses. Data
+    sampled at or below the new sampling rate are not resampled, and
+    are only detrended, tapered and bandpass filtered.
+
+    Parameters
+    ----------
+    data : :class:`~numpy.ndarray`
+        Components with shape (3, npts)
+    sr : float
+        Sampling rate of data (Hz)
+    new_sr : float
+        New sampling rate (Hz), or the sampling rate of the data if
+        lower
+    fmin : float
+        Minimum frequency corner for bandpass filter (Hz)
+    fmax : float
+        Maximum frequency corner for bandpass filter (Hz)
+    M : :class:`~numpy.ndarray`
+        Rotation matrix applied to the bandpass filtered components (see
+        :func:`~splitpy.utils.rotation_matrix`)
+    detrend : bool
+        Whether to detrend and taper the data (e.g., `False` for data
+        already detrended and tapered before trimming, as done by
+        :func:`~splitpy.utils.download_data`)
+    max_percentage : float
+        Maximum length of taper as fraction of the trace length
+    max_length : float
+        Maximum length of taper (sec)
+
+    Returns
+    -------
+    out : :class:`~numpy.ndarray`
+        Lowpass filtered and resampled components, with shape (3, nout)
+    outbp : :class:`~numpy.ndarray`
+        Bandpass filtered (and rotated) components, or `None` if the
+        frequency corners are not given
+
+    """
+
+    from fractions import Fraction
+    from scipy.fft import rfft, irfft, next_fast_len
+    from scipy.signal import detrend as sp_detrend
+
+    new_sr = min(new_sr, sr)
+
+    data = np.asarray(data, dtype=float)
+    npts = data.shape[-1]
+    if detrend:
+        data = sp_detrend(data, axis=-1, type='linear')
+        data *= _taper(npts, float(sr), max_percentage, max_length)
+
+    # Length of transform: at least twice the length of the data and a
+    # multiple of the resampling factor p/q
+    factor = Fraction(sr/new_sr).limit_denominator(1000)
+    p, q = factor.numerator, factor.denominator
+    nfft = p*next_fast_len(-(-2*npts//p))
+    nout = nfft*q//p
+    num = int(npts/float(factor))
+    nfreq = nout//2 + 1
+
+    H, Hbp = _fused_response(float(sr), float(new_sr), nfft, nfreq,
+                             fmin, fmax)
+    spec = rfft(data, n=nfft, axis=-1)[:, :nfreq]
+    if Hbp is None:
+        spec = spec*H
+    else:
+        spec = np.concatenate((spec*H, spec*Hbp))
+    res = irfft(spec, n=nout, axis=-1)[:, :num]*(float(nout)/nfft)
+
+    out = np.ascontiguousarray(res[:3])
+    outbp = None
+    if Hbp is not None:
+        outbp = np.ascontiguousarray(res[3:])
+        if M is not None:
+            rotate_array(outbp, M, out=outbp)
+
+    return out, outbp
+
+
+@lru_cache(maxsize=64)
+def _bandpass_response(sr, nfft, fmin, fmax):
+
+    from scipy.signal import iirfilter, sosfreqz
+
+    # Causal Butterworth bandpass (4 corners), as in ObsPy's bandpass
+    f = np.arange(nfft//2 + 1)*sr/nfft
+    sos = iirfilter(4, [fmin/(0.5*sr), fmax/(0.5*sr)], btype='band',
+                    ftype='butter', output='sos')
+    H = sosfreqz(sos, worN=f, fs=sr)[1]
+    H.setflags(write=False)
+    return H
+
+
+def bandpass_sweep(data, sr, bands):
+    """
+    Filters components in several frequency bands from a single
+    spectrum, where each band is applied as the frequency response of
+    the Butterworth bandpass filter (4 corners) of
+    :meth:`~obspy.core.trace.Trace.filter`. The traces are padded with
+    zeros to avoid wrap-around of the filter responses, such that the
+    result is equivalent to filtering copies of the traces with ObsPy.
+
+    Parameters
+    ----------
+    data : :class:`~numpy.ndarray`
+        Components with shape (..., npts)
+    sr : float
+        Sampling rate of data (Hz)
+    bands : List
+        Minimum and maximum frequency corners (Hz) of each band
+
+    Returns
+    -------
+    out : :class:`~numpy.ndarray`
+        Filtered components, with shape (nband, ..., npts)
+
+    """
+
+    from scipy.fft import rfft, irfft, next_fast_len
+
+    bands = np.asarray(bands, dtype=float).reshape(-1, 2)
+    if np.any(bands[:, 0] <= 0.) or np.any(bands[:, 1] >= 0.5*sr) or \
+            np.any(bands[:, 0] >= bands[:, 1]):
+        raise ValueError("Frequency bands must be within 0 and the " +
+                         "Nyquist frequency")
+
+    data = np.asarray(data, dtype=float)
+    npts = data.shape[-1]
+    nfft = next_fast_len(4*npts)
+    spec = rfft(data, n=nfft, axis=-1)
+    out = np.empty((len(bands),) + data.shape)
+    for i, (fmin, fmax) in enumerate(bands):
+        H = _bandpass_response(float(sr), nfft, fmin, fmax)
+        out[i] = irfft(spec*H, n=nfft, axis=-1)[..., :npts]
+
+    return out
+
+
+def prescreen_snr(stream, t1, baz, dt=30., new_sr=5., azcorr=0.):
+    """
+    Cheap estimate of the signal-to-noise ratio on the radial component,
+    calculated on the raw data before any preprocessing. The horizontal
+    components are projected onto the radial direction, decimated to
+    about ``new_sr`` by averaging over blocks of samples and linearly
+    detrended over the noise and signal windows ``[t1 - dt, t1]`` and
+    ``[t1, t1 + dt]``. This is a rough approximation of
+    :meth:`~splitpy.classes.Split.calc_snr`, meant to reject events
+    that clearly lack signal.
+
+    Parameters
+    ----------
+    stream : :class:`~obspy.core.Stream`
+        Raw seismograms with components N and E, or 1 and 2
+    t1 : :class:`~obspy.core.utcdatetime.UTCDateTime`
+        Predicted arrival time
+    baz : float
+        Back-azimuth (degrees)
+    dt : float
+        Duration of signal and noise windows (sec)
+    new_sr : float
+        Sampling rate after decimation (Hz)
+    azcorr : float
+        Azimuth of component 1 (degrees)
+
+    Returns
+    -------
+    snr : float
+        Signal-to-noise ratio (dB), or NaN if the horizontal components
+        do not cover both windows
+
+    """
+
+    from scipy.signal import detrend as sp_detrend
+
+    for comps, az in [('NE', 0.), ('12', azcorr)]:
+        trs = [stream.select(component=comp) for comp in comps]
+        if all(len(st) > 0 for st in trs):
+            break
+    else:
+        return nan
+
+    sr = trs[0][0].stats.sampling_rate
+    factor = max(int(sr//new_sr), 1)
+    nwin = int(round(dt*sr))//factor*factor
+    if nwin == 0:
+        return nan
+
+    # Noise and signal windows of both horizontal components
+    h = np.empty((2, 2*nwin))
+    for i, st in enumerate(trs):
+        tr = st[0]
+        if tr.stats.sampling_rate != sr:
+            return nan
+        i0 = int(round((t1 - dt - tr.stats.starttime)*sr))
+        if i0 < 0 or i0 + 2*nwin > tr.stats.npts:
+            return nan
+        h[i] = tr.data[i0:i0 + 2*nwin]
+
+    # Radial component, decimated and detrended in each window
+    a = math.radians(baz - az)
+    r = math.cos(a)*h[0] + math.sin(a)*h[1]
+    r = sp_detrend(r.reshape(2, -1, factor).mean(axis=-1), axis=-1,
+                   type='linear')
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return float(10.*np.log10(np.sum(r[1]**2)/np.sum(r[0]**2)))
+
+
+def trim_indices(stats, starttime, endtime):
+    """
+    Returns the index range of the samples kept by
+    :meth:`~obspy.core.trace.Trace.trim` (with ``nearest_sample=True``
+    and without padding), without copying or modifying the trace
+
+    Parameters
+    ----------
+    stats : :class:`~obspy.core.trace.Stats`
+        Header of trace
+    starttime : :class:`~obspy.core.utcdatetime.UTCDateTime`
+        Start time of window
+    endtime : :class:`~obspy.core.utcdatetime.UTCDateTime`
+        End time of window
+
+    Returns
+    -------
+    i1, i2 : int
+        Samples ``data[i1:i2]`` are kept
+
+    """
+
+    from obspy.core.compatibility import round_away
+
+    sr = stats.sampling_rate
+    npts = stats.npts
+    start = stats.starttime
+
+    # Left side
+    if starttime > stats.endtime:
+        return npts, npts
+    i1 = max(int(round_away((starttime - start)*sr)), 0)
+    if i1 > 0:
+        start += i1*stats.delta
+
+    # Right side, relative to the new start time
+    delta = int(round_away((endtime - start)*sr)) - (npts - i1) + 1
+    if delta >= 0:
+        return i1, npts
+    if endtime < start:
+        return i1, i1
+    if endtime == start:
+        return i1, i1 + 1
+    return i1, max(npts + delta, i1)
+
+
+def _detrend_taper(data, max_percentage):
+
+    # Simple detrend and Hann taper, as in ObsPy, on the last axis
+    x = np.array(data, dtype=float)
+    npts = x.shape[-1]
+    x1 = x[..., :1]
+    x2 = x[..., -1:]
+    x -= x1 + np.arange(npts)*(x2 - x1)/float(npts - 1)
+    x *= _taper(npts, 1., max_percentage, None)
+    return x
+
+
+def _snr_db(x, sig, nze):
+
+    srms = np.sqrt(np.mean(np.square(x[..., sig[0]:sig[1]]), axis=-1))
+    nrms = np.sqrt(np.mean(np.square(x[..., nze[0]:nze[1]]), axis=-1))
+    return 10*np.log10(srms*srms/nrms/nrms)
+
+
+def calc_snr(data, sig, nze, max_percentage=0.05):
+    """
+    Calculates the signal-to-noise ratio of several components from
+    index ranges on a single array. The components are detrended (line
+    through first and last samples) and tapered once, such that the
+    result is identical to detrending, tapering and trimming copies of
+    the traces with ObsPy, as in
+    :meth:`~splitpy.classes.Split.calc_snr`.
+
+    Parameters
+    ----------
+    data : :class:`~numpy.ndarray`
+        Components with shape (..., npts)
+    sig : tuple
+        Index range of signal window (see
+        :func:`~splitpy.utils.trim_indices`)
+    nze : tuple
+        Index range of noise window
+    max_percentage : float
+        Maximum length of taper as fraction of the trace length
+
+    Returns
+    -------
+    snr : :class:`~numpy.ndarray`
+        Signal-to-noise ratio (dB) of each component, with shape
+        ``data.shape[:-1]``
+
+    """
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return _snr_db(_detrend_taper(data, max_percentage), sig, nze)
+
+
+def calc_snr_batch(data, sig, nze, max_percentage=0.05):
+    """
+    Calculates the signal-to-noise ratio of the components of many
+    events (see :func:`~splitpy.utils.calc_snr`). Events that share the
+    same signal and noise windows are processed together.
+
+    Parameters
+    ----------
+    data : :class:`~numpy.ndarray`
+        Components with shape (nevent, ncomp, npts)
+    sig : :class:`~numpy.ndarray`
+        Index ranges of signal windows, with shape (nevent, 2)
+    nze : :class:`~numpy.ndarray`
+        Index ranges of noise windows, with shape (nevent, 2)
+    max_percentage : float
+        Maximum length of taper as fraction of the trace length
+
+    Returns
+    -------
+    snr : :class:`~numpy.ndarray`
+        Signal-to-noise ratio (dB), with shape (nevent, ncomp)
+
+    """
+
+    x = _detrend_taper(data, max_percentage)
+    windows = np.hstack([np.asarray(sig, dtype=int).reshape(-1, 2),
+                         np.asarray(nze, dtype=int).reshape(-1, 2)])
+    snr = np.empty(x.shape[:-1])
+    uniq, inverse = np.unique(windows, axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for i, win in enumerate(uniq):
+            sel = np.flatnonzero(inverse == i)
+            snr[sel] = _snr_db(x[sel], win[:2], win[2:])
+
+    return snr
@@ -0,0 +1,480 @@
+# Copyright 2019 Pascal Audet & Andrew Schaeffer
+#
+# This file is part of SplitPy.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+
+Module containing a work queue in a shared directory, used to distribute
+the processing of stations (or of time ranges of stations) across
+processes and nodes without a broker.
+
+A :class:`~splitpy.workqueue.WorkQueue` directory contains:
+
+- ``tasks/``: one JSON file per task, with the task description and the
+  names of the tasks that must be completed first;
+- ``claims/<task>/``: lease files of the task, numbered by generation;
+- ``done/``: one file per completed task (with the generation of the
+  lease and the error message if the task failed);
+- ``stop``: if present, processes stop claiming tasks.
+
+A task is claimed by creating the lease file of the next generation with
+``O_CREAT | O_EXCL``, which succeeds for a single process. The owner
+renews the lease by updating the modification time of its file (see
+:class:`~splitpy.workqueue.Lease`). A lease that is not renewed within
+the lease duration (e.g., after a node failure) expires, and the task can
+be claimed again with the next generation; the previous owner then finds
+that it lost the lease. Lease files are never removed while the task is
+pending, which keeps claims free of races on any POSIX file system that
+supports exclusive creation (including NFS v3 and later). Completion
+records are also created exclusively, and removed again if the lease
+was reclaimed in the meantime, such that a task is completed by a single
+lease.
+
+Note that expiry is determined from the modification times set by the
+file system, so the clocks of the nodes should agree to well within the
+lease duration.
+
+"""
+
+# -*- coding: utf-8 -*-
+import os
+import json
+import time
+import socket
+import threading
+from pathlib import Path
+
+
+def _write_atomic(path, data):
+
+    # Write to a temporary file and rename it
+    tmp = str(path) + '.{0}.{1}.tmp'.format(
+        socket.gethostname(), os.getpid())
+    with open(tmp, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _write_exclusive(path, data):
+
+    # Write to a temporary file and link it, which fails if the file
+    # exists (exclusive creation, including on NFS)
+    tmp = str(path) + '.{0}.{1}.tmp'.format(
+        socket.gethostname(), os.getpid())
+    with open(tmp, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    try:
+        os.link(tmp, path)
+    except FileExistsError:
+        return False
+    finally:
+        os.remove(tmp)
+    return True
+
+
+class Lease(object):
+    """
+    A Lease object holds the claim of a process on a task of a
+    :class:`~splitpy.workqueue.WorkQueue`. Used as a context manager, the
+    lease is renewed in a background thread until the block exits.
+
+    Attributes
+    ----------
+    queue : :class:`~splitpy.workqueue.WorkQueue`
+        Work queue
+    name : str
+        Name of task
+    task : Dict
+        Task description
+    generation : int
+        Generation of the lease
+
+    """
+
+    def __init__(self, queue, name, task, generation):
+
+        self.queue = queue
+        self.name = name
+        self.task = task
+        self.generation = generation
+        self.path = queue._claim_path(name, generation)
+        self._stop = None
+        self._thread = None
+
+    def valid(self):
+        """
+        Returns whether the lease is still held, i.e., it was not reclaimed
+        by another process after expiring
+
+        """
+
+        return self.queue._generation(self.name) == self.generation
+
+    def renew(self):
+        """
+        Renews the lease
+
+        Returns
+        -------
+        valid : bool
+            Whether the lease is still held
+
+        """
+
+        if not self.valid():
+            return False
+        os.utime(self.path)
+        return True
+
+    def _heartbeat(self):
+
+        while not self._stop.wait(self.queue.lease/3.):
+            if not self.renew():
+                break
+
+    def __enter__(self):
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._heartbeat, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+
+        self._stop.set()
+        self._thread.join()
+
+
+class WorkQueue(object):
+    """
+    A WorkQueue object contains tasks in a shared directory, which are
+    claimed with leases by any number of processes.
+
+    Attributes
+    ----------
+    path : :class:`~pathlib.Path`
+        Queue directory
+    lease : float
+        Duration of leases (sec)
+    owner : str
+        Identifier of the process (host name and process ID)
+
+    """
+
+    def __init__(self, path, lease=600.):
+
+        self.path = Path(path)
+        self.lease = lease
+        self.owner = '{0}:{1}'.format(socket.gethostname(), os.getpid())
+        for sub in ['tasks', 'claims', 'done']:
+            (self.path / sub).mkdir(parents=True, exist_ok=True)
+
+    def _claim_path(self, name, generation):
+
+        return self.path / 'claims' / name / '{0:06d}'.format(generation)
+
+    def _generation(self, name):
+
+        try:
+            gens = [int(x) for x in os.listdir(self.path / 'claims' / name)
+                    if x.isdigit()]
+        except FileNotFoundError:
+            return None
+        return max(gens) if len(gens) > 0 else None
+
+    def add(self, name, task, after=[]):
+        """
+        Adds a task, unless a task with the same name exists (such that
+        all processes can add the same tasks)
+
+        Parameters
+        ----------
+        name : str
+            Name of task (used as file name)
+        task : Dict
+            Task description (JSON serializable)
+        after : List
+            Names of tasks that must be completed first
+
+        Returns
+        -------
+        added : bool
+            Whether the task was added
+
+        """
+
+        file = self.path / 'tasks' / (name + '.json')
+        if file.exists():
+            return False
+        _write_atomic(file, json.dumps(
+            {'task': task, 'after': list(after)}).encode('utf-8'))
+        return True
+
+    def tasks(self):
+        """
+        Returns the sorted list of task names
+
+        """
+
+        return sorted(x[:-5] for x in os.listdir(self.path / 'tasks')
+                      if x.endswith('.json'))
+
+    def get(self, name):
+        """
+        Returns the description of a task and its prerequisites
+
+        """
+
+        with open(self.path / 'tasks' / (name + '.json')) as f:
+            return json.load(f)
+
+    def done(self, name):
+        """
+        Returns whether a task is completed
+
+        """
+
+        return (self.path / 'done' / name).exists()
+
+    def result(self, name):
+        """
+        Returns the completion record of a task (with the owner and the
+        generation of the lease that completed it), or `None`
+
+        """
+
+        try:
+            with open(self.path / 'done' / name) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def pending(self):
+        """
+        Returns the names of tasks that are not completed
+
+        """
+
+        done = set(os.listdir(self.path / 'done'))
+        return [name for name in self.tasks() if name not in done]
+
+    def claim(self):
+        """
+        Claims the first pending task whose prerequisites are completed and
+        that is either unclaimed or has an expired lease
+
+        Returns
+        -------
+        lease : :class:`~splitpy.workqueue.Lease`
+            Lease on the task, or `None` if no task can be claimed
+
+        """
+
+        done = set(os.listdir(self.path / 'done'))
+        for name in self.tasks():
+            if name in done:
+                continue
+            spec = self.get(name)
+            if not all(dep in done for dep in spec['after']):
+                continue
+
+            gen = self._generation(name)
+            if gen is not None:
+                try:
+                    mtime = os.stat(self._claim_path(name, gen)).st_mtime
+                except FileNotFoundError:
+                    continue
+                if time.time() - mtime < self.lease:
+                    continue
+                gen += 1
+            else:
+                gen = 0
+
+            # Exclusive creation of the lease file
+            path = self._claim_path(name, gen)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+                             0o644)
+            except FileExistsError:
+                continue
+            try:
+                os.write(fd, self.owner.encode('utf-8'))
+            finally:
+                os.close(fd)
+
+            return Lease(self, name, spec['task'], gen)
+
+        return None
+
+    def complete(self, lease, error=None):
+        """
+        Marks the task of a lease as completed
+
+        Parameters
+        ----------
+        lease : :class:`~splitpy.workqueue.Lease`
+            Lease on the task
+        error : str
+            Error message, if the task failed (it is not tried again)
+
+        Returns
+        -------
+        success : bool
+            Whether the lease was still held. Otherwise, the task was
+            reclaimed by another process, which will complete it.
+
+        """
+
+        if not lease.valid():
+            return False
+        file = self.path / 'done' / lease.name
+        if not _write_exclusive(file, json.dumps(
+                {'owner': self.owner, 'generation': lease.generation,
+                 'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                 'error': error}).encode('utf-8')):
+            return False
+
+        # The lease may have expired and been reclaimed before the record
+        # was written
+        if not lease.valid():
+            os.remove(file)
+            return False
+        return True
+
+    def run(self, func, poll=10., verbose=False, forever=False):
+        """
+        Claims and processes tasks until all tasks are completed. When no
+        task can be claimed while others are pending (e.g., claimed by other
+        processes), waits and tries again, such that expired leases are
+        eventually reclaimed. With ``forever``, the queue is polled for new
+        tasks indefinitely (e.g., as a spool directory for a daemon), and a
+        task that raises an exception is completed with the error instead
+        of stopping the process. In both cases, processes stop claiming
+        tasks when a file named ``stop`` is created in the queue directory.
+
+        Parameters
+        ----------
+        func : callable
+            Function called with the :class:`~splitpy.workqueue.Lease` of
+            each task. Outputs should be written to locations specific to
+            the lease (e.g., named after the task and the generation), since
+            the previous owner of an expired lease may still be running.
+        poll : float
+            Time between attempts to claim a task (sec)
+        verbose : bool
+            Whether to print the tasks claimed
+        forever : bool
+            Whether to keep polling for tasks
+
+        Returns
+        -------
+        ndone : int
+            Number of tasks completed by this process
+
+        """
+
+        ndone = 0
+        while not (self.path / 'stop').exists():
+            lease = self.claim()
+            if lease is None:
+                if not forever and len(self.pending()) == 0:
+                    break
+                time.sleep(poll)
+                continue
+
+            if verbose:
+                print("* Claimed task {0} (lease {1:d})".format(
+                    lease.name, lease.generation))
+            error = None
+            with lease:
+                if forever:
+                    try:
+                        func(lease)
+                    except Exception as exc:
+                        error = repr(exc)
+                        print("* Task {0} failed: {1}".format(
+                            lease.name, error))
+                else:
+                    func(lease)
+            if self.complete(lease, error=error):
+                ndone += 1
+            elif verbose:
+                print("* Lost lease on task " + lease.name)
+
+        return ndone
+
+
+def submit_job(path, station, start=None, end=None, args={}):
+    """
+    Submits a processing job for a station to a work queue (e.g., the
+    spool directory of a daemon, see ``split_calc_auto.py --daemon``).
+    The job is added as a task, followed by a task that merges its output
+    into the station directory. Merges of the jobs of a station are
+    carried out in order of submission.
+
+    Parameters
+    ----------
+    path : str or :class:`~pathlib.Path`
+        Queue directory
+    station : str
+        Station key
+    start : :class:`~obspy.core.UTCDateTime`
+        Start time of catalogue search (default start of station)
+    end : :class:`~obspy.core.UTCDateTime`
+        End time of catalogue search (default end of station)
+    args : Dict
+        Processing parameters that override those of the daemon, as
+        attributes of the arguments of ``split_calc_auto.py`` (e.g.,
+        ``{'msnr': 8.}``)
+
+    Returns
+    -------
+    name : str
+        Name of the task of the job
+
+    """
+
+    wq = WorkQueue(path)
+    name = '{0}_{1}_{2:d}'.format(
+        station, time.strftime('%Y%m%dT%H%M%S'), os.getpid())
+    n = 0
+    while (wq.path / 'tasks' / (name + '.json')).exists():
+        n += 1
+        name = '{0}_{1}_{2:d}.{3:d}'.format(
+            station, time.strftime('%Y%m%dT%H%M%S'), os.getpid(), n)
+
+    # Merge after the pending merges of the station
+    after = [name] + [x for x in wq.pending()
+                      if x.endswith('_merge') and
+                      wq.get(x)['task'].get('station') == station]
+
+    wq.add(name, {'station': station,
+                  'start': None if start is None else str(start),
+                  'end': None if end is None else str(end),
+                  'args': dict(args)})
+    wq.add(name + '_merge', {'station': station, 'merge': [name]},
+           after=after)
+
+    return name